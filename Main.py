@@ -5,6 +5,7 @@ import streamlit as st
 st.set_page_config(layout="wide")
 
 import hnsw
+from hnsw_instrumentation import Recorder
 from iris_integration import (
     # Generate test templates.
     DIM,
@@ -54,13 +55,16 @@ with st.sidebar:
 
     @st.cache_resource
     def make_db():
-        return hnsw.HNSW(
+        db = hnsw.HNSW(
             M=M,
             efConstruction=efConstruction,
             m_L=m_L,
             distance_func=distance,
             query_to_vector_func=query_to_vector,
+            instrumentation=Recorder(),
         )
+        db.count_comparisons = True
+        return db
 
     @st.cache_resource
     def past_stats():
@@ -148,3 +152,7 @@ st.line_chart(
     x="db_size_during_insertions",
     y=["n_distances_per_insertion", "n_comparisons_per_insertion"],
 )
+
+"### ⏱️ Latency and Layer Stats"
+st.dataframe(pd.DataFrame(db.instrumentation.latency_records()))
+st.dataframe(pd.DataFrame(db.instrumentation.layer_records()))
@@ -0,0 +1,92 @@
+"""
+Search latency at high efSearch with the heap queues (after) and the bisect-sorted lists (before).
+
+    python benchmarks/bench_search_queues.py --db-size 5000 --ef 100 200 500
+
+The default vectors are random 1024-bit ints with `hnsw.int_distance`, so the cost of the
+queues is not hidden by the iris distance. Use `--iris` for `irisint` vectors.
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hnsw import HNSW
+from hnsw_list_queues import FurthestQueue, NearestQueue
+
+
+# The queues used before the heaps, and after.
+QUEUE_TYPES = {
+    "before (sorted lists)": (NearestQueue, FurthestQueue),
+    "after (heaps)": (HNSW.nearest_queue_type, HNSW.furthest_queue_type),
+}
+
+
+def make_queries(n: int, iris: bool) -> list:
+    rng = np.random.default_rng(0)
+    if iris:
+        from iris_integration import irisint_make_query, iris_random
+
+        np.random.seed(0)
+        return [irisint_make_query(iris_random()) for _ in range(n)]
+    return [int.from_bytes(rng.bytes(128), "big") for _ in range(n)]
+
+
+def make_db(queries: list, M: int, efConstruction: int, iris: bool) -> HNSW:
+    kwargs = {}
+    if iris:
+        from iris_integration import irisint_distance, irisint_query_to_vector
+
+        kwargs = dict(
+            distance_func=irisint_distance, query_to_vector_func=irisint_query_to_vector
+        )
+    np.random.seed(1)
+    db = HNSW(M=M, efConstruction=efConstruction, **kwargs)
+    for q in queries:
+        db.insert(q)
+    return db
+
+
+def time_searches(db: HNSW, queries: list, K: int, ef: int) -> tuple[float, float]:
+    "Return the mean search latency in milliseconds and distances per search."
+    db.reset_stats()
+    start = perf_counter()
+    for q in queries:
+        db.search(q, K, ef)
+    duration = perf_counter() - start
+    return (duration / len(queries) * 1e3, db.get_stats()["n_distances"] / len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db-size", type=int, default=5000)
+    parser.add_argument("--n-queries", type=int, default=200)
+    parser.add_argument("--M", type=int, default=32)
+    parser.add_argument("--efConstruction", type=int, default=64)
+    parser.add_argument("--ef", type=int, nargs="+", default=[100, 200, 500])
+    parser.add_argument("--K", type=int, default=10)
+    parser.add_argument("--iris", action="store_true")
+    args = parser.parse_args()
+
+    queries = make_queries(args.db_size, args.iris)
+    search_queries = queries[: args.n_queries]
+    db = make_db(queries, args.M, args.efConstruction, args.iris)
+
+    print(f"db_size={args.db_size} M={args.M} K={args.K} ms/search (distances/search):")
+    for ef in args.ef:
+        cells = []
+        for name, (nearest_queue_type, furthest_queue_type) in QUEUE_TYPES.items():
+            # Same graph, only the queues of the layer search differ.
+            db.nearest_queue_type = nearest_queue_type
+            db.furthest_queue_type = furthest_queue_type
+            ms, n_distances = time_searches(db, search_queries, args.K, ef)
+            cells.append(f"{name}: {ms:7.3f} ({n_distances:.0f})")
+        print(f"ef={ef:<5} " + "  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
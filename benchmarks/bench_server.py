@@ -0,0 +1,132 @@
+"""
+Throughput and latency of the asyncio HNSW service, with a load generator on one machine.
+
+    python benchmarks/bench_server.py --db-size 5000 --concurrency 1 8 32 --window-ms 0 2
+
+The server runs in its own process on a Unix socket. The default vectors are random
+1024-bit ints with `hnsw.int_distance`; use `--iris` for `irispacked` vectors.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+from time import sleep
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hnsw import HNSW
+from hnsw_server import HNSWClient, HNSWServer, run_load
+
+
+def make_queries(n: int, iris: bool) -> list:
+    rng = np.random.default_rng(0)
+    if iris:
+        from iris_integration import irispacked_make_queries, iris_random
+        from iris_integration import templates_to_arrays
+
+        np.random.seed(0)
+        return irispacked_make_queries(
+            *templates_to_arrays([iris_random() for _ in range(n)])
+        )
+    return [int.from_bytes(rng.bytes(128), "big") for _ in range(n)]
+
+
+def make_db(queries: list, M: int, efConstruction: int, iris: bool) -> HNSW:
+    kwargs = {}
+    if iris:
+        from iris_integration import (
+            irispacked_distance,
+            irispacked_query_to_vector,
+            irispacked_store,
+        )
+
+        store = irispacked_store()
+        kwargs = dict(
+            distance_func=irispacked_distance,
+            query_to_vector_func=irispacked_query_to_vector,
+            vector_store=store,
+            distance_batch_func=store.distance_batch,
+        )
+    np.random.seed(1)
+    db = HNSW(M=M, efConstruction=efConstruction, **kwargs)
+    for q in queries:
+        db.insert(q)
+    return db
+
+
+def serve(path: str, args: argparse.Namespace, window: float):
+    db = make_db(
+        make_queries(args.db_size, args.iris), args.M, args.efConstruction, args.iris
+    )
+
+    async def main():
+        server = HNSWServer(db, batch_window=window, max_batch=args.max_batch)
+        await server.start(path)
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def run_client(path: str, queries: list, args: argparse.Namespace) -> list:
+    client = await HNSWClient.connect(path)
+    rows = []
+    for concurrency in args.concurrency:
+        load = await run_load(
+            client,
+            queries,
+            args.n_requests,
+            concurrency,
+            K=args.K,
+            ef=args.ef,
+            insert_every=args.insert_every,
+        )
+        rows.append((concurrency, load, await client.metrics()))
+    await client.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db-size", type=int, default=5000)
+    parser.add_argument("--n-requests", type=int, default=1000)
+    parser.add_argument("--M", type=int, default=32)
+    parser.add_argument("--efConstruction", type=int, default=64)
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--K", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[0.0, 2.0])
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--insert-every", type=int, default=0)
+    parser.add_argument("--iris", action="store_true")
+    args = parser.parse_args()
+
+    queries = make_queries(args.db_size, args.iris)
+    print(f"db_size={args.db_size} M={args.M} K={args.K} ef={args.ef}")
+    for window_ms in args.window_ms:
+        path = os.path.join(tempfile.mkdtemp(), "hnsw.sock")
+        server = multiprocessing.Process(
+            target=serve, args=(path, args, window_ms / 1e3), daemon=True
+        )
+        server.start()
+        while not os.path.exists(path):
+            sleep(0.05)
+
+        rows = asyncio.run(run_client(path, queries, args))
+        server.terminate()
+        for concurrency, load, metrics in rows:
+            print(
+                f"window={window_ms:g}ms concurrency={concurrency:<3} "
+                f"{load['requests_per_sec']:8.1f} req/s  "
+                f"p50={load['p50_ms']:.2f}ms p95={load['p95_ms']:.2f}ms "
+                f"p99={load['p99_ms']:.2f}ms  "
+                f"mean_batch={metrics['mean_search_batch']:.1f} "
+                f"max_queue={metrics['max_search_queue_depth']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Micro-benchmarks of the hot paths: distances, query preparation, queues, insert, search.
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --quick --compare results.json
+
+All data is synthetic `iris_random` templates with fixed seeds, so two runs time the
+same work. The results are JSON records keyed by `case`. `n_distances` and `recall` are
+deterministic, so any change of them is reported. With --compare, the cases slower than
+the baseline by more than --threshold are listed, and the exit status is 1.
+"""
+import argparse
+from datetime import datetime, timezone
+import itertools
+import json
+from math import prod
+import os
+import platform
+import subprocess
+import sys
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hnsw import HNSW, FurthestHeap, NearestHeap
+import iris_integration as ii
+from hnsw_list_queues import FurthestQueue, NearestQueue
+
+# Queue implementations, as (nearest, furthest).
+QUEUE_TYPES = {
+    "heap": (NearestHeap, FurthestHeap),
+    "list": (NearestQueue, FurthestQueue),
+}
+
+# The deterministic metrics: compared exactly, not as timings.
+EXACT_METRICS = ("n_distances", "recall")
+
+
+def seed(n: int):
+    "iris_random and iris_with_noise use the global numpy generator."
+    np.random.seed(n)
+
+
+def templates(n: int, rng_seed: int) -> list:
+    seed(rng_seed)
+    return [ii.iris_random() for _ in range(n)]
+
+
+def noisy(tpls: list, noise_level: float, rng_seed: int) -> list:
+    seed(rng_seed)
+    return [ii.iris_with_noise(tpl, noise_level=noise_level) for tpl in tpls]
+
+
+# --- Timing ---
+
+
+def time_call(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """
+    Time func in `repeat` samples of enough calls to last min_time each, and return
+    the microseconds per call.
+    """
+    start = perf_counter()
+    func()
+    number = max(1, int(min_time / max(perf_counter() - start, 1e-9)))
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((perf_counter() - start) / number)
+    return summarize(samples) | {"calls_per_sample": number}
+
+
+def summarize(seconds: list[float]) -> dict:
+    us = np.array(seconds) * 1e6
+    return {
+        "samples": len(us),
+        "median_us": float(np.median(us)),
+        "min_us": float(us.min()),
+        "mean_us": float(us.mean()),
+        "p95_us": float(np.percentile(us, 95)),
+    }
+
+
+def cycling(func: Callable, args: list) -> Callable[[], object]:
+    "A call of func on the next args, in a cycle."
+    it = itertools.cycle(args)
+    return lambda: func(*next(it))
+
+
+# --- Cases ---
+
+
+def bench_distances(args) -> list[dict]:
+    tpls = templates(8, rng_seed=0)
+    pairs = list(zip(tpls, noisy(tpls, 0.3, rng_seed=1)))
+    store = ii.irispacked_store()
+    for tpl, _ in pairs:
+        store.append(ii.irispacked_query_to_vector(ii.irispacked_make_query(tpl)))
+
+    variants = {
+        # The reference variant is slow: few samples.
+        "iris": (ii.iris_make_query, ii.iris_query_to_vector, ii.iris_distance),
+        "irisnp": (ii.irisnp_make_query, ii.irisnp_query_to_vector, ii.irisnp_distance),
+        "irisint": (
+            ii.irisint_make_query,
+            ii.irisint_query_to_vector,
+            ii.irisint_distance,
+        ),
+        "irispacked": (
+            ii.irispacked_make_query,
+            ii.irispacked_query_to_vector,
+            ii.irispacked_distance,
+        ),
+    }
+    records = []
+    for name, (make_query, to_vector, distance) in variants.items():
+        queries = [make_query(q) for _, q in pairs]
+        vectors = [to_vector(make_query(tpl)) for tpl, _ in pairs]
+        calls = [(q, v) for q in queries for v in vectors]
+        repeat = 3 if name == "iris" else args.repeat
+        timing = time_call(cycling(distance, calls), repeat, args.min_time)
+        records.append({"case": f"distance/{name}", "group": "distance"} | timing)
+
+        timing = time_call(
+            cycling(make_query, [(q,) for _, q in pairs]), repeat, args.min_time
+        )
+        records.append({"case": f"make_query/{name}", "group": "make_query"} | timing)
+
+    # The whole store at once, per vector.
+    queries = [ii.irispacked_make_query(q) for _, q in pairs]
+    ids = list(range(len(store))) * 16
+    timing = time_call(
+        cycling(store.distance_batch, [(q, ids) for q in queries]),
+        args.repeat,
+        args.min_time,
+    )
+    for k in ("median_us", "min_us", "mean_us", "p95_us"):
+        timing[k] /= len(ids)
+    records.append({"case": "distance/irispacked_batch", "group": "distance"} | timing)
+
+    # Batched query preparation, per template.
+    tpl_list = [q for _, q in pairs]
+    for name, make_queries in (
+        ("irisint_batch", ii.irisint_make_queries),
+        ("irispacked_batch", ii.irispacked_make_queries),
+    ):
+        arrays = ii.templates_to_arrays(tpl_list)
+        timing = time_call(lambda: make_queries(*arrays), args.repeat, args.min_time)
+        for k in ("median_us", "min_us", "mean_us", "p95_us"):
+            timing[k] /= len(tpl_list)
+        records.append({"case": f"make_query/{name}", "group": "make_query"} | timing)
+    return records
+
+
+def bench_queues(args) -> list[dict]:
+    "The queue pattern of one layer search: fill W, then drain C and refill W."
+    rng = np.random.default_rng(2)
+    records = []
+    for ef in args.queue_sizes:
+        dists = rng.random(4 * ef).tolist()
+        items = list(zip(dists, range(len(dists))))
+
+        for name, (nearest_type, furthest_type) in QUEUE_TYPES.items():
+
+            def layer_search():
+                W = furthest_type()
+                for dist, e in items[:ef]:
+                    W.add(dist, e)
+                C = nearest_type.from_furthest_queue(W)
+                rest = iter(items[ef:])
+                while len(C) > 0:
+                    C.take_nearest()
+                    for dist, e in itertools.islice(rest, 3):
+                        if dist < W.get_furthest()[0]:
+                            W.take_furthest()
+                            W.add(dist, e)
+                            C.add(dist, e)
+                return W.get_k_nearest(10)
+
+            timing = time_call(layer_search, args.repeat, args.min_time)
+            records.append(
+                {"case": f"queue/{name} ef={ef}", "group": "queue", "ef": ef} | timing
+            )
+    return records
+
+
+def make_db(variant: str, M: int, efConstruction: int) -> tuple[HNSW, Callable]:
+    "An empty index of the variant, and its make_query."
+    if variant == "irisint":
+        db = HNSW(
+            M=M,
+            efConstruction=efConstruction,
+            distance_func=ii.irisint_distance,
+            query_to_vector_func=ii.irisint_query_to_vector,
+            vector_bits=prod(ii.DIM),
+        )
+        return db, ii.irisint_make_query
+    store = ii.irispacked_store()
+    db = HNSW(
+        M=M,
+        efConstruction=efConstruction,
+        distance_func=ii.irispacked_distance,
+        query_to_vector_func=ii.irispacked_query_to_vector,
+        vector_store=store,
+        distance_batch_func=store.distance_batch,
+    )
+    return db, ii.irispacked_make_query
+
+
+def bench_graph(args) -> list[dict]:
+    """
+    Grow one index per (M, efConstruction) through the db sizes. Time the inserts from
+    the previous size, then searches of noisy copies of stored templates at each ef.
+    """
+    records = []
+    sizes = sorted(args.db_sizes)
+    tpls = templates(sizes[-1], rng_seed=3)
+    for M, efConstruction in args.M_ef:
+        db, make_query = make_db(args.variant, M, efConstruction)
+        seed(4)  # The layers drawn by insert.
+        params = {
+            "variant": args.variant,
+            "M": M,
+            "efConstruction": efConstruction,
+        }
+        for size in sizes:
+            start_size = db.db_size()
+            queries = [make_query(tpl) for tpl in tpls[start_size:size]]
+            db.reset_stats()
+            seconds = []
+            for q in queries:
+                start = perf_counter()
+                db.insert(q)
+                seconds.append(perf_counter() - start)
+            n_distances = db.get_stats()["n_distances"] / len(queries)
+            case = f"insert/{args.variant} M={M} efC={efConstruction} size={size}"
+            records.append(
+                {"case": case, "group": "insert", **params, "db_size": size}
+                | summarize(seconds)
+                | {"n_distances": n_distances}
+            )
+
+            rng = np.random.default_rng(5)
+            targets = rng.choice(size, min(args.n_queries, size), replace=False)
+            search_tpls = noisy([tpls[i] for i in targets], 0.3, rng_seed=6)
+            search_queries = [make_query(tpl) for tpl in search_tpls]
+            ids = list(range(size))
+            truth = [
+                set(
+                    e
+                    for _d, e in sorted(zip(db._distance_batch(q, ids), ids))[: args.K]
+                )
+                for q in search_queries
+            ]
+            for ef in args.ef:
+                db.reset_stats()
+                seconds, hits = [], 0
+                for q, true_ids in zip(search_queries, truth):
+                    start = perf_counter()
+                    result = db.search(q, args.K, ef)
+                    seconds.append(perf_counter() - start)
+                    hits += len(true_ids & set(e for _d, e in result))
+                n_distances = db.get_stats()["n_distances"] / len(search_queries)
+                case = (
+                    f"search/{args.variant} M={M} efC={efConstruction} size={size} "
+                    f"ef={ef}"
+                )
+                records.append(
+                    {
+                        "case": case,
+                        "group": "search",
+                        **params,
+                        "db_size": size,
+                        "ef": ef,
+                        "K": args.K,
+                    }
+                    | summarize(seconds)
+                    | {
+                        "n_distances": n_distances,
+                        "recall": hits / (args.K * len(search_queries)),
+                    }
+                )
+    return records
+
+
+GROUPS = {
+    "distance": bench_distances,
+    "queue": bench_queues,
+    "graph": bench_graph,
+}
+
+
+# --- Results ---
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> int:
+    "Print the changes from the baseline, and return the number of regressions."
+    base = {r["case"]: r for r in baseline}
+    regressions = 0
+    print(f"\n{'case':60} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for r in results:
+        b = base.get(r["case"])
+        if b is None:
+            print(f"{r['case']:60} {'(new)':>10}")
+            continue
+        ratio = r["median_us"] / b["median_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  SLOWER"
+            regressions += 1
+        elif ratio < 1 / (1 + threshold):
+            flag = "  faster"
+        for k in EXACT_METRICS:
+            if k in r and k in b and r[k] != b[k]:
+                flag += f"  {k}: {b[k]:.4g} -> {r[k]:.4g}"
+        print(
+            f"{r['case']:60} {b['median_us']:10.1f} {r['median_us']:10.1f} "
+            f"{ratio:7.2f}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--groups", nargs="+", choices=list(GROUPS), default=list(GROUPS)
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A JSON file of results to compare to.")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes.")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--queue-sizes", type=int, nargs="+", default=[64, 512])
+    parser.add_argument(
+        "--variant", choices=["irispacked", "irisint"], default="irispacked"
+    )
+    parser.add_argument("--db-sizes", type=int, nargs="+", default=[1000, 4000])
+    parser.add_argument(
+        "--M-ef",
+        type=lambda s: tuple(map(int, s.split(","))),
+        nargs="+",
+        default=[(16, 64), (32, 128)],
+        help="M,efConstruction pairs.",
+    )
+    parser.add_argument("--ef", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--K", type=int, default=10)
+    parser.add_argument("--n-queries", type=int, default=100)
+    args = parser.parse_args()
+    if args.quick:
+        args.repeat, args.min_time = 3, 0.01
+        args.db_sizes, args.M_ef, args.n_queries = [200, 500], [(16, 64)], 30
+
+    results = []
+    for group in args.groups:
+        records = GROUPS[group](args)
+        for r in records:
+            print(f"{r['case']:60} {r['median_us']:12.1f} us")
+        results += records
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Baseline: {baseline['metadata']}")
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
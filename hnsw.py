@@ -1,8 +1,18 @@
-from typing import Callable, TypeVar, Generic, TypeAlias
+from typing import Callable, Iterable, Sequence, TypeVar, Generic, TypeAlias
 import numpy as np
-import bisect
-from threading import Lock
-from time import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager, ExitStack
+import heapq
+import json
+import math
+import os
+import shutil
+from threading import Lock, RLock
+from time import perf_counter, time
+
+from hnsw_instrumentation import Instrumentation
+from packed_vectors import PackedVectorStore, int_to_words, words_to_int
 
 
 def int_distance(x: int, y: int) -> int:
@@ -16,10 +26,305 @@ def identity(x):
 Query = TypeVar("Query")
 Vector = TypeVar("Vector")
 Index: TypeAlias = int
-Layer: TypeAlias = dict[Index, "FurthestQueue"]
+Layer: TypeAlias = "CompactLayer"
+
+
+def __getattr__(name: str):
+    # The pickles of the first indexes hold FurthestQueue links.
+    if name in ("FurthestQueue", "NearestQueue"):
+        import hnsw_list_queues
+
+        return getattr(hnsw_list_queues, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Heaps.
+
+
+class FurthestHeap:
+    "A max-heap, for fast pop of the furthest element. Stores (-distance, -id)."
+
+    __slots__ = ("_heap",)
+
+    def __init__(self, iterable=None):
+        self._heap = [(-dist, -to) for dist, to in iterable] if iterable else []
+        heapq.heapify(self._heap)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __iter__(self):
+        "Iterate over (distance, id) in heap order, not sorted."
+        return ((-neg_dist, -neg_to) for neg_dist, neg_to in self._heap)
+
+    def add(self, dist: float, to: Index):
+        heapq.heappush(self._heap, (-dist, -to))
+
+    def get_furthest(self) -> tuple[float, Index]:
+        neg_dist, neg_to = self._heap[0]
+        return (-neg_dist, -neg_to)
+
+    def take_furthest(self) -> tuple[float, Index]:
+        neg_dist, neg_to = heapq.heappop(self._heap)
+        return (-neg_dist, -neg_to)
+
+    def get_k_nearest(self, k) -> list[tuple[float, Index]]:
+        "Return the k nearest elements sorted in ascending order."
+        return [
+            (-neg_dist, -neg_to) for neg_dist, neg_to in heapq.nlargest(k, self._heap)
+        ]
+
+    def trim_to_k_nearest(self, k):
+        if len(self._heap) > k:
+            self._heap = heapq.nlargest(k, self._heap)
+            heapq.heapify(self._heap)
+
+    def discard(self, ids: set[Index]):
+        "Remove the elements whose id is in ids."
+        self._heap = [(d, neg_to) for d, neg_to in self._heap if -neg_to not in ids]
+        heapq.heapify(self._heap)
+
+
+class NearestHeap:
+    "A min-heap, for fast pop of the nearest element."
+
+    __slots__ = ("_heap",)
+
+    def __init__(self, iterable=None):
+        self._heap = list(iterable) if iterable else []
+        heapq.heapify(self._heap)
+
+    @staticmethod
+    def from_furthest_queue(furthest_queue: FurthestHeap) -> "NearestHeap":
+        return NearestHeap(furthest_queue)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def add(self, dist: float, to: Index):
+        heapq.heappush(self._heap, (dist, to))
+
+    def get_nearest(self) -> tuple[float, Index]:
+        return self._heap[0]
+
+    def take_nearest(self) -> tuple[float, Index]:
+        return heapq.heappop(self._heap)
+
+
+# Compact layers.
+
+
+class CompactLayer(Mapping[Index, list[tuple[float, Index]]]):
+    """
+    The links of one layer in fixed-width arrays: row r holds degree[r] neighbors in
+    ids[r] and dists[r], sorted by (distance, id), and at most max_links of them.
+
+    A dense layer uses the node id as the row, and -1 degrees for absent nodes.
+    A sparse layer, for the upper layers with few nodes, maps node ids to rows.
+
+    As a read-only Mapping, it reads as the dict layers of the first versions:
+    layer[e] is the list of the (distance, id) links of e.
+    """
+
+    def __init__(self, max_links: int, dense: bool, capacity: int = 0):
+        self.max_links = max_links
+        self.rows: dict[Index, int] | None = None if dense else {}
+        self.ids = np.zeros((capacity, max_links), dtype=np.int32)
+        self.dists = np.zeros((capacity, max_links), dtype=np.float64)
+        self.degree = np.full(capacity, -1, dtype=np.int32)
+        self.n_nodes = 0
+
+    def __len__(self) -> int:
+        return self.n_nodes
+
+    def __contains__(self, e: Index) -> bool:
+        return self.row(e) is not None
+
+    def __iter__(self):
+        "Iterate over the node ids of the layer."
+        if self.rows is None:
+            return iter(np.flatnonzero(self.degree >= 0).tolist())
+        return iter(self.rows)
+
+    def __getitem__(self, e: Index) -> list[tuple[float, Index]]:
+        r = self.row(e)
+        if r is None:
+            raise KeyError(e)
+        dists, ids = self.links(r)
+        return list(zip(dists.tolist(), ids.tolist()))
+
+    @classmethod
+    def from_dict(
+        cls,
+        links: Mapping[Index, Iterable[tuple[float, Index]]],
+        dense: bool,
+        max_links: int = 0,
+    ) -> "CompactLayer":
+        "Convert a dict layer { node: [(distance, neighbor)] }, wide enough for all links."
+        links = {int(e): sorted(neighbors) for e, neighbors in links.items()}
+        max_links = max([max_links, *map(len, links.values())])
+        capacity = (max(links) + 1 if dense else len(links)) if links else 0
+        layer = cls(max_links, dense, capacity)
+        for e, neighbors in links.items():
+            layer.set_links(layer.mut_row(e), neighbors)
+        return layer
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ids: np.ndarray,
+        dists: np.ndarray,
+        degree: np.ndarray,
+        nodes: np.ndarray | None = None,
+    ) -> "CompactLayer":
+        "Wrap the arrays of to_arrays(), such as memory-mapped ones, without copying."
+        layer = cls(ids.shape[1], dense=nodes is None)
+        layer.ids, layer.dists, layer.degree = ids, dists, degree
+        if nodes is None:
+            layer.n_nodes = int(np.count_nonzero(degree >= 0))
+        else:
+            layer.rows = {e: r for r, e in enumerate(nodes.tolist())}
+            layer.n_nodes = len(layer.rows)
+        return layer
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        "Return the used rows: ids, dists, degree, and the node of each row if sparse."
+        if self.rows is None:
+            n = int(np.flatnonzero(self.degree >= 0)[-1]) + 1 if self.n_nodes else 0
+            arrays = {}
+        else:
+            n = len(self.rows)
+            nodes = np.zeros(n, dtype=np.int64)
+            for e, r in self.rows.items():
+                nodes[r] = e
+            arrays = {"nodes": nodes}
+        arrays.update(ids=self.ids[:n], dists=self.dists[:n], degree=self.degree[:n])
+        return arrays
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.dists.nbytes + self.degree.nbytes
+
+    def row(self, e: Index) -> int | None:
+        if self.rows is not None:
+            return self.rows.get(e)
+        return e if e < len(self.degree) and self.degree[e] >= 0 else None
+
+    def mut_row(self, e: Index) -> int:
+        "Return the row of e, adding e to the layer if needed."
+        r = self.row(e)
+        if r is None:
+            r = len(self.rows) if self.rows is not None else e
+            if r >= len(self.degree):
+                self._grow(max(r + 1, 2 * len(self.degree)))
+            if self.rows is not None:
+                self.rows[e] = r
+            self.degree[r] = 0
+            self.n_nodes += 1
+        return r
+
+    def has_rows_for(self, nodes: Sequence[Index]) -> bool:
+        "Whether mut_row can add the missing nodes without growing the arrays."
+        new = [e for e in nodes if self.row(e) is None]
+        if self.rows is None:
+            return not new or max(new) < len(self.degree)
+        return len(self.rows) + len(new) <= len(self.degree)
+
+    def links(self, r: int) -> tuple[np.ndarray, np.ndarray]:
+        "Views of the (dists, ids) of row r, without copying."
+        d = self.degree[r]
+        return (self.dists[r, :d], self.ids[r, :d])
+
+    def set_links(self, r: int, neighbors: list[tuple[float, Index]]):
+        "Replace the links of row r by neighbors, sorted in ascending order."
+        d = min(len(neighbors), self.max_links)
+        for i in range(d):
+            self.dists[r, i], self.ids[r, i] = neighbors[i]
+        self.degree[r] = d
+
+    def add_link(self, r: int, dist: float, to: Index):
+        "Insert a link in order, and drop the furthest link if the row is full."
+        d = self.degree[r]
+        dists, ids = self.dists[r], self.ids[r]
+        pos = int(np.searchsorted(dists[:d], dist, side="left"))
+        while pos < d and dists[pos] == dist and ids[pos] < to:
+            pos += 1
+        if pos >= self.max_links:
+            return
+        end = min(d, self.max_links - 1)
+        dists[pos + 1 : end + 1] = dists[pos:end]
+        ids[pos + 1 : end + 1] = ids[pos:end]
+        dists[pos] = dist
+        ids[pos] = to
+        self.degree[r] = end + 1
+
+    def renumbered(self, new_id: np.ndarray) -> "CompactLayer":
+        "A copy without the nodes and links whose new_id is -1, with ids mapped by new_id."
+        arrays = self.to_arrays()
+        degree = arrays["degree"]
+        nodes = arrays.get("nodes", np.arange(len(degree)))
+        kept = (degree >= 0) & (new_id[nodes] >= 0)
+        ids = new_id[arrays["ids"][kept]]
+        valid = (np.arange(self.max_links) < degree[kept, None]) & (ids >= 0)
+        # Move the valid links first, in order. new_id keeps the order of ties.
+        order = np.argsort(~valid, axis=1, kind="stable")
+        ids = np.take_along_axis(ids, order, axis=1)
+        dists = np.take_along_axis(arrays["dists"][kept], order, axis=1)
+        degree = np.count_nonzero(valid, axis=1).astype(np.int32)
+        nodes = new_id[nodes[kept]]
+        if self.rows is not None:
+            return CompactLayer.from_arrays(ids, dists, degree, nodes)
+
+        n_rows = int(nodes.max()) + 1 if len(nodes) else 0
+        layer = CompactLayer(self.max_links, dense=True, capacity=n_rows)
+        layer.ids[nodes], layer.dists[nodes], layer.degree[nodes] = ids, dists, degree
+        layer.n_nodes = len(nodes)
+        return layer
+
+    def _grow(self, capacity: int):
+        n = len(self.degree)
+        for name in ("ids", "dists"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, self.max_links), dtype=old.dtype)
+            new[:n] = old
+            setattr(self, name, new)
+        degree = np.full(capacity, -1, dtype=np.int32)
+        degree[:n] = self.degree
+        self.degree = degree
+
+
+_NO_LINKS = (np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int32))
+
+# Stripes of the locks of the node links.
+N_LINK_LOCKS = 64
+
+# Rows of a layer scanned at once for the links to deleted nodes.
+REPAIR_BLOCK_ROWS = 1 << 14
+
+# The stats counted per operation, such as per query by search_many.
+QUERY_STATS = (
+    "n_distances",
+    "n_comparisons",
+    "n_improve",
+    "n_rejections",
+    "n_memo_hits",
+)
+
+
+def query_key(q_vec) -> tuple | int | str | bytes:
+    "A hashable key of a query made of arrays, tuples, lists and hashable values."
+    if isinstance(q_vec, np.ndarray):
+        return (q_vec.dtype.str, q_vec.shape, q_vec.tobytes())
+    if isinstance(q_vec, (list, tuple)):
+        return tuple(query_key(x) for x in q_vec)
+    return q_vec
 
 
 class HNSW(Generic[Query, Vector]):
+    # Queue types of the candidates C and of the results W of a layer search.
+    nearest_queue_type: type = NearestHeap
+    furthest_queue_type: type = FurthestHeap
+
     def __init__(
         self,
         M: int = 128,
@@ -27,6 +332,21 @@ class HNSW(Generic[Query, Vector]):
         m_L: float = 0.3,
         distance_func: Callable[[Query, Vector], float] = int_distance,
         query_to_vector_func: Callable[[Query], Vector] = identity,
+        vector_store: PackedVectorStore | None = None,
+        distance_batch_func: (
+            Callable[[Query, list[Index]], Sequence[float]] | None
+        ) = None,
+        distance_bound_func: Callable[[Query, Vector, float], float] | None = None,
+        sketch_query_func: Callable[[Query], Query] | None = None,
+        sketch_vector_func: Callable[[Vector], Vector] | None = None,
+        sketch_distance_func: Callable[[Query, Vector], float] | None = None,
+        vector_to_query_func: Callable[[Vector], Query] | None = None,
+        neighbor_heuristic: bool = False,
+        extend_candidates: bool = False,
+        keep_pruned_connections: bool = False,
+        query_cache_size: int = 0,
+        instrumentation: Instrumentation | None = None,
+        vector_bits: int | None = None,
     ):
         # Params.
         self.M = int(M)
@@ -34,21 +354,64 @@ class HNSW(Generic[Query, Vector]):
         self.Mmax0 = self.M * 2 # self.Mmax0 = self.M
         self.efConstruction = int(efConstruction)
         self.m_L = m_L
+        # Neighbor selection: the k-nearest, or the diversity heuristic of the HNSW
+        # paper with its variants. The heuristic needs vector_to_query_func.
+        self.neighbor_heuristic = neighbor_heuristic
+        self.extend_candidates = extend_candidates
+        self.keep_pruned_connections = keep_pruned_connections
+        if neighbor_heuristic and vector_to_query_func is None:
+            raise ValueError("neighbor_heuristic needs a vector_to_query_func.")
+        # Each insert or search memoizes its distances across layers. The memos of the
+        # last query_cache_size queries are kept, keyed by query_key, for retries.
+        self.query_cache_size = int(query_cache_size)
+        # Width of big-int vectors, such as prod(DIM) for `irisint`, in save() and in
+        # packed copies. Without it, it is the bit length of the longest stored int,
+        # too short for queries with higher bits.
+        self.vector_bits = vector_bits
 
         # User Functions.
         self._distance_func = distance_func
         self._query_to_vector_func = query_to_vector_func
+        # Distances from a query to many stored vectors by id. Defaults to distance_func.
+        self._distance_batch_func = distance_batch_func
+        # Distance, or any value >= bound if it is not below bound. Replaces the batches.
+        # Opt-in: irispacked_distance_bounded is slower than the batches on irises.
+        self._distance_bound_func = distance_bound_func
+        # Low-resolution sketches, to navigate with search(sketch=True).
+        self._sketch_query_func = sketch_query_func
+        self._sketch_vector_func = sketch_vector_func
+        self._sketch_distance_func = sketch_distance_func
+        # Query of a stored vector, to repair deletions. Without it, repair only unlinks.
+        self._vector_to_query_func = vector_to_query_func
 
         # State.
         self.lock = Lock()
-        self.vectors: list[Vector] = []
+        self.link_locks = [Lock() for _ in range(N_LINK_LOCKS)]
+        # Held by repair and compact, so that one does not run during the other.
+        self._maintenance_lock = RLock()
+        # Either a list, or a contiguous store such as `irispacked_store()`.
+        self.vectors: list[Vector] | PackedVectorStore = (
+            [] if vector_store is None else vector_store
+        )
+        self.sketches: list[Vector] = []  # If sketch_vector_func is set.
         self.entry_point: list[Index] = []
-        # Layer format: [ { node: [(distance(node, neighbor), neighbor)] } ]
-        self.layers: list[Layer] = []
+        # Layer format: [ CompactLayer ], layer 0 is dense. See the layers property.
+        self._layers: list[Layer] = []
+        # Tombstones, and those whose in-neighbors are not repaired yet.
+        self.deleted: set[Index] = set()
+        self._unrepaired: set[Index] = set()
+        # LRU of (sketch, query_key) -> {id: distance}.
+        self._query_cache: OrderedDict[tuple, dict[Index, float]] = OrderedDict()
+        self._query_cache_lock = Lock()
 
         # Tracing.
         self.search_log = {}
         self.record_search_log = False
+        # Count n_comparisons and n_improve, for the stats panel. Off, the searches do
+        # no accounting per candidate.
+        self.count_comparisons = False
+        # Per-layer counts and latencies of insert and search, such as a `Recorder`.
+        self.instrumentation = instrumentation
 
         # Stats.
         # Precompute the count of comparison of a list bisection.
@@ -57,34 +420,86 @@ class HNSW(Generic[Query, Vector]):
         ]
         self._reset_stats()
 
+    def __getstate__(self) -> dict:
+        "Pickle without the locks."
+        state = self.__dict__.copy()
+        for name in ("lock", "link_locks", "_maintenance_lock", "_query_cache_lock"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict):
+        # The pickles of the first versions lack the newer attributes, and their layers
+        # are dicts.
+        layers = state.pop("layers", None)
+        if layers is not None:
+            self.__init__(state["M"], state["efConstruction"], state["m_L"])
+        self.__dict__.update(state)
+        if layers is not None:
+            self.layers = layers
+        self.lock = Lock()
+        self.link_locks = [Lock() for _ in range(N_LINK_LOCKS)]
+        self._maintenance_lock = RLock()
+        self._query_cache_lock = Lock()
+
+    @property
+    def layers(self) -> list[Layer]:
+        return self._layers
+
+    @layers.setter
+    def layers(self, layers: Sequence[Mapping]):
+        "Dict layers, as { node: [(distance, neighbor)] }, are converted to CompactLayer."
+        self._layers = [
+            (
+                layer
+                if isinstance(layer, CompactLayer)
+                else CompactLayer.from_dict(
+                    layer, dense=lc == 0, max_links=self.Mmax if lc else self.Mmax0
+                )
+            )
+            for lc, layer in enumerate(layers)
+        ]
+
     # --- State Operations ---
 
+    def _rebuild_sketches(self):
+        "Compute the sketches of all the vectors, such as after they are replaced."
+        if self._sketch_vector_func is not None:
+            self.sketches = [self._sketch_vector_func(vec) for vec in self.vectors]
+
     def _mut_insert_vector(self, vec: Vector) -> Index:
+        if self._sketch_vector_func is not None:
+            sketch = self._sketch_vector_func(vec)
         with self.lock:
             q = len(self.vectors)
             self.vectors.append(vec)
+            if self._sketch_vector_func is not None:
+                self.sketches.append(sketch)
             self.n_insertions += 1
         return q
 
     def get_layer(self, lc: int) -> Layer:
-        return self.layers[lc] if lc < len(self.layers) else {}
+        return self.layers[lc] if lc < len(self.layers) else self._new_layer(lc)
 
     def _mut_layer(self, lc: int) -> Layer:
         while lc >= len(self.layers):
-            self.layers.append({})
+            self.layers.append(self._new_layer(len(self.layers)))
         return self.layers[lc]
 
+    def _new_layer(self, lc: int) -> Layer:
+        if lc == 0:
+            return CompactLayer(self.Mmax0, dense=True)
+        return CompactLayer(self.Mmax, dense=False)
+
     @staticmethod
-    def _get_links(e: Index, layer: Layer) -> "FurthestQueue":
-        return layer.get(e) or FurthestQueue()
+    def _get_links(e: Index, layer: Layer) -> tuple[np.ndarray, np.ndarray]:
+        "Return (dists, ids) of the links of e, sorted by distance."
+        r = layer.row(e)
+        return layer.links(r) if r is not None else _NO_LINKS
 
     @staticmethod
-    def _mut_links(e: Index, layer: Layer) -> "FurthestQueue":
-        conn = layer.get(e)
-        if conn is None:
-            conn = FurthestQueue()
-            layer[e] = conn
-        return conn
+    def _mut_links(e: Index, layer: Layer) -> int:
+        "Return the row of e in the layer, adding e if needed."
+        return layer.mut_row(e)
 
     def db_size(self) -> int:
         return len(self.vectors)
@@ -96,32 +511,357 @@ class HNSW(Generic[Query, Vector]):
         lc: int,
         max_links: int,
     ):
+        # The global lock guards the layers and their rows; the links of each node
+        # are guarded by its stripe, so that concurrent inserts rarely wait.
         with self.lock:
             layer = self._mut_layer(lc)
 
-            # Connect q -> n.
             if q in layer:
                 print("Warning: _connect_bidir: q is already in the layer.")
                 return
 
-            layer[q] = FurthestQueue(neighbors, is_ascending=True)
-
-            for nq, n in neighbors:
-                # Connect n -> q.
-                n_links = HNSW._mut_links(n, layer)
-                self._record_list_comparison(len(n_links))
-                n_links.add(nq, q)
-                if len(n_links) > max_links:
-                    n_links.trim_to_k_nearest(max_links)
-                    # or select_neighbors_heuristic.
+            nodes = [q] + [n for _nq, n in neighbors]
+            if layer.has_rows_for(nodes):
+                rows = [HNSW._mut_links(e, layer) for e in nodes]
+            else:
+                # Growing reallocates the arrays: wait for all the link writers.
+                with self._all_link_locks():
+                    rows = [HNSW._mut_links(e, layer) for e in nodes]
+
+        # Connect q -> n.
+        # The layer keeps at most layer.max_links == max_links per node.
+        with self._link_lock(q):
+            layer.set_links(rows[0], neighbors)
+
+        for (nq, n), n_row in zip(neighbors, rows[1:]):
+            # Connect n -> q.
+            with self._link_lock(n):
+                if self.count_comparisons:
+                    self._record_list_comparison(int(layer.degree[n_row]))
+                if self.neighbor_heuristic and layer.degree[n_row] == max_links:
+                    # Overflow: select among the links of n and q.
+                    dists, ids = layer.links(n_row)
+                    candidates = list(zip(dists.tolist(), ids.tolist()))
+                    candidates.append((nq, q))
+                    selected = self._select_neighbors_heuristic(candidates, max_links)
+                    layer.set_links(n_row, selected)
+                else:
+                    layer.add_link(n_row, nq, q)
+
+    def _link_lock(self, e: Index) -> Lock:
+        return self.link_locks[e % len(self.link_locks)]
+
+    @contextmanager
+    def _all_link_locks(self):
+        with ExitStack() as stack:
+            for lock in self.link_locks:
+                stack.enter_context(lock)
+            yield
 
     def _mut_may_be_entry_point(self, l: int, q: Index):
         with self.lock:
             if l >= len(self.layers):
-                while l >= len(self.layers):
-                    self.layers.append({})
+                self._mut_layer(l)
                 self.entry_point[:] = [q]
 
+    # --- Deletion ---
+
+    def delete(self, e: Index):
+        """
+        Mark e as deleted. Search skips it in its results but still traverses it, and
+        new nodes do not link to it. repair() reconnects the nodes linking to it, and
+        compact() reclaims the ids and storage.
+        """
+        if not 0 <= e < len(self.vectors):
+            raise IndexError(e)
+        with self.lock:
+            if e not in self.deleted:
+                self.deleted.add(e)
+                self._unrepaired.add(e)
+
+    def repair(self, max_deleted: int | None = None) -> int:
+        """
+        Reconnect the in-neighbors of up to max_deleted deleted nodes, and return the
+        number of deleted nodes left to repair.
+
+        Each in-neighbor replaces its links to deleted nodes by the nearest of its other
+        links and of the links of the deleted nodes. It holds the lock of its links like
+        insert does, so repair can run in a background thread. A concurrent compact
+        waits for it.
+        """
+        with self._maintenance_lock:
+            with self.lock:
+                pending = sorted(self._unrepaired)[:max_deleted]
+            if pending:
+                for layer in list(self.layers):
+                    self._repair_layer(layer, np.array(pending))
+                with self.lock:
+                    self._unrepaired.difference_update(pending)
+            return len(self._unrepaired)
+
+    def _repair_layer(self, layer: Layer, pending: np.ndarray):
+        # The rows linking to pending nodes, by blocks of rows to bound the memory.
+        in_rows = []
+        cols = np.arange(layer.max_links)
+        for start in range(0, len(layer.degree), REPAIR_BLOCK_ROWS):
+            block = slice(start, start + REPAIR_BLOCK_ROWS)
+            hit = np.isin(layer.ids[block], pending)
+            hit &= cols < layer.degree[block, None]
+            in_rows.extend((start + np.flatnonzero(hit.any(axis=1))).tolist())
+        if not in_rows:
+            return
+        row_nodes = {r: e for e, r in layer.rows.items()} if layer.rows else None
+
+        for r in in_rows:
+            n = row_nodes[r] if row_nodes is not None else r
+            if n in self.deleted:
+                continue  # Its links only serve traversal until compact().
+            with self._link_lock(n):
+                dists, ids = layer.links(r)
+                keep, lost = [], []
+                for eq, e in zip(dists.tolist(), ids.tolist()):
+                    (lost if e in self.deleted else keep).append((eq, e))
+
+                known = set(e for _eq, e in keep)
+                known.add(n)
+                candidates = []
+                for _eq, d in lost:
+                    for e in HNSW._get_links(d, layer)[1].tolist():
+                        if e not in known and e not in self.deleted:
+                            known.add(e)
+                            candidates.append(e)
+
+                if candidates and self._vector_to_query_func is not None:
+                    n_query = self._vector_to_query_func(self.vectors[n])
+                    eqs = self._distance_batch(n_query, candidates)
+                    keep = sorted(keep + list(zip(map(float, eqs), candidates)))
+                layer.set_links(r, keep)
+
+    def compact(self, min_deleted_ratio: float = 0.1) -> np.ndarray | None:
+        """
+        Once at least min_deleted_ratio of the vectors are deleted, repair, then drop
+        them and renumber the others in order.
+
+        Return the new id of each old id, -1 for deleted ones, or None below the
+        threshold. Ids kept outside of the index must be mapped with it. A concurrent
+        repair runs before or after it.
+        """
+        with self._maintenance_lock:
+            n = len(self.vectors)
+            if not self.deleted or len(self.deleted) < min_deleted_ratio * n:
+                return None
+            self.repair()
+
+            with self.lock, self._all_link_locks():
+                n = len(self.vectors)  # With the inserts since the check.
+                live = np.ones(n, dtype=bool)
+                live[list(self.deleted)] = False
+                new_id = np.full(n, -1, dtype=np.int32)
+                new_id[live] = np.arange(np.count_nonzero(live), dtype=np.int32)
+
+                if isinstance(self.vectors, PackedVectorStore):
+                    self.vectors.keep(live)
+                else:
+                    self.vectors = [vec for vec, k in zip(self.vectors, live) if k]
+                if self.sketches:
+                    self.sketches = [s for s, k in zip(self.sketches, live) if k]
+                self.layers = [layer.renumbered(new_id) for layer in self.layers]
+
+                entry_point = [int(new_id[e]) for e in self.entry_point if live[e]]
+                if not entry_point:
+                    # Enter from the top layer that still has nodes.
+                    while self.layers and not len(self.layers[-1]):
+                        self.layers.pop()
+                    entry_point = [next(iter(self.layers[-1]))] if self.layers else []
+                self.entry_point[:] = entry_point
+                self.deleted.clear()
+                self._unrepaired.clear()
+                with self._query_cache_lock:
+                    self._query_cache.clear()  # Keyed by the old ids.
+            return new_id
+
+    # --- Persistence ---
+
+    FORMAT_VERSION = 1
+
+    def save(self, path: str):
+        """
+        Save the index into the directory `path`: a JSON header with the params, entry
+        points and format version, then one .npy file per array of vectors and layers.
+
+        Vectors are saved as uint64 words, from a PackedVectorStore, from (code, mask)
+        big ints, or from plain ints. The user functions are not saved; pass them again to load().
+
+        The files are written into `path.tmp`, which then replaces path, so that an
+        interrupted save leaves the previous index whole: in path, or in `path.old`
+        between the two renames, where load() finds it.
+        """
+        path = path.rstrip(os.sep)
+        tmp, old = path + ".tmp", path + ".old"
+        if os.path.isdir(old):
+            if os.path.exists(path):
+                shutil.rmtree(old)
+            else:
+                os.replace(old, path)  # From a save interrupted between the renames.
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        try:
+            self._save_files(tmp)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        if os.path.exists(path):
+            os.replace(path, old)
+        os.replace(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def _save_files(self, path: str):
+        with self.lock:
+            if isinstance(self.vectors, PackedVectorStore):
+                vector_format, n_bits = "packed", self.vectors.n_bits
+                codes, masks = self.vectors.codes, self.vectors.masks
+            elif self.vectors and not isinstance(self.vectors[0], tuple):
+                # Plain ints, as for the default int_distance: no masks.
+                vector_format, n_bits = "int", self._int_vector_bits()
+                codes = np.array([int_to_words(c, n_bits) for c in self.vectors])
+                masks = None
+            else:
+                vector_format, n_bits = "irisint", self._int_vector_bits()
+                codes = np.array([int_to_words(c, n_bits) for c, _ in self.vectors])
+                masks = np.array([int_to_words(m, n_bits) for _, m in self.vectors])
+            np.save(os.path.join(path, "vector_codes.npy"), codes)
+            if masks is not None:
+                np.save(os.path.join(path, "vector_masks.npy"), masks)
+
+            for lc, layer in enumerate(self.layers):
+                for name, array in layer.to_arrays().items():
+                    np.save(os.path.join(path, f"layer_{lc}_{name}.npy"), array)
+            for name, ids in (
+                ("deleted", self.deleted),
+                ("unrepaired", self._unrepaired),
+            ):
+                ids = np.array(sorted(ids), dtype=np.int64)
+                np.save(os.path.join(path, f"{name}.npy"), ids)
+
+            params = self.get_params() | {
+                "Mmax": self.Mmax,
+                "Mmax0": self.Mmax0,
+                "neighbor_heuristic": self.neighbor_heuristic,
+                "extend_candidates": self.extend_candidates,
+                "keep_pruned_connections": self.keep_pruned_connections,
+            }
+            header = {
+                "format_version": self.FORMAT_VERSION,
+                "params": params,
+                "entry_point": [int(e) for e in self.entry_point],
+                "n_layers": len(self.layers),
+                "vector_format": vector_format,
+                "n_bits": n_bits,
+                "vector_bits": self.vector_bits,
+                "n_insertions": self.n_insertions,
+            }
+            with open(os.path.join(path, "header.json"), "w") as f:
+                json.dump(header, f, indent=2)
+
+    def _int_vector_bits(self) -> int:
+        "The width of the big-int vectors: vector_bits, or the longest stored int."
+        if self.vector_bits is not None:
+            return self.vector_bits
+        return max(
+            (
+                x.bit_length()
+                for vec in self.vectors
+                for x in (vec if isinstance(vec, tuple) else (vec,))
+            ),
+            default=1,
+        )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs) -> "HNSW":
+        """
+        Load an index saved by save(). kwargs are passed to the constructor, such as
+        distance_func, query_to_vector_func and distance_batch_func.
+
+        With mmap, packed vectors and the layer 0 links are memory-mapped copy-on-write:
+        the index opens without reading them, and processes share their pages.
+        """
+        path = path.rstrip(os.sep)
+        if not os.path.exists(path) and os.path.exists(path + ".old"):
+            path += ".old"  # A save was interrupted between its renames.
+        with open(os.path.join(path, "header.json")) as f:
+            header = json.load(f)
+        if header["format_version"] != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported HNSW format version {header['format_version']} in {path}"
+            )
+
+        def load_array(name: str, mmap_array: bool) -> np.ndarray:
+            mmap_mode = "c" if mmap and mmap_array else None
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        params = header["params"]
+        db = cls(
+            M=params["M"],
+            efConstruction=params["efConstruction"],
+            m_L=params["m_L"],
+            neighbor_heuristic=params.get("neighbor_heuristic", False),
+            extend_candidates=params.get("extend_candidates", False),
+            keep_pruned_connections=params.get("keep_pruned_connections", False),
+            **kwargs,
+        )
+        db.Mmax, db.Mmax0 = params["Mmax"], params["Mmax0"]
+        if db.vector_bits is None:
+            db.vector_bits = header.get("vector_bits")
+
+        n_bits = header["n_bits"]
+        if header["vector_format"] == "packed":
+            db.vectors = PackedVectorStore.from_arrays(
+                n_bits,
+                load_array("vector_codes", True),
+                load_array("vector_masks", True),
+            )
+            # A batch function bound to the store given in kwargs reads the loaded one.
+            batch_func = db._distance_batch_func
+            if (
+                getattr(batch_func, "__func__", None)
+                is PackedVectorStore.distance_batch
+            ):
+                db._distance_batch_func = db.vectors.distance_batch
+        elif header["vector_format"] == "int":
+            codes = load_array("vector_codes", False)
+            db.vectors = [words_to_int(c, n_bits) for c in codes]
+        else:
+            codes = load_array("vector_codes", False)
+            masks = load_array("vector_masks", False)
+            db.vectors = [
+                (words_to_int(c, n_bits), words_to_int(m, n_bits))
+                for c, m in zip(codes, masks)
+            ]
+
+        for lc in range(header["n_layers"]):
+            prefix = f"layer_{lc}_"
+            nodes = None if lc == 0 else load_array(prefix + "nodes", False)
+            db.layers.append(
+                CompactLayer.from_arrays(
+                    load_array(prefix + "ids", lc == 0),
+                    load_array(prefix + "dists", lc == 0),
+                    load_array(prefix + "degree", lc == 0),
+                    nodes,
+                )
+            )
+
+        db._rebuild_sketches()
+
+        # Indexes saved before deletion existed have no tombstones.
+        if os.path.exists(os.path.join(path, "deleted.npy")):
+            db.deleted = set(load_array("deleted", False).tolist())
+            db._unrepaired = set(load_array("unrepaired", False).tolist())
+
+        db.entry_point[:] = header["entry_point"]
+        db.n_insertions = header["n_insertions"]
+        return db
+
     # --- Stats ---
 
     def _reset_stats(self):
@@ -130,6 +870,10 @@ class HNSW(Generic[Query, Vector]):
         self.n_distances = 0
         self.n_comparisons = 0
         self.n_improve = 0
+        self.n_rejections = 0
+        self.n_memo_hits = 0
+        self.n_query_cache_hits = 0
+        self.n_sketch_distances = 0
         self.stat_time = time()
 
     def get_params(self) -> dict[str, int | float]:
@@ -150,6 +894,13 @@ class HNSW(Generic[Query, Vector]):
             "n_distances": self.n_distances,
             "n_comparisons": self.n_comparisons,
             "n_improve": self.n_improve,
+            "n_rejections": self.n_rejections,
+            # Distances reused within an operation, or from the query cache.
+            "n_memo_hits": self.n_memo_hits,
+            # Operations whose query was found in the query cache.
+            "n_query_cache_hits": self.n_query_cache_hits,
+            "n_deleted": len(self.deleted),
+            "n_sketch_distances": self.n_sketch_distances,
             "duration_sec": time() - self.stat_time,
         }
 
@@ -162,44 +913,277 @@ class HNSW(Generic[Query, Vector]):
     def _record_list_comparison(self, list_length: int):
         self.n_comparisons += self.n_cmp_per_len[list_length]
 
+    def _trace_candidate(
+        self, c: Index, e: Index, eq: float, fq: float, full: bool, n_C: int, n_W: int
+    ):
+        "Log and count the evaluation of e, a neighbor of c, before it updates C and W."
+        if self.record_search_log and e not in self.search_log:
+            depth = self.search_log[c][1] + 1
+            self.search_log[e] = (len(self.search_log), depth, eq, fq)
+        if not self.count_comparisons:
+            return
+        if full:
+            self.n_comparisons += 1  # record_list_comparison(1)
+            if eq >= fq:
+                return
+            n_W -= 1  # The furthest is taken out first.
+        self.n_improve += 1
+        self._record_list_comparison(n_C)
+        self._record_list_comparison(n_W)
+
     # --- HNSW Algorithms ---
 
-    def _distance(self, x_vec: Query, y_id: Index) -> float:
+    def _operation_memo(self, x_vec: Query, sketch: bool = False) -> dict[Index, float]:
+        "The distance memo of one operation on x_vec, shared with the query cache."
+        if not self.query_cache_size:
+            return {}
+        key = (sketch, query_key(x_vec))
+        with self._query_cache_lock:
+            memo = self._query_cache.get(key)
+            if memo is None:
+                memo = self._query_cache[key] = {}
+                if len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+            else:
+                self._query_cache.move_to_end(key)
+                self.n_query_cache_hits += 1
+        return memo
+
+    def _distance(
+        self,
+        x_vec: Query,
+        y_id: Index,
+        sketch: bool = False,
+        memo: dict[Index, float] | None = None,
+    ) -> float:
+        if memo is not None:
+            if y_id in memo:
+                self.n_memo_hits += 1
+                return memo[y_id]
+            memo[y_id] = eq = self._distance(x_vec, y_id, sketch)
+            return eq
+        if sketch:
+            self.n_sketch_distances += 1
+            return self._sketch_distance_func(x_vec, self.sketches[y_id])
         self.n_distances += 1
         y_vec = self.vectors[y_id]
         return self._distance_func(x_vec, y_vec)
 
+    def _distance_batch(
+        self,
+        x_vec: Query,
+        y_ids: list[Index],
+        sketch: bool = False,
+        memo: dict[Index, float] | None = None,
+    ) -> Sequence[float]:
+        if memo is not None:
+            missing = [y for y in y_ids if y not in memo]
+            self.n_memo_hits += len(y_ids) - len(missing)
+            if missing:
+                memo.update(zip(missing, self._distance_batch(x_vec, missing, sketch)))
+            return [memo[y] for y in y_ids]
+        if sketch:
+            self.n_sketch_distances += len(y_ids)
+            return [self._sketch_distance_func(x_vec, self.sketches[y]) for y in y_ids]
+        self.n_distances += len(y_ids)
+        if self._distance_batch_func is None:
+            return [self._distance_func(x_vec, self.vectors[y_id]) for y_id in y_ids]
+        return self._distance_batch_func(x_vec, y_ids)
+
+    def _distance_bounded(
+        self,
+        x_vec: Query,
+        y_id: Index,
+        W: "FurthestHeap",
+        ef: int,
+        memo: dict[Index, float] | None = None,
+    ) -> float:
+        "Distance with the furthest of a full W as bound: no need to be exact beyond it."
+        if memo is not None and y_id in memo:
+            self.n_memo_hits += 1
+            return memo[y_id]
+        self.n_distances += 1
+        bound = W.get_furthest()[0] if len(W) == ef else math.inf
+        eq = self._distance_bound_func(x_vec, self.vectors[y_id], bound)
+        if eq >= bound:
+            self.n_rejections += 1
+        elif memo is not None:
+            memo[y_id] = eq  # Only exact distances.
+        return eq
+
     def _select_layer(self) -> int:
         return int(-np.log(np.random.random()) * self.m_L)
 
-    def insert(self, q_vec: Query) -> Index:
+    def insert(self, q_vec: Query, l: int | None = None) -> Index:
+        "Insert q_vec in the layers 0 to l, drawn at random by default. Return its id."
+        if self.instrumentation is not None:
+            start = perf_counter()
         q_vec_to_store = self._query_to_vector_func(q_vec)
         q = self._mut_insert_vector(q_vec_to_store)
 
-        W = self._search_init(q_vec)
+        if l is None:
+            l = self._select_layer()
+        plan = self._insert_search(q_vec, l)
+        self._insert_link(q, l, plan)
+
+        if self.instrumentation is not None:
+            self.instrumentation.record_latency("insert", perf_counter() - start)
+        return q  # ID of the inserted vector.
+
+    def insert_many(
+        self, queries: Sequence[Query], workers: int = 1, batch_size: int | None = None
+    ) -> list[Index]:
+        """
+        Insert the queries in order, and return their ids.
+
+        With several workers, the search phase of the insertions runs in a process
+        pool over a shared-memory copy of the vectors and layers, one batch at a time.
+        The links of a batch are then applied in order, so the queries of a batch do
+        not see each other in the graph; they are offered to each other as candidates.
+        See `hnsw_parallel.py`.
+        """
+        if workers <= 1:
+            return [self.insert(q_vec) for q_vec in queries]
+        from hnsw_parallel import parallel_insert
+
+        return parallel_insert(self, queries, workers, batch_size)
+
+    def build(self, queries: Sequence[Query], **kwargs) -> list[Index]:
+        """
+        Build the empty index from all the queries at once, and return their ids.
+
+        Instead of an efConstruction search per insert, the nodes of each layer are
+        compared within clusters of the layer above, then their links are trimmed to
+        Mmax and Mmax0. The distance must be symmetric. See `hnsw_bulk.py` for kwargs,
+        and for the recall and cost of n_clusters against inserts.
+        """
+        from hnsw_bulk import bulk_build
+
+        return bulk_build(self, queries, **kwargs)
+
+    def _insert_search(
+        self,
+        q_vec: Query,
+        l: int,
+        peers: Sequence[tuple[float, Index, int]] = (),
+    ) -> list[tuple[int, list[tuple[float, Index]]]]:
+        """
+        Search phase of insert: return [(lc, neighbors)] from layer min(L, l) down to 0.
+
+        The peers (distance, id, layer) are candidates not yet linked in the graph.
+        """
+        memo = self._operation_memo(q_vec)
+        W = self._search_init(q_vec, memo=memo)
         L = len(self.layers) - 1
-        l = self._select_layer()
+
+        inst = self.instrumentation
 
         # From the top layer down to the new node layer, non-inclusive.
         for lc in range(L, l, -1):
-            self._search_layer(q_vec, W, 1, lc)
+            counts = self._search_layer(q_vec, W, 1, lc, memo=memo)
+            if inst is not None:
+                inst.record_layer("insert", lc, *counts)
             W.trim_to_k_nearest(1)
 
+        plan = []
         for lc in range(min(L, l), -1, -1):
-            self._search_layer(q_vec, W, self.efConstruction, lc)
-            neighbors = W.get_k_nearest(self.M)  # or select_neighbors_heuristic
+            counts = self._search_layer(
+                q_vec, W, self.efConstruction, lc, memo=memo, skip=self.deleted
+            )
+            if inst is not None:
+                inst.record_layer("insert", lc, *counts)
+            if peers:
+                in_W = set(e for _eq, e in W)
+                for eq, e, l_e in peers:
+                    if l_e >= lc and e not in in_W:
+                        W.add(eq, e)
+                W.trim_to_k_nearest(self.efConstruction)
+            if self.neighbor_heuristic:
+                candidates = self._k_nearest_live(W, len(W))
+                if self.extend_candidates:
+                    candidates += self._extend_candidates(q_vec, candidates, lc, memo)
+                neighbors = self._select_neighbors_heuristic(candidates, self.M)
+            else:
+                neighbors = self._k_nearest_live(W, self.M)
+            plan.append((lc, neighbors))
+        return plan
 
+    def _extend_candidates(
+        self,
+        q_vec: Query,
+        candidates: list[tuple[float, Index]],
+        lc: int,
+        memo: dict[Index, float] | None = None,
+    ) -> list[tuple[float, Index]]:
+        "The neighbors of the candidates in layer lc that are not candidates already."
+        layer = self.get_layer(lc)
+        known = set(e for _eq, e in candidates)
+        new_e = []
+        for _eq, c in candidates:
+            for e in self._get_links(c, layer)[1].tolist():
+                if e not in known and e not in self.deleted:
+                    known.add(e)
+                    new_e.append(e)
+        if not new_e:
+            return []
+        eqs = self._distance_batch(q_vec, new_e, memo=memo)
+        return list(zip(map(float, eqs), new_e))
+
+    def _select_neighbors_heuristic(
+        self, candidates: list[tuple[float, Index]], M: int
+    ) -> list[tuple[float, Index]]:
+        """
+        Select up to M of the (distance to base, id) candidates, nearest first, keeping
+        only those nearer to the base than to any selected one, as in the HNSW paper.
+        With keep_pruned_connections, the nearest pruned ones fill the free places.
+
+        The distance must be symmetric: each selected candidate is compared once to
+        the candidates after it, with its query from vector_to_query_func.
+        """
+        candidates = sorted(candidates)
+        selected, pruned = [], []
+        # Distance from each candidate to the nearest selected one.
+        to_selected = np.full(len(candidates), np.inf)
+        for i, (eq, e) in enumerate(candidates):
+            if len(selected) == M:
+                break
+            if to_selected[i] <= eq:
+                pruned.append((eq, e))
+                continue
+            selected.append((eq, e))
+            rest = [c for _cq, c in candidates[i + 1 :]]
+            if rest and len(selected) < M:
+                e_query = self._vector_to_query_func(self.vectors[e])
+                to_e = self._distance_batch(e_query, rest)
+                np.minimum(to_selected[i + 1 :], to_e, out=to_selected[i + 1 :])
+        if self.keep_pruned_connections:
+            selected = sorted(selected + pruned[: M - len(selected)])
+        return selected
+
+    def _insert_link(
+        self, q: Index, l: int, plan: list[tuple[int, list[tuple[float, Index]]]]
+    ):
+        "Link phase of insert: connect q to the neighbors found by _insert_search."
+        for lc, neighbors in plan:
             max_conn = self.Mmax if lc else self.Mmax0
             self._mut_connect_bidir(q, neighbors, lc, max_conn)
 
         self._mut_may_be_entry_point(l, q)
 
-        return q  # ID of the inserted vector.
-
     def search(
-        self, q_vec: Query, K: int, ef: int | None = None
+        self, q_vec: Query, K: int, ef: int | None = None, sketch: bool = False
     ) -> list[tuple[float, int]]:
-        "Return the K nearest neighbors of q_vec, as [(distance, vector_id)]."
+        """
+        Return the K nearest neighbors of q_vec, as [(distance, vector_id)].
+
+        With sketch, navigate the graph with the sketch distance, then rerank the ef
+        candidates found with the full distance.
+        """
+        if sketch:
+            self._check_sketch_funcs()
+        inst = self.instrumentation
+        if inst is not None:
+            start = perf_counter()
         self.n_searches += 1
         if not ef:
             ef = self.efConstruction
@@ -207,27 +1191,123 @@ class HNSW(Generic[Query, Vector]):
         if K > ef:
             ef = K
 
-        W = self._search_init(q_vec)
+        x_vec = self._sketch_query_func(q_vec) if sketch else q_vec
+
+        memo = self._operation_memo(x_vec, sketch)
+        W = self._search_init(x_vec, sketch, memo)
         L = len(self.layers) - 1
 
         for lc in range(L, 0, -1):
-            self._search_layer(q_vec, W, 1, lc)
+            counts = self._search_layer(x_vec, W, 1, lc, sketch, memo)
+            if inst is not None:
+                inst.record_layer("search", lc, *counts)
             W.trim_to_k_nearest(1)
 
-        self._search_layer(q_vec, W, ef, 0)
-        W.trim_to_k_nearest(K)
-        return W
+        counts = self._search_layer(x_vec, W, ef, 0, sketch, memo, self.deleted)
+        if sketch:
+            result = self._rerank(q_vec, W, K)
+        else:
+            result = self._k_nearest_live(W, K)
+        if inst is not None:
+            inst.record_layer("search", 0, *counts)
+            inst.record_latency("search", perf_counter() - start)
+        return result
+
+    def _k_nearest_live(self, W: "FurthestHeap", K: int) -> list[tuple[float, int]]:
+        "The K nearest of W that are not deleted."
+        if not self.deleted:
+            return W.get_k_nearest(K)
+        return [(eq, e) for eq, e in W.get_k_nearest(len(W)) if e not in self.deleted][
+            :K
+        ]
 
-    def _search_init(self, q_vec: Query) -> "FurthestQueue":
+    def search_many(
+        self,
+        queries: Sequence[Query],
+        K: int,
+        ef: int | None = None,
+        workers: int = 1,
+    ) -> tuple[list[list[tuple[float, int]]], list[dict[str, int | float]]]:
+        """
+        Search the queries, and return their results and stats in order.
+
+        With several workers, the queries run in a process pool attached to a read-only
+        shared-memory copy of the vectors and layers, made once per call. The index
+        must not be modified meanwhile. See `hnsw_parallel.py`.
+        """
+        if workers > 1:
+            from hnsw_parallel import parallel_search
+
+            return parallel_search(self, queries, K, ef, workers)
+        results, stats = [], []
+        for q_vec in queries:
+            result, query_stats = self._search_counted(q_vec, K, ef)
+            results.append(result)
+            stats.append(query_stats)
+        return results, stats
+
+    def _search_counted(
+        self, q_vec: Query, K: int, ef: int | None
+    ) -> tuple[list[tuple[float, int]], dict[str, int | float]]:
+        "Return search() and the stats counted during it."
+        before = [getattr(self, k) for k in QUERY_STATS]
+        start = time()
+        result = self.search(q_vec, K, ef)
+        stats = {k: getattr(self, k) - b for k, b in zip(QUERY_STATS, before)}
+        stats["duration_sec"] = time() - start
+        return result, stats
+
+    def _rerank(
+        self, q_vec: Query, W: "FurthestHeap", K: int
+    ) -> list[tuple[float, int]]:
+        "Return the K nearest of W by the full distance."
+        ids = [e for _eq, e in W if e not in self.deleted]
+        return sorted(zip(self._distance_batch(q_vec, ids), ids))[:K]
+
+    def sketch_recall(
+        self, queries: Sequence[Query], K: int, ef: int | None = None
+    ) -> float:
+        """
+        The recall of search(sketch=True) over the queries: the share of their exact K
+        nearest neighbors, from `hnsw_exact.ExactIndex`, that it returns.
+        """
+        from hnsw_exact import ExactIndex, recall
+
+        truth = ExactIndex.from_hnsw(self).search_many(queries, K)
+        results = [self.search(q_vec, K, ef, sketch=True) for q_vec in queries]
+        return recall(results, truth)
+
+    def _check_sketch_funcs(self):
+        missing = [
+            name
+            for name, func in (
+                ("sketch_query_func", self._sketch_query_func),
+                ("sketch_vector_func", self._sketch_vector_func),
+                ("sketch_distance_func", self._sketch_distance_func),
+            )
+            if func is None
+        ]
+        if missing:
+            raise ValueError(
+                f"search(sketch=True) needs the HNSW args {', '.join(missing)}."
+            )
+
+    def _search_init(
+        self,
+        q_vec: Query,
+        sketch: bool = False,
+        memo: dict[Index, float] | None = None,
+    ) -> "FurthestHeap":
         if self.record_search_log:
             self.search_log.clear()
 
-        W = FurthestQueue()
+        W = self.furthest_queue_type()
 
         for e in self.entry_point:
-            eq = self._distance(q_vec, e)
+            eq = self._distance(q_vec, e, sketch, memo)
 
-            self._record_list_comparison(len(W))
+            if self.count_comparisons:
+                self._record_list_comparison(len(W))
             W.add(eq, e)
 
             if self.record_search_log:
@@ -235,102 +1315,78 @@ class HNSW(Generic[Query, Vector]):
 
         return W
 
-    def _search_layer(self, q_vec: Query, W: "FurthestQueue", ef: int, lc: int):
-        "Mutate W into the ef nearest neighbors of q_vec in the given layer."
+    def _search_layer(
+        self,
+        q_vec: Query,
+        W: "FurthestHeap",
+        ef: int,
+        lc: int,
+        sketch: bool = False,
+        memo: dict[Index, float] | None = None,
+        skip: set[Index] | None = None,
+    ) -> tuple[int, int, int]:
+        """
+        Mutate W into the ef nearest neighbors of q_vec in the given layer, and return
+        the counts of nodes expanded, distances evaluated and nodes visited.
+
+        The memo holds the distances already known in this operation, such as those
+        evaluated in the layers above: they are reused instead of computed again.
+
+        The nodes in skip, such as tombstones, are traversed but kept out of W, so that
+        W still gets ef others.
+        """
 
         layer = self.get_layer(lc)
         v = set(e for eq, e in W)  # set of visited elements
-        C = NearestQueue.from_furthest_queue(W)  # set of candidates
-        fq, _ = W[-1]  # W.get_furthest()
+        C = self.nearest_queue_type.from_furthest_queue(W)  # set of candidates
+        if skip:
+            nearest_skipped = min(((eq, e) for eq, e in W if e in skip), default=None)
+            W.discard(skip)
+        fq = W.get_furthest()[0] if len(W) else math.inf
+        trace = self.record_search_log or self.count_comparisons
+        bounded = self._distance_bound_func is not None and not sketch
+        n_hops = 0
+        n_evaluated = 0
 
         while len(C) > 0:
-            cq, c = C.pop()  # C.take_nearest()
-
-            if self.record_search_log:
-                depth = self.search_log[c][1] + 1
-            else:
-                depth = None
+            cq, c = C.take_nearest()
 
             if cq > fq:
                 break  # all elements in W are evaluated
 
-            # update C and W
-            for _ec, e in self._get_links(c, layer):
-                # TODO: batch distance.
-                if e not in v:
-                    v.add(e)
-
-                    eq = self._distance(q_vec, e)
-
-                    if self.record_search_log and e not in self.search_log:
-                        self.search_log[e] = (len(self.search_log), depth, eq, fq)
-
-                    if len(W) == ef:  # W is full
-                        self.n_comparisons += 1  # record_list_comparison(1)
-                        if eq < fq:
-                            W.pop()  # W.take_furthest()
-                        else:
-                            continue
+            # Evaluate all unvisited neighbors of c at once.
+            n_hops += 1
+            _dists, ids = self._get_links(c, layer)
+            new_e = [e for e in ids.tolist() if e not in v]
+            if not new_e:
+                continue
+            v.update(new_e)
+            n_evaluated += len(new_e)
 
-                    self.n_improve += 1
-                    self._record_list_comparison(len(C))
-                    self._record_list_comparison(len(W))
-                    C.add(eq, e)
-                    W.add(eq, e)
-
-                    fq, _ = W[-1]  # W.get_furthest()
-
-
-# Sorted list.
-
-
-class FurthestQueue(list[tuple[float, Index]]):
-    "A list sorted in ascending order, for fast pop of the furthest element."
-
-    def __init__(self, iterable=None, is_ascending=False):
-        if not iterable:
-            super().__init__()
-        else:
-            if not is_ascending:
-                iterable = sorted(iterable)
-            super().__init__(iterable)
-
-    def add(self, dist: float, to: Index):
-        bisect.insort(self, (dist, to))
-
-    def get_furthest(self) -> tuple[float, Index]:
-        return self[-1]
-
-    def take_furthest(self) -> tuple[float, Index]:
-        return self.pop()
-
-    def get_k_nearest(self, k) -> list[tuple[float, Index]]:
-        return self[:k]
-
-    def trim_to_k_nearest(self, k):
-        del self[k:]
-
-
-class NearestQueue(list[tuple[float, Index]]):
-    "A list sorted in descending order, for fast pop of the nearest element."
-
-    def __init__(self, iterable=None, is_descending=False):
-        if not iterable:
-            super().__init__()
-        else:
-            if not is_descending:
-                iterable = sorted(iterable, reverse=True)
-            super().__init__(iterable)
-
-    @staticmethod
-    def from_furthest_queue(furthest_queue: FurthestQueue) -> "NearestQueue":
-        return NearestQueue(reversed(furthest_queue), is_descending=True)
-
-    def add(self, dist: float, to: Index):
-        bisect.insort(self, (dist, to), key=lambda x: -x[0])
-
-    def get_nearest(self) -> tuple[float, Index]:
-        return self[-1]
-
-    def take_nearest(self) -> tuple[float, Index]:
-        return self.pop()
+            # update C and W
+            if bounded:
+                # One at a time, to use the bound of the current W.
+                eqs = (self._distance_bounded(q_vec, e, W, ef, memo) for e in new_e)
+            else:
+                eqs = self._distance_batch(q_vec, new_e, sketch, memo)
+            for e, eq in zip(new_e, eqs):
+                if trace:
+                    self._trace_candidate(c, e, eq, fq, len(W) == ef, len(C), len(W))
+
+                if len(W) == ef and eq >= fq:  # W is full
+                    continue
+
+                C.add(eq, e)
+                if skip and e in skip:
+                    if nearest_skipped is None or (eq, e) < nearest_skipped:
+                        nearest_skipped = (eq, e)
+                    continue
+                if len(W) == ef:
+                    W.take_furthest()
+                W.add(eq, e)
+
+                fq, _ = W.get_furthest()
+
+        if skip and not len(W) and nearest_skipped is not None:
+            W.add(*nearest_skipped)  # To enter the layer below.
+        return n_hops, n_evaluated, len(v)
@@ -0,0 +1,249 @@
+"""
+Bulk build of an HNSW from a dataset known up front. See `HNSW.build`.
+
+The layers of all the nodes are drawn first, as insert would draw them, and the layers
+are linked from the top down. The top layer, with few nodes, compares all its pairs.
+Each layer below is clustered by the one above it, which is already linked: each node
+finds its n_clusters nearest nodes of the layer above by a search with ef_pivots, and
+joins their clusters. The pairs of each cluster are compared, about n_clusters^2 * M
+per node, where insert searches with efConstruction.
+
+Recall needs more clusters as the index grows. With 3000 random irispacked templates,
+M=16 and efConstruction=64, 600 targets with noise 0.3 were in the top 10 at ef=64 for
+59.5% of them with 3 clusters, 67% with 4, 68.5% with 5 and 70% with 6, against 68.5%
+when inserted one by one. That cost 152, 218, 297 and 390 distances per node, against
+917. With 1000 templates, 3 clusters found 93% and inserts 95%. So the default is 3
+clusters up to 1000 nodes, and one more per doubling.
+
+Then rounds of NN-descent (Dong et al., 2011) may refine the lists: the neighbors of
+each node, and the nodes listing it, are compared to each other, as a neighbor of a
+neighbor is probably a neighbor. Finally the lists and their reverse links are trimmed
+to Mmax, or Mmax0 in layer 0, as the links of insert are.
+
+The distance must be symmetric: each pair is compared once, for both of its nodes.
+"""
+import bisect
+import math
+from typing import Sequence
+
+import numpy as np
+
+from hnsw import HNSW, Index, Query
+
+# Clusters joined by each node, from its nearest nodes in the layer above: N_CLUSTERS
+# up to CLUSTERS_BASE_SIZE nodes, and one more per doubling of the nodes.
+N_CLUSTERS = 3
+CLUSTERS_BASE_SIZE = 1000
+
+# Rounds of NN-descent after the clusters, and the share of each list joined per round.
+REFINE_ROUNDS = 0
+SAMPLE_RATE = 0.5
+
+# A top layer with up to this many nodes per link compares all its pairs. A bigger one
+# starts from random lists, refined until a round updates few of them.
+BRUTE_FORCE_RATIO = 4
+MAX_ROUNDS = 10
+MIN_UPDATES = 0.01
+
+
+def bulk_build(
+    db: HNSW,
+    queries: Sequence[Query],
+    n_clusters: int | None = None,
+    ef_pivots: int | None = None,
+    refine_rounds: int = REFINE_ROUNDS,
+    sample_rate: float = SAMPLE_RATE,
+) -> list[Index]:
+    "See `HNSW.build`."
+    if len(db.vectors):
+        raise ValueError("build needs an empty index; use insert_many to add to one.")
+    queries = list(queries)
+    if not queries:
+        return []
+    if n_clusters is None:
+        n_clusters = default_n_clusters(len(queries))
+    if ef_pivots is None:
+        ef_pivots = n_clusters
+
+    levels = np.array([db._select_layer() for _ in queries])
+    ids = [db._mut_insert_vector(db._query_to_vector_func(q_vec)) for q_vec in queries]
+
+    top = int(levels.max())
+    for lc in range(top, -1, -1):
+        nodes = np.flatnonzero(levels >= lc)
+        max_links = db.Mmax if lc else db.Mmax0
+        knn = _NeighborLists(
+            db, [queries[i] for i in nodes], [ids[i] for i in nodes], max_links
+        )
+        if lc == top:
+            if len(nodes) <= BRUTE_FORCE_RATIO * max_links:
+                knn.join_all()
+            else:
+                knn.join_random()
+                for _ in range(MAX_ROUNDS):
+                    n_updates = knn.join_round(sample_rate)
+                    if n_updates < MIN_UPDATES * len(nodes) * max_links:
+                        break
+        else:
+            knn.join_clusters(levels[nodes] > lc, lc + 1, n_clusters, ef_pivots)
+            for _ in range(refine_rounds):
+                knn.join_round(sample_rate)
+
+        layer = db._mut_layer(lc)
+        for i, neighbors in enumerate(knn.with_reverse()):
+            neighbors = [(eq, ids[nodes[j]]) for eq, j in neighbors]
+            if db.neighbor_heuristic:
+                neighbors = db._select_neighbors_heuristic(neighbors, max_links)
+            layer.set_links(layer.mut_row(ids[nodes[i]]), neighbors)
+        if lc == top:
+            db.entry_point[:] = [ids[int(np.flatnonzero(levels == top)[0])]]
+    return ids
+
+
+def default_n_clusters(n: int) -> int:
+    "The clusters joined by each node when building n nodes."
+    if n <= CLUSTERS_BASE_SIZE:
+        return N_CLUSTERS
+    return N_CLUSTERS + round(math.log2(n / CLUSTERS_BASE_SIZE))
+
+
+class _NeighborLists:
+    """
+    The K nearest neighbors found so far of each node 0..n-1 of a layer, as sorted
+    lists of (distance, node), with the nodes added since they were last joined.
+    """
+
+    def __init__(self, db: HNSW, queries: list[Query], ids: list[Index], K: int):
+        self.db = db
+        # The query of each node, and the id of its vector in db.
+        self.queries = queries
+        self.ids = ids
+        self.n = len(queries)
+        self.K = min(K, self.n - 1)
+        self.lists: list[list[tuple[float, int]]] = [[] for _ in range(self.n)]
+        self.members: list[set[int]] = [set() for _ in range(self.n)]
+        self.new: list[set[int]] = [set() for _ in range(self.n)]
+
+    def add(self, i: int, eq: float, j: int) -> int:
+        "Add j to the list of i if it is nearer than the furthest. Return 1 if added."
+        neighbors = self.lists[i]
+        if j in self.members[i] or (
+            len(neighbors) == self.K and (eq, j) >= neighbors[-1]
+        ):
+            return 0
+        bisect.insort(neighbors, (eq, j))
+        self.members[i].add(j)
+        self.new[i].add(j)
+        if len(neighbors) > self.K:
+            _eq, dropped = neighbors.pop()
+            self.members[i].discard(dropped)
+            self.new[i].discard(dropped)
+        return 1
+
+    def join(self, i: int, others: list[int]) -> int:
+        "Compare i to the others, and add each to the list of the other."
+        others = [j for j in others if not self._linked(i, j)]
+        if not others:
+            return 0
+        eqs = self.db._distance_batch(self.queries[i], [self.ids[j] for j in others])
+        n_updates = 0
+        for j, eq in zip(others, map(float, eqs)):
+            n_updates += self.add(i, eq, j) + self.add(j, eq, i)
+        return n_updates
+
+    def join_all(self):
+        "The exact lists, from all the pairs."
+        for i in range(self.n - 1):
+            self.join(i, list(range(i + 1, self.n)))
+
+    def join_clusters(
+        self, is_pivot: np.ndarray, lc: int, n_clusters: int, ef_pivots: int
+    ):
+        """
+        Compare the pairs of each cluster. The pivots are the nodes that are also in
+        layer lc of db, which is linked; each other node joins the clusters of its
+        n_clusters nearest pivots, found by a search with ef_pivots.
+        """
+        clusters = {i: [i] for i in np.flatnonzero(is_pivot).tolist()}
+        node_of_id = {e: i for i, e in enumerate(self.ids)}
+        for i in np.flatnonzero(~is_pivot).tolist():
+            pivots = self._nearest_pivots(self.queries[i], lc, n_clusters, ef_pivots)
+            for eq, e in pivots:
+                p = node_of_id[e]
+                self.add(i, eq, p)
+                self.add(p, eq, i)
+                clusters[p].append(i)
+        for cluster in clusters.values():
+            for a, i in enumerate(cluster[:-1]):
+                self.join(i, cluster[a + 1 :])
+
+    def join_random(self):
+        "Start each list with K random nodes, and the other lists with the reverse."
+        for i in range(self.n):
+            others = np.random.choice(self.n - 1, self.K, replace=False)
+            others[others >= i] += 1
+            self.join(i, others.tolist())
+
+    def join_round(self, sample_rate: float) -> int:
+        """
+        One round of local joins: the new neighbors of each node, forward and reverse,
+        are compared to each other and to the old ones. Return the count of updates.
+        """
+        n_sample = max(1, int(sample_rate * self.K))
+        new_fwd, old_fwd = [], []
+        for i in range(self.n):
+            new = [j for _eq, j in self.lists[i] if j in self.new[i]]
+            old_fwd.append([j for _eq, j in self.lists[i] if j not in self.new[i]])
+            new = _sample(new, n_sample)
+            self.new[i].difference_update(new)  # Joined from now on.
+            new_fwd.append(new)
+        new_rev, old_rev = _reverse(new_fwd, self.n), _reverse(old_fwd, self.n)
+
+        n_updates = 0
+        for i in range(self.n):
+            new = set(new_fwd[i]).union(_sample(new_rev[i], n_sample))
+            old = set(old_fwd[i]).union(_sample(old_rev[i], n_sample)) - new
+            new, old = sorted(new), sorted(old)
+            for a, u in enumerate(new):
+                n_updates += self.join(u, new[a + 1 :] + old)
+        return n_updates
+
+    def with_reverse(self) -> list[list[tuple[float, int]]]:
+        "The lists with the reverse of each link, sorted without duplicates."
+        merged = [list(neighbors) for neighbors in self.lists]
+        for i, neighbors in enumerate(self.lists):
+            for eq, j in neighbors:
+                if i not in self.members[j]:
+                    merged[j].append((eq, i))
+        return [sorted(set(neighbors)) for neighbors in merged]
+
+    def _linked(self, i: int, j: int) -> bool:
+        "Whether i and j are the same, or in the lists of each other."
+        return i == j or (j in self.members[i] and i in self.members[j])
+
+    def _nearest_pivots(
+        self, q_vec: Query, lc: int, n: int, ef: int
+    ) -> list[tuple[float, Index]]:
+        "The n nearest nodes of layer lc of db, searched from its top layer."
+        db = self.db
+        W = db._search_init(q_vec)
+        for l in range(len(db.layers) - 1, lc, -1):
+            db._search_layer(q_vec, W, 1, l)
+            W.trim_to_k_nearest(1)
+        db._search_layer(q_vec, W, max(ef, n), lc)
+        return W.get_k_nearest(n)
+
+
+def _sample(items: list[int], n: int) -> list[int]:
+    if len(items) <= n:
+        return items
+    return [items[k] for k in np.random.choice(len(items), n, replace=False).tolist()]
+
+
+def _reverse(lists: list[list[int]], n: int) -> list[list[int]]:
+    "The nodes whose list holds each node."
+    reverse = [[] for _ in range(n)]
+    for i, neighbors in enumerate(lists):
+        for j in neighbors:
+            reverse[j].append(i)
+    return reverse
@@ -1,9 +1,10 @@
 import json
 import numpy as np
 import pandas as pd
-from typing import Any
+from typing import Any, Iterable
 from iris_integration import _np_to_bigint
 from hnsw import HNSW
+from packed_vectors import PackedVectorStore, bits_to_words
 
 def parse_string_to_dict(input_string: str) -> Any:
     """
@@ -32,8 +33,12 @@ def copy_in(db: HNSW, vectors: pd.DataFrame, links: pd.DataFrame, entries: pd.Da
         vectors (pd.DataFrame): DataFrame containing vector data.
         links (pd.DataFrame): DataFrame containing links data.
         entries (pd.DataFrame): DataFrame containing entry point data.
+
+    Raises:
+        ValueError: If a node has more links than the layers of db keep.
     """
     _update_vectors(db, vectors)
+    db._rebuild_sketches()
     _update_layers(db, links)
     _update_n_insertions(db, len(vectors))
     _update_entry_point(db, entries)
@@ -69,14 +74,29 @@ def _update_layers(db: HNSW, links: pd.DataFrame) -> None:
         db (HNSW): The HNSW object where layers are updated.
         links (pd.DataFrame): DataFrame containing all links across all layers.
     """
-    def process_links(df: DataFrame) -> dict:
-        def process_row(row: pd.Series) -> list:
-            return [(item[1], item[0]) for item in row['queue']]
-        
-        df['processed_queue'] = df['links'].apply(lambda x: process_row(x))
-        return pd.Series(df['processed_queue'].values, index=df['source_ref']).to_dict()
+    db.layers = []
+    for lc, df in links.groupby('layer', sort=True):
+        layer = db._mut_layer(lc)
+        for source, row in zip(df['source_ref'], df['links']):
+            # The Rust queue holds [neighbor, distance] pairs.
+            neighbors = sorted((item[1], item[0]) for item in row['queue'])
+            _check_degree(db, lc, len(neighbors))
+            layer.set_links(layer.mut_row(source), neighbors)
+
+
+def _check_degree(db: HNSW, lc: int, degree: int) -> None:
+    """
+    Raises if a node has more links than the layers of db keep, rather than truncating them.
 
-    db.layers = links.groupby('layer').apply(process_links).sort_index(ascending=True).tolist()
+    Raises:
+        ValueError: If db was made with another M than the copied index.
+    """
+    max_links = db.Mmax if lc else db.Mmax0
+    if degree > max_links:
+        raise ValueError(
+            f"A node of layer {lc} has {degree} links, more than the {max_links} of "
+            f"M={db.M}: make the HNSW with the M of the copied index."
+        )
 
 
 def _update_vectors(db: HNSW, vectors: pd.DataFrame) -> None:
@@ -96,3 +116,164 @@ def _update_vectors(db: HNSW, vectors: pd.DataFrame) -> None:
     vectors_sorted = vectors.sort_values(by='id')
     processed_points = vectors_sorted['point'].apply(process_vectors)
     db.vectors = processed_points.tolist()
+
+
+# --- Streaming bulk import. ---
+
+
+def copy_in_csv(
+    db: HNSW,
+    vectors_path: str,
+    links_path: str,
+    entries_path: str,
+    chunksize: int = 10_000,
+) -> None:
+    """
+    Streams the CSV files of the Rust copy-out into the HNSW database, chunk by chunk.
+
+    Args:
+        db (HNSW): The HNSW object to be updated.
+        vectors_path (str): CSV file with `id` and `point` columns.
+        links_path (str): CSV file with `layer`, `source_ref` and `links` columns.
+        entries_path (str): CSV file with an `id` column.
+        chunksize (int): Number of CSV rows parsed at once.
+    """
+    copy_in_chunks(
+        db,
+        pd.read_csv(vectors_path, chunksize=chunksize),
+        pd.read_csv(links_path, chunksize=chunksize),
+        pd.read_csv(entries_path),
+    )
+
+
+def copy_in_chunks(
+    db: HNSW,
+    vector_chunks: Iterable[pd.DataFrame],
+    link_chunks: Iterable[pd.DataFrame],
+    entries: pd.DataFrame,
+) -> None:
+    """
+    Same result as `copy_in`, from chunks of the vectors and links DataFrames, so that only
+    one chunk is parsed in memory at a time. Payload columns may be JSON strings or dicts.
+
+    Vectors are decoded in bulk per chunk. If `db.vectors` is a PackedVectorStore, they are
+    packed into it directly instead of big ints.
+
+    Args:
+        db (HNSW): The HNSW object to be updated.
+        vector_chunks (Iterable[pd.DataFrame]): Chunks with `id` and `point` columns.
+        link_chunks (Iterable[pd.DataFrame]): Chunks with `layer`, `source_ref`, `links`.
+        entries (pd.DataFrame): DataFrame with the entry points.
+
+    Raises:
+        ValueError: If a node has more links than the layers of db keep.
+    """
+    n_vectors = _stream_vectors(db, vector_chunks)
+    db._rebuild_sketches()
+    db.layers = []
+    for chunk in link_chunks:
+        _stream_links(db, chunk)
+    _update_n_insertions(db, n_vectors)
+    _update_entry_point(db, entries)
+
+
+def _parsed(values: list) -> list:
+    """
+    Parses the JSON strings of a payload column, and keeps the dicts.
+
+    Raises:
+        json.JSONDecodeError: If a string is not valid JSON.
+    """
+    return [json.loads(v) if isinstance(v, str) else v for v in values]
+
+
+def _decode_points(points: pd.Series) -> np.ndarray:
+    """
+    Decodes the `data.data` arrays of a chunk of points.
+
+    Returns:
+        np.ndarray: An int8 matrix with one row per point.
+    """
+    return np.array([p['data']['data'] for p in _parsed(points.tolist())], dtype=np.int8)
+
+
+def _decode_queues(queues: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes the `queue` lists of [neighbor, distance] pairs of a chunk of links.
+
+    Returns:
+        tuple: The number of pairs of each queue, and all pairs as a float matrix (n, 2).
+    """
+    queue_list = [row['queue'] for row in _parsed(queues.tolist())]
+    lengths = np.array([len(queue) for queue in queue_list], dtype=np.int64)
+    pairs = np.array([item for queue in queue_list for item in queue], dtype=np.float64)
+    return (lengths, pairs.reshape(-1, 2))
+
+
+def _stream_vectors(db: HNSW, vector_chunks: Iterable[pd.DataFrame]) -> int:
+    """
+    Decodes each chunk of vectors at once and stores them by id.
+
+    Returns:
+        int: The number of vectors.
+    """
+    is_packed = isinstance(db.vectors, PackedVectorStore)
+    if is_packed:
+        db.vectors = PackedVectorStore(db.vectors.n_bits)
+    else:
+        db.vectors = []
+    by_id: dict[int, tuple] = {}
+    ids_seen = 0
+
+    for chunk in vector_chunks:
+        data = _decode_points(chunk['point'])
+        # Following methodology defined in Rust.
+        bits, masks = data == -1, data != 0
+        ids = chunk['id'].to_numpy()
+        ids_seen += len(ids)
+
+        if is_packed:
+            rows = zip(ids.tolist(), bits_to_words(bits), bits_to_words(masks))
+        else:
+            code_bytes, mask_bytes = np.packbits(bits, axis=1), np.packbits(masks, axis=1)
+            rows = (
+                (i, int.from_bytes(c.tobytes(), 'big'), int.from_bytes(m.tobytes(), 'big'))
+                for i, c, m in zip(ids.tolist(), code_bytes, mask_bytes)
+            )
+        for i, code, mask in rows:
+            by_id[i] = (code, mask)
+        # Append the contiguous prefix of ids, to free the pending rows early.
+        while len(db.vectors) in by_id:
+            db.vectors.append(by_id.pop(len(db.vectors)))
+
+    if by_id:
+        raise ValueError(f"Vector ids are not contiguous: missing id {len(db.vectors)}.")
+    return ids_seen
+
+
+def _stream_links(db: HNSW, links: pd.DataFrame) -> None:
+    """
+    Writes one chunk of links into the compact layers, sorting all rows of a layer at once.
+
+    Args:
+        db (HNSW): The HNSW object where layers are updated.
+        links (pd.DataFrame): A chunk of links, of any layers.
+    """
+    for lc, df in links.groupby('layer', sort=True):
+        layer = db._mut_layer(lc)
+        sources = df['source_ref'].tolist()
+        rows = np.array([layer.mut_row(e) for e in sources], dtype=np.int64)
+        lengths, pairs = _decode_queues(df['links'])
+        _check_degree(db, lc, int(lengths.max(initial=0)))
+
+        # The Rust queue holds [neighbor, distance] pairs.
+        ids, dists = pairs[:, 0].astype(np.int64), pairs[:, 1]
+        row_of_link = np.repeat(rows, lengths)
+        order = np.lexsort((ids, dists, row_of_link))
+        row_of_link, ids, dists = row_of_link[order], ids[order], dists[order]
+
+        # Position of each link within its row.
+        pos = np.arange(len(order)) - np.searchsorted(row_of_link, row_of_link)
+        layer.ids[row_of_link, pos] = ids
+        layer.dists[row_of_link, pos] = dists
+        layer.degree[rows] = lengths
@@ -0,0 +1,144 @@
+"""
+Exact k-nearest neighbors by brute force, as ground truth for the recall of HNSW.
+
+The packed words of all the stored vectors are compared to all the query rotations with
+`packed_distances`, one chunk of rows at a time, so the memory stays bounded at any
+size. Chunks run on a thread pool: numpy releases the GIL in the kernels, and the
+threads share the vectors, memory-mapped ones included.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+from typing import Sequence
+
+import numpy as np
+
+from hnsw import HNSW, Index
+from packed_vectors import PackedVectorStore, int_to_words, packed_distances
+
+# Rows compared to a query per task. They are views; a task allocates their distances.
+CHUNK_ROWS = 1 << 14
+
+
+class ExactIndex:
+    """
+    Brute-force search over a PackedVectorStore, with the results of `HNSW.search`:
+    [(distance, id)] in ascending order, ties by id. Deleted ids are skipped.
+
+    Queries are (codes, masks) rotations of the `irispacked` variant, or lists of big
+    int rotations of the `irisint` variant.
+    """
+
+    def __init__(
+        self,
+        vectors: PackedVectorStore,
+        deleted: Sequence[Index] = (),
+        chunk_rows: int = CHUNK_ROWS,
+        workers: int | None = None,
+    ):
+        self.vectors = vectors
+        self.deleted = np.array(sorted(deleted), dtype=np.int64)
+        self.chunk_rows = chunk_rows
+        self.workers = workers or os.cpu_count() or 1
+
+    @classmethod
+    def from_hnsw(cls, db: HNSW, n_bits: int | None = None, **kwargs) -> "ExactIndex":
+        """
+        Search the vectors of db, sharing a packed store, or packing `irisint` ones at
+        the width n_bits, by default db.vector_bits, such as prod(DIM).
+        """
+        vectors = db.vectors
+        if not isinstance(vectors, PackedVectorStore):
+            n_bits = n_bits or db.vector_bits
+            if n_bits is None:
+                raise ValueError(
+                    "Packing big-int vectors needs their width: pass n_bits, or create "
+                    "the index with HNSW(vector_bits=prod(DIM))."
+                )
+            store = PackedVectorStore(n_bits, capacity=len(vectors))
+            for vec in vectors:
+                store.append(vec)
+            vectors = store
+        return cls(vectors, sorted(db.deleted), **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def search(self, q_vec, K: int) -> list[tuple[float, int]]:
+        "Return the exact K nearest neighbors of q_vec, as [(distance, vector_id)]."
+        return self.search_many([q_vec], K)[0]
+
+    def search_many(self, queries: Sequence, K: int) -> list[list[tuple[float, int]]]:
+        """
+        Search the queries in order. The chunks of a few queries at a time run on the
+        pool, so that small indexes use all the workers too.
+        """
+        results = []
+        window = 4 * self.workers
+        with ThreadPoolExecutor(self.workers) as pool:
+            for i in range(0, len(queries), window):
+                pending = [
+                    [
+                        pool.submit(self._search_chunk, query, K, start)
+                        for start in range(0, len(self.vectors), self.chunk_rows)
+                    ]
+                    for query in map(self._as_query, queries[i : i + window])
+                ]
+                results += [_merge([f.result() for f in fs], K) for fs in pending]
+        return results
+
+    def _search_chunk(
+        self, query: tuple[np.ndarray, np.ndarray], K: int, start: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        "The (distances, ids) of at least the K nearest live rows of a chunk, and ties."
+        rows = slice(start, start + self.chunk_rows)
+        dists = packed_distances(
+            query, self.vectors.codes[rows], self.vectors.masks[rows]
+        )
+        ids = np.arange(start, start + len(dists))
+        if len(self.deleted):
+            live = ~np.isin(ids, self.deleted)
+            dists, ids = dists[live], ids[live]
+        return _k_smallest(dists, ids, K)
+
+    def _as_query(self, q_vec) -> tuple[np.ndarray, np.ndarray]:
+        if isinstance(q_vec, list):  # Rotations of big ints.
+            n_bits = self.vectors.n_bits
+            codes = np.stack([int_to_words(code, n_bits) for code, _mask in q_vec])
+            masks = np.stack([int_to_words(mask, n_bits) for _code, mask in q_vec])
+            return (codes, masks)
+        return q_vec
+
+
+def _merge(
+    chunks: list[tuple[np.ndarray, np.ndarray]], K: int
+) -> list[tuple[float, int]]:
+    "The K nearest of the chunk results, ties by id."
+    if not chunks:
+        return []
+    dists = np.concatenate([d for d, _ids in chunks])
+    ids = np.concatenate([ids for _d, ids in chunks])
+    order = np.lexsort((ids, dists))[:K]
+    return [(float(d), int(e)) for d, e in zip(dists[order], ids[order])]
+
+
+def _k_smallest(
+    dists: np.ndarray, ids: np.ndarray, K: int
+) -> tuple[np.ndarray, np.ndarray]:
+    "The K smallest distances with their ids, and all those tied with the K-th."
+    if len(dists) <= K:
+        return dists, ids
+    kth = np.partition(dists, K - 1)[K - 1]
+    keep = dists <= kth
+    return dists[keep], ids[keep]
+
+
+def recall(
+    results: Sequence[list[tuple[float, int]]], truth: Sequence[list[tuple[float, int]]]
+) -> float:
+    "The share of the true neighbors found in the results, over all queries."
+    found = sum(
+        len(set(e for _d, e in r) & set(e for _d, e in t))
+        for r, t in zip(results, truth)
+    )
+    total = sum(len(t) for t in truth)
+    return found / total if total else float("nan")
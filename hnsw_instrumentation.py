@@ -0,0 +1,149 @@
+"""
+Optional instrumentation of HNSW operations.
+
+An HNSW built with `instrumentation=Recorder()` reports, for each insert and search, the
+hops, distances and visited nodes of each layer, and the wall-clock latency of the
+whole operation. Without it, the index checks for it once per layer, and does nothing.
+
+The exports are lists of flat dicts, for `pd.DataFrame(...)` in notebooks and in the
+Streamlit stats panel.
+"""
+from collections import deque
+from threading import Lock
+
+import numpy as np
+
+
+class LatencyStats:
+    "The latencies of the last operations, summarized in milliseconds."
+
+    def __init__(self, history: int = 10_000):
+        self.count = 0
+        self.recent = deque(maxlen=history)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.recent.append(seconds)
+
+    def summary(self) -> dict[str, float]:
+        if not self.recent:
+            return {"count": self.count}
+        ms = np.array(self.recent) * 1e3
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean_ms": float(ms.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+        }
+
+    def histogram(self, bins: int = 20) -> tuple[np.ndarray, np.ndarray]:
+        "Return the (counts, edges in milliseconds) of the recent latencies."
+        return np.histogram(np.array(self.recent) * 1e3, bins=bins)
+
+
+class Instrumentation:
+    """
+    The events an HNSW reports when given as its instrumentation. This base ignores
+    them; subclass it to send them elsewhere. op is "insert" or "search".
+    """
+
+    def record_layer(
+        self, op: str, lc: int, n_hops: int, n_distances: int, n_visited: int
+    ):
+        """
+        One layer searched: nodes expanded, distances evaluated (memo hits included),
+        and nodes visited.
+        """
+
+    def record_latency(self, op: str, seconds: float):
+        "One operation done, in seconds of wall-clock time."
+
+
+class Recorder(Instrumentation):
+    "Keep the events of the last `history` operations, per operation and layer."
+
+    LAYER_FIELDS = ("hops", "distances", "visited")
+
+    def __init__(self, history: int = 10_000):
+        self.history = history
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latency: dict[str, LatencyStats] = {}
+            # (op, lc) -> deque of (n_hops, n_distances, n_visited).
+            self.layers: dict[tuple[str, int], deque] = {}
+            # op -> the sums of the counts over all its layers and operations.
+            self.totals: dict[str, list[int]] = {}
+
+    def record_layer(
+        self, op: str, lc: int, n_hops: int, n_distances: int, n_visited: int
+    ):
+        with self._lock:
+            events = self.layers.get((op, lc))
+            if events is None:
+                events = self.layers[(op, lc)] = deque(maxlen=self.history)
+            events.append((n_hops, n_distances, n_visited))
+            totals = self.totals.setdefault(op, [0, 0, 0])
+            totals[0] += n_hops
+            totals[1] += n_distances
+            totals[2] += n_visited
+
+    def record_latency(self, op: str, seconds: float):
+        with self._lock:
+            if op not in self.latency:
+                self.latency[op] = LatencyStats(self.history)
+            self.latency[op].add(seconds)
+
+    # --- Exports ---
+
+    def layer_records(self) -> list[dict[str, int | float | str]]:
+        "One row per operation and layer, with the mean and p50/p95/p99 of each count."
+        with self._lock:
+            layers = {key: np.array(events) for key, events in self.layers.items()}
+        records = []
+        for (op, lc), events in sorted(
+            layers.items(), key=lambda kv: (kv[0][0], -kv[0][1])
+        ):
+            record = {"op": op, "layer": lc, "count": len(events)}
+            for name, values in zip(self.LAYER_FIELDS, events.T):
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                record[f"{name}_mean"] = float(values.mean())
+                record[f"{name}_p50"] = float(p50)
+                record[f"{name}_p95"] = float(p95)
+                record[f"{name}_p99"] = float(p99)
+            records.append(record)
+        return records
+
+    def latency_records(self) -> list[dict[str, int | float | str]]:
+        "One row per operation, with its latency summary in milliseconds."
+        with self._lock:
+            return [{"op": op} | stats.summary() for op, stats in self.latency.items()]
+
+    def latency_histogram(
+        self, op: str, bins: int = 20
+    ) -> tuple[np.ndarray, np.ndarray]:
+        "Return the (counts, edges in milliseconds) of the recent latencies of op."
+        with self._lock:
+            return self.latency[op].histogram(bins)
+
+    def summary(self) -> dict[str, int | float]:
+        """
+        Flat totals in the style of HNSW.get_stats(), such as `search_p99_ms` and
+        `search_hops_per_op`, to add to a row of stats.
+        """
+        summary = {}
+        for record in self.latency_records():
+            op = record.pop("op")
+            summary.update((f"{op}_{k}", v) for k, v in record.items() if k != "count")
+        with self._lock:
+            for op, totals in self.totals.items():
+                n_ops = self.latency[op].count if op in self.latency else 0
+                for name, total in zip(self.LAYER_FIELDS, totals):
+                    summary[f"{op}_{name}_per_op"] = (
+                        total / n_ops if n_ops else float("nan")
+                    )
+        return summary
@@ -0,0 +1,61 @@
+"""
+The bisect-sorted lists that HNSW used as search queues before the heaps of `hnsw.py`.
+They are kept for the benchmarks, to compare with `HNSW.nearest_queue_type` and
+`HNSW.furthest_queue_type`, and to unpickle the indexes of that time, whose layers were
+dicts of FurthestQueue: `hnsw.FurthestQueue` resolves to this module.
+"""
+import bisect
+
+from hnsw import Index
+
+
+class FurthestQueue(list[tuple[float, Index]]):
+    "A list sorted in ascending order, for fast pop of the furthest element."
+
+    def __init__(self, iterable=None, is_ascending=False):
+        if not iterable:
+            super().__init__()
+        else:
+            if not is_ascending:
+                iterable = sorted(iterable)
+            super().__init__(iterable)
+
+    def add(self, dist: float, to: Index):
+        bisect.insort(self, (dist, to))
+
+    def get_furthest(self) -> tuple[float, Index]:
+        return self[-1]
+
+    def take_furthest(self) -> tuple[float, Index]:
+        return self.pop()
+
+    def get_k_nearest(self, k) -> list[tuple[float, Index]]:
+        return self[:k]
+
+    def trim_to_k_nearest(self, k):
+        del self[k:]
+
+
+class NearestQueue(list[tuple[float, Index]]):
+    "A list sorted in descending order, for fast pop of the nearest element."
+
+    def __init__(self, iterable=None, is_descending=False):
+        if not iterable:
+            super().__init__()
+        else:
+            if not is_descending:
+                iterable = sorted(iterable, reverse=True)
+            super().__init__(iterable)
+
+    @staticmethod
+    def from_furthest_queue(furthest_queue: FurthestQueue) -> "NearestQueue":
+        return NearestQueue(reversed(furthest_queue), is_descending=True)
+
+    def add(self, dist: float, to: Index):
+        bisect.insort(self, (dist, to), key=lambda x: -x[0])
+
+    def get_nearest(self) -> tuple[float, Index]:
+        return self[-1]
+
+    def take_nearest(self) -> tuple[float, Index]:
+        return self.pop()
@@ -0,0 +1,460 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+from multiprocessing import shared_memory
+from typing import Iterable, Sequence
+import numpy as np
+
+from hnsw import HNSW, CompactLayer, Index, Query, QUERY_STATS
+from packed_vectors import (
+    PackedVectorStore,
+    WORD_BITS,
+    int_to_words,
+    n_words,
+    words_to_int,
+)
+
+# The search phase of a batch of insertions runs in parallel against the graph as it
+# was at the start of the batch, then the links are applied in order. Bigger batches
+# use the workers better, but the queries of a batch only see each other as peers.
+BATCH_PER_WORKER = 16
+
+
+# Shared memory.
+
+
+class SharedArrays:
+    "Numpy arrays in named shared memory, which other processes attach to by spec()."
+
+    def __init__(self):
+        self.blocks: dict[str, shared_memory.SharedMemory] = {}
+        self.arrays: dict[str, np.ndarray] = {}
+        self._specs: dict[str, tuple] = {}
+
+    def create(self, key: str, shape: tuple, dtype, fill=0) -> np.ndarray:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.fill(fill)
+        self.blocks[key], self.arrays[key] = block, array
+        self._specs[key] = (block.name, shape, np.dtype(dtype).str)
+        return array
+
+    def spec(self) -> dict[str, tuple]:
+        return dict(self._specs)
+
+    @classmethod
+    def attach(cls, spec: dict[str, tuple]) -> "SharedArrays":
+        shared = cls()
+        for key, (name, shape, dtype) in spec.items():
+            block = shared_memory.SharedMemory(name=name)
+            shared.blocks[key] = block
+            shared.arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return shared
+
+    def close(self, unlink: bool = False):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks.clear()
+
+
+class _RowMap:
+    "The node-to-row map of a sparse layer, as an array with -1 for absent nodes."
+
+    def __init__(self, row_of: np.ndarray, n_rows: int):
+        self.row_of = row_of
+        self.n_rows = n_rows
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.row_of >= 0).tolist())
+
+    def get(self, e: Index) -> int | None:
+        r = int(self.row_of[e]) if e < len(self.row_of) else -1
+        return r if r >= 0 else None
+
+    def __setitem__(self, e: Index, r: int):
+        self.row_of[e] = r
+        self.n_rows += 1
+
+    def items(self):
+        return ((e, int(self.row_of[e])) for e in self)
+
+
+class SharedLayer(CompactLayer):
+    "A CompactLayer over shared arrays, which cannot grow beyond their capacity."
+
+    def _grow(self, capacity: int):
+        raise RuntimeError("The shared layer is full.")
+
+
+class _IntVectors:
+    "The big-int vectors of a list, such as `irisint` (code, mask), read from words."
+
+    def __init__(self, words: np.ndarray, n_bits: int, size: int, is_tuple: bool):
+        self.words = words  # (parts, N, n_words)
+        self.n_bits = n_bits
+        self.size = size
+        self.is_tuple = is_tuple
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int):
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        parts = tuple(words_to_int(w[i], self.n_bits) for w in self.words)
+        return parts if self.is_tuple else parts[0]
+
+
+def share_db(
+    db: HNSW, n_vectors: int, layer_rows: Sequence[int], int_bits: int = 0
+) -> SharedArrays:
+    """
+    Move the vectors and the layers of db into shared memory, with room for n_vectors
+    vectors and layer_rows[lc] rows in each layer; db keeps working on them in place.
+    Vectors of big ints are copied as words of int_bits, and the list stays in db.
+
+    Workers rebuild db with `attach_db(db_spec(db, shared))`. Release with unshare_db.
+    On failure, the segments already made are released before the error is raised.
+    """
+    shared = SharedArrays()
+    try:
+        if isinstance(db.vectors, PackedVectorStore):
+            store = db.vectors
+            shape = (n_vectors, store.n_words)
+            codes = shared.create("vector_codes", shape, np.uint64)
+            masks = shared.create("vector_masks", shape, np.uint64)
+            codes[: store.size] = store.codes
+            masks[: store.size] = store.masks
+            # In place, to keep `store.distance_batch` valid.
+            store._codes, store._masks = codes, masks
+        else:
+            parts = _int_vector_parts(db.vectors[0])
+            shape = (len(parts), n_vectors, n_words(int_bits))
+            words = shared.create("vector_words", shape, np.uint64)
+            for i, vec in enumerate(db.vectors):
+                write_int_vector(words, i, vec)
+
+        for lc, n_rows in enumerate(layer_rows):
+            old = db.layers[lc]
+            prefix = f"layer_{lc}_"
+            ids = shared.create(prefix + "ids", (n_rows, old.max_links), np.int32)
+            dists = shared.create(prefix + "dists", (n_rows, old.max_links), np.float64)
+            degree = shared.create(prefix + "degree", (n_rows,), np.int32, fill=-1)
+            arrays = old.to_arrays()
+            n = len(arrays["degree"])
+            ids[:n] = arrays["ids"]
+            dists[:n] = arrays["dists"]
+            degree[:n] = arrays["degree"]
+
+            layer = SharedLayer(old.max_links, dense=old.rows is None)
+            layer.ids, layer.dists, layer.degree = ids, dists, degree
+            layer.n_nodes = len(old)
+            if old.rows is not None:
+                row_of = shared.create(
+                    prefix + "row_of", (n_vectors,), np.int32, fill=-1
+                )
+                row_of[arrays["nodes"]] = np.arange(n, dtype=np.int32)
+                layer.rows = _RowMap(row_of, n)
+            db.layers[lc] = layer
+    except BaseException:
+        # Release the segments made so far, and give db its private arrays back.
+        unshare_db(db, shared)
+        raise
+    return shared
+
+
+def unshare_db(db: HNSW, shared: SharedArrays):
+    "Copy the vectors and layers of db back into private memory, and release shared."
+    if "vector_codes" in shared.arrays:
+        store = db.vectors
+        store._codes, store._masks = store.codes.copy(), store.masks.copy()
+    for lc, layer in enumerate(db.layers):
+        if isinstance(layer, SharedLayer):
+            arrays = {k: v.copy() for k, v in layer.to_arrays().items()}
+            db.layers[lc] = CompactLayer.from_arrays(**arrays)
+    shared.close(unlink=True)
+
+
+def _int_vector_parts(vec) -> tuple[int, ...]:
+    parts = vec if isinstance(vec, tuple) else (vec,)
+    if not all(isinstance(x, int) for x in parts):
+        raise TypeError(
+            "Workers need a PackedVectorStore, or vectors of ints such as "
+            "`irisint` (code, mask)."
+        )
+    return parts
+
+
+def int_vector_bits(vectors: Iterable) -> int:
+    "The number of bits to hold any part of vectors of ints, such as `irisint`."
+    return max(
+        (x.bit_length() for vec in vectors for x in _int_vector_parts(vec)), default=1
+    )
+
+
+def write_int_vector(words: np.ndarray, i: int, vec):
+    "Write the ints of a vector as row i of the (parts, N, n_words) shared words."
+    n_bits = words.shape[-1] * WORD_BITS
+    for part, x in enumerate(_int_vector_parts(vec)):
+        words[part, i] = int_to_words(x, n_bits)
+
+
+def db_spec(db: HNSW, shared: SharedArrays) -> dict:
+    "Everything a worker needs to rebuild db over the shared arrays."
+    vectors = db.vectors
+    if isinstance(vectors, PackedVectorStore):
+        vector_spec = ("packed", vectors.n_bits, vectors.size)
+    else:
+        n_bits = shared.arrays["vector_words"].shape[-1] * WORD_BITS
+        vector_spec = ("ints", n_bits, len(vectors), isinstance(vectors[0], tuple))
+    batch_func = db._distance_batch_func
+    # Rebound to the store of the worker.
+    batch_on_store = (
+        getattr(batch_func, "__func__", None) is PackedVectorStore.distance_batch
+    )
+    return {
+        "cls": type(db),
+        "params": {
+            "M": db.M,
+            "efConstruction": db.efConstruction,
+            "m_L": db.m_L,
+            "neighbor_heuristic": db.neighbor_heuristic,
+            "extend_candidates": db.extend_candidates,
+            "keep_pruned_connections": db.keep_pruned_connections,
+        },
+        "vector_to_query_func": db._vector_to_query_func,
+        "Mmax": (db.Mmax, db.Mmax0),
+        "count_comparisons": db.count_comparisons,
+        "distance_func": db._distance_func,
+        "distance_batch_func": None if batch_on_store else batch_func,
+        "batch_on_store": batch_on_store,
+        "distance_bound_func": db._distance_bound_func,
+        "vectors": vector_spec,
+        "entry_point": list(db.entry_point),
+        "deleted": set(db.deleted),
+        "layers": [
+            (layer.max_links, layer.rows is None, len(layer.rows or ()))
+            for layer in db.layers
+            if isinstance(layer, SharedLayer)
+        ],
+        "arrays": shared.spec(),
+    }
+
+
+def attach_db(spec: dict) -> tuple[HNSW, SharedArrays]:
+    "Rebuild a db from db_spec in a worker process, over the shared arrays."
+    shared = SharedArrays.attach(spec["arrays"])
+    arrays = shared.arrays
+    db = spec["cls"](
+        distance_func=spec["distance_func"],
+        distance_batch_func=spec["distance_batch_func"],
+        distance_bound_func=spec["distance_bound_func"],
+        vector_to_query_func=spec["vector_to_query_func"],
+        **spec["params"],
+    )
+    db.Mmax, db.Mmax0 = spec["Mmax"]
+    db.count_comparisons = spec["count_comparisons"]
+    db.entry_point[:] = spec["entry_point"]
+    db.deleted = spec["deleted"]
+
+    kind, n_bits, size, *rest = spec["vectors"]
+    if kind == "packed":
+        db.vectors = PackedVectorStore.from_arrays(
+            n_bits, arrays["vector_codes"], arrays["vector_masks"], size=size
+        )
+        if spec["batch_on_store"]:
+            db._distance_batch_func = db.vectors.distance_batch
+    else:
+        db.vectors = _IntVectors(arrays["vector_words"], n_bits, size, *rest)
+
+    for lc, (max_links, dense, n_rows) in enumerate(spec["layers"]):
+        prefix = f"layer_{lc}_"
+        layer = SharedLayer(max_links, dense)
+        layer.ids = arrays[prefix + "ids"]
+        layer.dists = arrays[prefix + "dists"]
+        layer.degree = arrays[prefix + "degree"]
+        if not dense:
+            layer.rows = _RowMap(arrays[prefix + "row_of"], n_rows)
+        db.layers.append(layer)
+    return db, shared
+
+
+# Parallel insertion.
+
+_worker_db: HNSW | None = None
+_worker_shared: SharedArrays | None = None
+_worker_n_shared_layers = 0
+
+
+def _init_worker(spec: dict):
+    global _worker_db, _worker_shared, _worker_n_shared_layers
+    _worker_db, _worker_shared = attach_db(spec)
+    _worker_n_shared_layers = len(_worker_db.layers)
+
+
+def _search_chunk(
+    entry_point: list[Index],
+    new_layers: list[CompactLayer],
+    items: list[tuple[Index, Query, int, list[Index], list[int]]],
+) -> tuple[list[list[tuple[int, list[tuple[float, Index]]]]], dict[str, int]]:
+    """
+    Run the search phase of insert for items (id, query, layer, peer ids, peer layers),
+    in a worker. new_layers are the layers created since the graph was shared.
+    """
+    db = _worker_db
+    db.layers[_worker_n_shared_layers:] = new_layers
+    db.entry_point[:] = entry_point
+    db._reset_stats()
+
+    plans = []
+    for _q, q_vec, l, peer_ids, peer_levels in items:
+        peers = []
+        if peer_ids:
+            peer_dists = db._distance_batch(q_vec, peer_ids)
+            peers = list(zip(peer_dists, peer_ids, peer_levels))
+        plans.append(db._insert_search(q_vec, l, peers))
+
+    return plans, {k: getattr(db, k) for k in QUERY_STATS}
+
+
+def parallel_insert(
+    db: HNSW, queries: Sequence[Query], workers: int, batch_size: int | None = None
+) -> list[Index]:
+    "See `HNSW.insert_many`."
+    queries = list(queries)
+    ids = []
+    if queries and not db.entry_point:
+        # The first node only creates the layers.
+        ids.append(db.insert(queries.pop(0)))
+    if not queries:
+        return ids
+    if batch_size is None:
+        batch_size = BATCH_PER_WORKER * workers
+
+    # Draw the layers up front, to give the shared layers their final capacity.
+    levels = [db._select_layer() for _ in queries]
+    n_vectors = len(db.vectors) + len(queries)
+    layer_rows = [n_vectors]
+    for lc in range(1, len(db.layers)):
+        n_above = sum(len(layer) for layer in db.layers[lc + 1 :])
+        n_new = sum(l >= lc for l in levels)
+        # Nodes of the layers above may gain a row here, such as a lone entry point.
+        layer_rows.append(len(db.layers[lc]) + n_new + n_above + 1)
+
+    vectors = [db._query_to_vector_func(q_vec) for q_vec in queries]
+    int_bits = 0
+    if not isinstance(db.vectors, PackedVectorStore):
+        int_bits = db.vector_bits or int_vector_bits(db.vectors + vectors)
+
+    shared = share_db(db, n_vectors, layer_rows, int_bits)
+    try:
+        int_words = shared.arrays.get("vector_words")
+        new_ids = []
+        for vec in vectors:
+            q = db._mut_insert_vector(vec)
+            if int_words is not None:
+                write_int_vector(int_words, q, vec)
+            new_ids.append(q)
+        del vectors
+
+        spec = db_spec(db, shared)
+        n_shared = len(spec["layers"])
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(spec,)
+        ) as pool:
+            for start in range(0, len(queries), batch_size):
+                batch = range(start, min(start + batch_size, len(queries)))
+                items = [
+                    (
+                        new_ids[i],
+                        queries[i],
+                        levels[i],
+                        new_ids[start:i],
+                        levels[start:i],
+                    )
+                    for i in batch
+                ]
+                chunk = -(-len(items) // workers)
+                futures = [
+                    pool.submit(
+                        _search_chunk,
+                        list(db.entry_point),
+                        db.layers[n_shared:],
+                        items[i : i + chunk],
+                    )
+                    for i in range(0, len(items), chunk)
+                ]
+                plans = []
+                for future in futures:
+                    chunk_plans, stats = future.result()
+                    plans.extend(chunk_plans)
+                    for k, v in stats.items():
+                        setattr(db, k, getattr(db, k) + v)
+
+                for i, plan in zip(batch, plans):
+                    db._insert_link(new_ids[i], levels[i], plan)
+    finally:
+        unshare_db(db, shared)
+    return ids + new_ids
+
+
+# Parallel search.
+
+# Chunks of queries per worker, to balance the load at a small pickling cost.
+CHUNKS_PER_WORKER = 4
+
+
+def _search_queries(
+    queries: list[Query], K: int, ef: int | None
+) -> list[tuple[list[tuple[float, int]], dict[str, int | float]]]:
+    "Search the queries in a worker, with the stats of each."
+    return [_worker_db._search_counted(q_vec, K, ef) for q_vec in queries]
+
+
+def parallel_search(
+    db: HNSW, queries: Sequence[Query], K: int, ef: int | None, workers: int
+) -> tuple[list[list[tuple[float, int]]], list[dict[str, int | float]]]:
+    "See `HNSW.search_many`."
+    queries = list(queries)
+    if not queries or not db.entry_point:
+        return db.search_many(queries, K, ef)
+
+    # Share a copy, and leave db and its arrays, maybe memory-mapped, untouched.
+    view = copy.copy(db)
+    view.layers = list(db.layers)
+    int_bits = 0
+    if isinstance(db.vectors, PackedVectorStore):
+        view.vectors = copy.copy(db.vectors)
+    else:
+        int_bits = db.vector_bits or int_vector_bits(db.vectors)
+    layer_rows = [len(db.vectors)] + [len(layer) for layer in db.layers[1:]]
+    shared = share_db(view, len(db.vectors), layer_rows, int_bits)
+    try:
+        spec = db_spec(view, shared)
+        chunk = -(-len(queries) // (workers * CHUNKS_PER_WORKER))
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(spec,)
+        ) as pool:
+            futures = [
+                pool.submit(_search_queries, queries[i : i + chunk], K, ef)
+                for i in range(0, len(queries), chunk)
+            ]
+            results, stats = [], []
+            for future in futures:
+                for result, query_stats in future.result():
+                    results.append(result)
+                    stats.append(query_stats)
+    finally:
+        del view  # Its arrays hold the shared memory.
+        shared.close(unlink=True)
+
+    db.n_searches += len(queries)
+    for k in QUERY_STATS:
+        setattr(db, k, getattr(db, k) + sum(s[k] for s in stats))
+    return results, stats
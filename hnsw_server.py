@@ -0,0 +1,416 @@
+"""
+An asyncio service around one HNSW, over a Unix socket or localhost TCP.
+
+Concurrent searches are grouped into micro-batches, within a time window and up to a
+size, and each batch runs as one `search_many` call on an executor, so the event loop
+never blocks.
+Inserts run one after the other on their own thread. A lock keeps the search batches
+and the inserts from running on db at the same time.
+
+A frame is the lengths of its JSON and binary parts, then the parts. The JSON holds the
+message, with tagged tuples, big ints as hex, errors by name, and numpy arrays as
+(dtype, shape, offset) into the binary part, read back with np.frombuffer. Decoding runs
+no code from the peer, unlike pickle.
+"""
+import asyncio
+import builtins
+from concurrent.futures import Executor, ThreadPoolExecutor
+import itertools
+import json
+import struct
+from threading import Lock
+from time import perf_counter
+from typing import Any, Sequence
+
+import numpy as np
+
+from hnsw import HNSW, Query
+from hnsw_instrumentation import LatencyStats
+
+_FRAME_HEADER = struct.Struct("!II")
+
+# Array dtypes of the frames: bools, ints and floats.
+_ARRAY_KINDS = "biuf"
+
+
+def _encode(message: Any, buffers: list[bytes], offset: list[int]) -> Any:
+    "The JSON value of message; the bytes of its arrays are appended to buffers."
+    if isinstance(message, bool) or message is None or isinstance(message, str):
+        return message
+    if isinstance(message, int):
+        return message if message.bit_length() < 53 else {"int": hex(message)}
+    if isinstance(message, float):
+        return message
+    if isinstance(message, np.generic):
+        return _encode(message.item(), buffers, offset)
+    if isinstance(message, np.ndarray) and message.dtype.kind in _ARRAY_KINDS:
+        data = np.ascontiguousarray(message).tobytes()
+        buffers.append(data)
+        offset[0] += len(data)
+        return {"array": [message.dtype.str, message.shape, offset[0] - len(data)]}
+    if isinstance(message, tuple):
+        return {"tuple": [_encode(x, buffers, offset) for x in message]}
+    if isinstance(message, list):
+        return [_encode(x, buffers, offset) for x in message]
+    if isinstance(message, dict) and all(isinstance(k, str) for k in message):
+        return {"dict": {k: _encode(v, buffers, offset) for k, v in message.items()}}
+    if isinstance(message, Exception):
+        return {"error": [type(message).__name__, str(message)]}
+    raise TypeError(f"Cannot send a {type(message).__name__}.")
+
+
+def _decode(value: Any, data: bytes) -> Any:
+    if isinstance(value, list):
+        return [_decode(x, data) for x in value]
+    if not isinstance(value, dict):
+        return value
+    ((tag, body),) = value.items()
+    if tag == "int":
+        return int(body, 16)
+    if tag == "tuple":
+        return tuple(_decode(x, data) for x in body)
+    if tag == "dict":
+        return {k: _decode(v, data) for k, v in body.items()}
+    if tag == "array":
+        dtype, shape, offset = np.dtype(body[0]), tuple(body[1]), body[2]
+        if dtype.kind not in _ARRAY_KINDS:
+            raise ValueError(f"Unsupported array dtype {dtype}.")
+        count = int(np.prod(shape))
+        return np.frombuffer(data, dtype, count, offset).reshape(shape)
+    if tag == "error":
+        name, text = body
+        error = getattr(builtins, name, None)
+        if isinstance(error, type) and issubclass(error, Exception):
+            return error(text)
+        return RuntimeError(f"{name}: {text}")
+    raise ValueError(f"Unknown tag {tag!r}.")
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Any:
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    n_json, n_data = _FRAME_HEADER.unpack(header)
+    text = await reader.readexactly(n_json)
+    data = await reader.readexactly(n_data)
+    try:
+        return _decode(json.loads(text), data)
+    except (TypeError, KeyError, IndexError) as e:
+        raise ValueError("Malformed frame.") from e
+
+
+def _write_frame(writer: asyncio.StreamWriter, message: Any):
+    buffers: list[bytes] = []
+    text = json.dumps(_encode(message, buffers, [0])).encode()
+    data = b"".join(buffers)
+    writer.write(_FRAME_HEADER.pack(len(text), len(data)) + text + data)
+
+
+class HNSWServer:
+    """
+    Serve search, insert, stats and metrics requests on db.
+
+    Searches waiting within batch_window seconds of the first one, up to max_batch,
+    run together through `db.search_many` on executor (one thread by default, shut down
+    with the server; a given one is left to its owner). Metrics give the latency of each
+    request from its arrival to its result, queue depths, and batch sizes.
+    """
+
+    def __init__(
+        self,
+        db: HNSW,
+        batch_window: float = 0.002,
+        max_batch: int = 32,
+        executor: Executor | None = None,
+    ):
+        self.db = db
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._owns_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(1)
+        # One thread keeps the inserts serialized.
+        self._insert_executor = ThreadPoolExecutor(1)
+        # Held by each search batch and each insert batch.
+        self._db_lock = Lock()
+        self._search_queue: asyncio.Queue = asyncio.Queue()
+        self._insert_queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._server: asyncio.AbstractServer | None = None
+
+        # Metrics.
+        self.latency = {"search": LatencyStats(), "insert": LatencyStats()}
+        self.max_queue_depth = {"search": 0, "insert": 0}
+        self.n_search_batches = 0
+        self.n_batched_searches = 0
+
+    async def start(
+        self, path: str | None = None, host: str = "127.0.0.1", port: int = 0
+    ) -> asyncio.AbstractServer:
+        "Listen on the Unix socket path if given, else on host:port (0 picks a port)."
+        self._tasks = [
+            asyncio.create_task(self._search_loop()),
+            asyncio.create_task(self._insert_loop()),
+        ]
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._insert_executor.shutdown()
+        if self._owns_executor:
+            self.executor.shutdown()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "search": self.latency["search"].summary(),
+            "insert": self.latency["insert"].summary(),
+            "search_queue_depth": self._search_queue.qsize(),
+            "insert_queue_depth": self._insert_queue.qsize(),
+            "max_search_queue_depth": self.max_queue_depth["search"],
+            "max_insert_queue_depth": self.max_queue_depth["insert"],
+            "n_search_batches": self.n_search_batches,
+            "mean_search_batch": (
+                self.n_batched_searches / self.n_search_batches
+                if self.n_search_batches
+                else float("nan")
+            ),
+        }
+
+    # --- Connections ---
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        "Read the requests of a connection; each one answers when done, in any order."
+        pending = set()
+        try:
+            while True:
+                request_id, op, args = await _read_frame(reader)
+                task = asyncio.create_task(self._answer(writer, request_id, op, args))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # Closed, or a malformed frame.
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def _answer(
+        self, writer: asyncio.StreamWriter, request_id: int, op: str, args
+    ):
+        try:
+            result = (True, await self._dispatch(op, args))
+        except Exception as e:
+            result = (False, e)
+        if not writer.is_closing():
+            _write_frame(writer, (request_id,) + result)
+            await writer.drain()
+
+    async def _dispatch(self, op: str, args: tuple) -> Any:
+        if op in ("search", "insert"):
+            queue = self._search_queue if op == "search" else self._insert_queue
+            future = asyncio.get_running_loop().create_future()
+            await queue.put((args, future, perf_counter()))
+            self.max_queue_depth[op] = max(self.max_queue_depth[op], queue.qsize())
+            return await future
+        if op == "stats":
+            return self.db.get_stats()
+        if op == "metrics":
+            return self.metrics()
+        raise ValueError(f"Unknown operation {op!r}")
+
+    # --- Queues ---
+
+    async def _take_batch(self, queue: asyncio.Queue, window: float) -> list:
+        "Wait for one request, then take more for up to window seconds or max_batch."
+        batch = [await queue.get()]
+        deadline = asyncio.get_running_loop().time() + window
+        while len(batch) < self.max_batch:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _search_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._take_batch(self._search_queue, self.batch_window)
+            self.n_search_batches += 1
+            self.n_batched_searches += len(batch)
+            results = await loop.run_in_executor(
+                self.executor,
+                self._locked,
+                _run_search_batch,
+                self.db,
+                [a for a, _f, _t in batch],
+            )
+            self._resolve("search", batch, results)
+
+    async def _insert_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # No window: the inserts waiting already go in one executor call.
+            batch = await self._take_batch(self._insert_queue, 0.0)
+            results = await loop.run_in_executor(
+                self._insert_executor,
+                self._locked,
+                _run_batch,
+                self.db.insert,
+                [a for a, _f, _t in batch],
+            )
+            self._resolve("insert", batch, results)
+
+    def _locked(self, func, *args):
+        with self._db_lock:
+            return func(*args)
+
+    def _resolve(self, op: str, batch: list, results: list[tuple[bool, Any]]):
+        now = perf_counter()
+        for (_args, future, start), (ok, result) in zip(batch, results):
+            self.latency[op].add(now - start)
+            if future.cancelled():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+
+def _run_batch(func, batch_args: list[tuple]) -> list[tuple[bool, Any]]:
+    "Call func on each args in the executor, catching errors per request."
+    results = []
+    for args in batch_args:
+        try:
+            results.append((True, func(*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+def _run_search_batch(db: HNSW, batch_args: list[tuple]) -> list[tuple[bool, Any]]:
+    """
+    Run the searches (q_vec, K, ef) in the executor, with one search_many per (K, ef).
+    A failed search_many is retried one query at a time, to fail only the bad ones.
+    """
+    groups: dict[tuple, list[int]] = {}
+    for i, (_q_vec, K, ef) in enumerate(batch_args):
+        groups.setdefault((K, ef), []).append(i)
+    results: list[tuple[bool, Any]] = [None] * len(batch_args)
+    for (K, ef), indices in groups.items():
+        args = [batch_args[i] for i in indices]
+        try:
+            found, _stats = db.search_many([q_vec for q_vec, _K, _ef in args], K, ef)
+            group_results = [(True, result) for result in found]
+        except Exception:
+            group_results = _run_batch(db.search, args)
+        for i, result in zip(indices, group_results):
+            results[i] = result
+    return results
+
+
+class HNSWClient:
+    "A client of HNSWServer, whose concurrent requests share one connection."
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader, self._writer = reader, writer
+        self._ids = itertools.count()
+        self._pending: dict[int, asyncio.Future] = {}
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(
+        cls, path: str | None = None, host: str = "127.0.0.1", port: int | None = None
+    ) -> "HNSWClient":
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def close(self):
+        self._writer.close()
+        self._read_task.cancel()
+
+    async def search(
+        self, q_vec: Query, K: int, ef: int | None = None
+    ) -> list[tuple[float, int]]:
+        return await self._call("search", q_vec, K, ef)
+
+    async def insert(self, q_vec: Query) -> int:
+        return await self._call("insert", q_vec)
+
+    async def stats(self) -> dict[str, int | float]:
+        return await self._call("stats")
+
+    async def metrics(self) -> dict[str, Any]:
+        return await self._call("metrics")
+
+    async def _call(self, op: str, *args) -> Any:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        _write_frame(self._writer, (request_id, op, args))
+        await self._writer.drain()
+        return await future
+
+    async def _read_loop(self):
+        try:
+            while True:
+                request_id, ok, result = await _read_frame(self._reader)
+                future = self._pending.pop(request_id)
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for future in self._pending.values():
+                future.set_exception(
+                    ConnectionError("The server closed the connection.")
+                )
+            self._pending.clear()
+
+
+async def run_load(
+    client: HNSWClient,
+    queries: Sequence[Query],
+    n_requests: int,
+    concurrency: int = 32,
+    K: int = 5,
+    ef: int | None = None,
+    insert_every: int = 0,
+) -> dict[str, float]:
+    """
+    Send n_requests from `concurrency` concurrent tasks, cycling over queries, with an
+    insert every insert_every requests (0 for none). Return the throughput and the
+    latencies seen by the client.
+    """
+    latencies = LatencyStats(history=n_requests)
+    counter = itertools.count()
+
+    async def worker():
+        while (i := next(counter)) < n_requests:
+            q_vec = queries[i % len(queries)]
+            start = perf_counter()
+            if insert_every and i % insert_every == insert_every - 1:
+                await client.insert(q_vec)
+            else:
+                await client.search(q_vec, K, ef)
+            latencies.add(perf_counter() - start)
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = perf_counter() - start
+    return {"requests_per_sec": n_requests / duration, **latencies.summary()}
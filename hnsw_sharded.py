@@ -0,0 +1,232 @@
+import json
+import math
+import multiprocessing
+import os
+from typing import Any, Sequence
+
+from hnsw import HNSW, Index, Query
+
+
+class ShardedHNSW:
+    """
+    An index partitioned across worker processes, each owning its own HNSW.
+
+    Inserts go round-robin: the global id g lives in shard g % n_shards under the local
+    id g // n_shards, so ids are globally unique without a mapping table. A search fans
+    out to all shards, and their (distance, id) lists are merged into a global top-K.
+
+    kwargs are passed to each HNSW, and must be picklable: module-level functions, or
+    `vector_store=store, distance_batch_func=store.distance_batch` (one copy per shard).
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, n_shards: int, **kwargs):
+        self._start(n_shards, None, False, kwargs)
+
+    def _start(self, n_shards: int, path: str | None, mmap: bool, kwargs: dict):
+        "Start the shard processes, with new indexes or loading them from path."
+        self.n_shards = n_shards
+        self.n_searches = 0
+        self._conns = []
+        self._procs = []
+        for s in range(n_shards):
+            shard_path = None if path is None else self._shard_path(path, s)
+            conn, child_conn = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_shard_main,
+                args=(child_conn, shard_path, mmap, kwargs),
+                daemon=True,
+            )
+            proc.start()
+            self._conns.append(conn)
+            self._procs.append(proc)
+        # Each shard answers once its index is created or loaded.
+        errors = []
+        for s in range(n_shards):
+            try:
+                self._recv(s)
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            self.close()
+            raise errors[0]
+        self.size = sum(self._call_all("db_size"))
+
+    def __enter__(self) -> "ShardedHNSW":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "Stop the shard processes."
+        for conn in self._conns:
+            try:
+                conn.send((None, ()))
+            except OSError:
+                pass  # The shard has exited already.
+        for proc in self._procs:
+            proc.join()
+        self._conns, self._procs = [], []
+
+    def __len__(self) -> int:
+        return self.size
+
+    # --- Shard calls ---
+
+    def _send(self, s: int, method: str, *args):
+        self._conns[s].send((method, args))
+
+    def _recv(self, s: int) -> Any:
+        ok, result = self._conns[s].recv()
+        if not ok:
+            raise result
+        return result
+
+    def _call_all(self, method: str, *args) -> list:
+        "Call a method of every shard in parallel, and return their results."
+        for s in range(self.n_shards):
+            self._send(s, method, *args)
+        return [self._recv(s) for s in range(self.n_shards)]
+
+    def _global_id(self, s: int, local: Index) -> Index:
+        return local * self.n_shards + s
+
+    # --- Index operations ---
+
+    def insert(self, q_vec: Query) -> Index:
+        g = self.size
+        s = g % self.n_shards
+        self._send(s, "insert", q_vec)
+        local = self._recv(s)
+        if self._global_id(s, local) != g:
+            raise RuntimeError("Shards were modified out of order.")
+        self.size += 1
+        return g
+
+    def insert_many(self, queries: Sequence[Query]) -> list[Index]:
+        "Insert the queries in order, each shard inserting its share in parallel."
+        start = self.size
+        ids = list(range(start, start + len(queries)))
+        firsts = [(s - start) % self.n_shards for s in range(self.n_shards)]
+        for s, first in enumerate(firsts):
+            self._send(s, "insert_many", list(queries[first :: self.n_shards]))
+        for s, first in enumerate(firsts):
+            got = [self._global_id(s, local) for local in self._recv(s)]
+            if got != ids[first :: self.n_shards]:
+                raise RuntimeError("Shards were modified out of order.")
+        self.size += len(queries)
+        return ids
+
+    def delete(self, g: Index):
+        "Mark g as deleted in its shard; see HNSW.delete."
+        s = g % self.n_shards
+        self._send(s, "delete", g // self.n_shards)
+        self._recv(s)
+
+    def repair(self, max_deleted: int | None = None) -> int:
+        "Repair the deletions of all shards in parallel; see HNSW.repair."
+        return sum(self._call_all("repair", max_deleted))
+
+    def search(
+        self, q_vec: Query, K: int, ef: int | None = None, sketch: bool = False
+    ) -> list[tuple[float, int]]:
+        "Return the K nearest neighbors of q_vec over all shards, as [(distance, id)]."
+        self.n_searches += 1
+        results = self._call_all("search", q_vec, K, ef, sketch)
+        merged = [
+            (dist, self._global_id(s, local))
+            for s, result in enumerate(results)
+            for dist, local in result
+        ]
+        merged.sort()
+        return merged[:K]
+
+    # --- Stats ---
+
+    def get_params(self) -> dict[str, int | float]:
+        return self._call_all("get_params")[0] | {"n_shards": self.n_shards}
+
+    def get_shard_stats(self) -> list[dict[str, int | float]]:
+        return self._call_all("get_stats")
+
+    def get_stats(self) -> dict[str, int | float]:
+        "Stats summed over the shards; a fanned-out search counts once in n_searches."
+        stats = _merge_stats(self.get_shard_stats())
+        stats["n_searches"] = self.n_searches
+        stats["n_shards"] = self.n_shards
+        return stats
+
+    def reset_stats(self) -> dict[str, int | float]:
+        "Return the current stats, then reset them."
+        stats = self.get_stats()
+        self._call_all("reset_stats")
+        self.n_searches = 0
+        return stats
+
+    # --- Persistence ---
+
+    @staticmethod
+    def _shard_path(path: str, s: int) -> str:
+        return os.path.join(path, f"shard_{s}")
+
+    def save(self, path: str):
+        "Save each shard with HNSW.save into a subdirectory of `path`, in parallel."
+        os.makedirs(path, exist_ok=True)
+        for s in range(self.n_shards):
+            self._send(s, "save", self._shard_path(path, s))
+        for s in range(self.n_shards):
+            self._recv(s)
+        header = {"format_version": self.FORMAT_VERSION, "n_shards": self.n_shards}
+        # Written last, so an interrupted save cannot be loaded.
+        with open(os.path.join(path, "sharded.json"), "w") as f:
+            json.dump(header, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs) -> "ShardedHNSW":
+        "Load an index saved by save(), each shard with HNSW.load(mmap=mmap, **kwargs)."
+        with open(os.path.join(path, "sharded.json")) as f:
+            header = json.load(f)
+        if header["format_version"] != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported sharded format version {header['format_version']} in {path}"
+            )
+        index = cls.__new__(cls)
+        index._start(header["n_shards"], path, mmap, kwargs)
+        return index
+
+
+def _shard_main(conn, path: str | None, mmap: bool, kwargs: dict):
+    "Serve the method calls of ShardedHNSW on one HNSW, until a None method."
+    try:
+        db = HNSW(**kwargs) if path is None else HNSW.load(path, mmap=mmap, **kwargs)
+    except Exception as e:
+        conn.send((False, e))
+        conn.close()
+        return
+    conn.send((True, None))
+    while True:
+        method, args = conn.recv()
+        if method is None:
+            break
+        try:
+            conn.send((True, getattr(db, method)(*args)))
+        except Exception as e:
+            conn.send((False, e))
+    conn.close()
+
+
+def _merge_stats(shard_stats: list[dict[str, int | float]]) -> dict[str, int | float]:
+    "Sum the counts, keep the max of n_layers and durations, average the ratios."
+    merged = {}
+    for key in shard_stats[0]:
+        values = [stats[key] for stats in shard_stats]
+        if key.startswith("n_") and key != "n_layers" or key == "db_size":
+            merged[key] = sum(values)
+        elif key in ("n_layers", "duration_sec"):
+            merged[key] = max(values)
+        else:
+            values = [v for v in values if not math.isnan(v)]
+            merged[key] = sum(values) / len(values) if values else float("nan")
+    return merged
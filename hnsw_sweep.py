@@ -0,0 +1,320 @@
+"""
+Resumable sweeps of M, efConstruction and efSearch on a local process pool.
+
+Each (M, efConstruction) is one task. Its index is built once and grown through the db
+sizes in order, and at each size, every efSearch runs the same noisy queries. A size is
+done when its results are written, after its index is saved, so a sweep stopped at any
+point resumes from the last done size of each task: call `run_sweep` on the same path.
+
+Layout of the sweep directory:
+
+    sweep.json                                  The config, written last on creation.
+    data_codes.npy, data_masks.npy              The templates, inserted in order.
+    results/M{M}_efC{efC}_size{n}.parquet       The rows of one size, or .pkl without
+                                                a parquet engine such as pyarrow.
+    indexes/M{M}_efC{efC}/size_{n}/             HNSW.save of the last done sizes.
+
+Files are written under a temporary name, then renamed.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+import importlib.util
+import json
+import math
+import os
+import shutil
+from time import perf_counter
+from typing import Callable, Sequence
+
+import numpy as np
+import pandas as pd
+
+from hnsw import HNSW
+import iris_integration as ii
+
+RESULT_COLUMNS = [
+    "db_size",
+    "K",
+    "M",
+    "efConstruction",
+    "efSearch",
+    "results",
+    "num_experiments",
+    "n_distances",
+    "search_sec",
+]
+
+# Result files are parquet when pandas has an engine for it, else pickle. Both are read.
+RESULT_EXTS = (".parquet", ".pkl")
+RESULT_EXT = (
+    ".parquet"
+    if any(importlib.util.find_spec(m) for m in ("pyarrow", "fastparquet"))
+    else ".pkl"
+)
+
+# Templates made into queries at once.
+QUERY_BATCH = ii.BATCH_SIZE
+
+
+def run_sweep(
+    path: str,
+    Ms: Sequence[int],
+    efConstructions: Sequence[int],
+    efSearches: Sequence[int],
+    db_sizes: Sequence[int],
+    num_experiments: int = 100,
+    K: int = 200,
+    noise: float | tuple[np.ndarray, np.ndarray] = 0.3,
+    variant: str = "irisint",
+    data: tuple[np.ndarray, np.ndarray] | None = None,
+    seed: int = 0,
+    workers: int | None = None,
+    log: Callable[[str], None] | None = print,
+) -> pd.DataFrame:
+    """
+    Run or resume the sweep in the directory path, and return all its results.
+
+    The results are one row per (db_size, M, efConstruction, efSearch), with the rank of
+    the target in the top-K of each of num_experiments searches (inf if not found), as
+    in the `multi_notebook_threading` notebook, plus the mean distances and seconds per
+    search. The targets are inserted templates with noise: a level, or levels drawn from
+    (midpoints, probabilities). They depend only on seed and db_size.
+
+    data is (codes, masks) arrays of shape (N, *DIM), by default random templates; it is
+    saved when the sweep is created, and ignored on resume. The variant is "irisint" or
+    "irispacked". m_L is 1 / ln(M).
+    """
+    config = {
+        "Ms": sorted(int(M) for M in Ms),
+        "efConstructions": sorted(int(ef) for ef in efConstructions),
+        "efSearches": sorted(int(ef) for ef in efSearches),
+        "db_sizes": sorted(int(n) for n in db_sizes),
+        "num_experiments": int(num_experiments),
+        "K": int(K),
+        "noise": (
+            float(noise)
+            if np.isscalar(noise)
+            else [np.asarray(a, dtype=float).tolist() for a in noise]
+        ),
+        "variant": variant,
+        "seed": int(seed),
+    }
+    config_path = os.path.join(path, "sweep.json")
+    if os.path.exists(config_path):
+        if _read_json(config_path) != config:
+            raise ValueError(f"{path} holds a sweep with a different config.")
+    else:
+        os.makedirs(path, exist_ok=True)
+        if data is None:
+            rng = np.random.default_rng(seed)
+            data = ii.iris_random_arrays(config["db_sizes"][-1], rng=rng)
+        codes, masks = data
+        if len(codes) < config["db_sizes"][-1]:
+            raise ValueError(
+                f"{len(codes)} templates for a db size of {max(db_sizes)}."
+            )
+        for name, array in (("codes", codes), ("masks", masks)):
+            _atomic(
+                os.path.join(path, f"data_{name}.npy"),
+                lambda tmp: _save_npy(tmp, np.asarray(array, dtype=bool)),
+            )
+        _atomic(config_path, lambda tmp: _write_json(tmp, config))
+
+    tasks = [
+        (M, efC)
+        for M, efC in product(config["Ms"], config["efConstructions"])
+        if _done_sizes(path, M, efC) != config["db_sizes"]
+    ]
+    if log:
+        n_tasks = len(config["Ms"]) * len(config["efConstructions"])
+        log(f"{len(tasks)} of {n_tasks} tasks to run.")
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(_run_task, path, M, efC): (M, efC) for M, efC in tasks}
+        for i, future in enumerate(as_completed(futures), 1):
+            M, efC = futures[future]
+            duration = future.result()
+            if log:
+                log(f"[{i}/{len(tasks)}] M={M} efConstruction={efC}: {duration:.0f}s")
+    return load_results(path)
+
+
+def load_results(path: str) -> pd.DataFrame:
+    "The results written so far in the sweep directory path."
+    results_dir = os.path.join(path, "results")
+    parts = sorted(
+        os.path.join(results_dir, name)
+        for name in (os.listdir(results_dir) if os.path.isdir(results_dir) else [])
+        if name.endswith(RESULT_EXTS)
+    )
+    if not parts:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    results = pd.concat([_read_results(p) for p in parts], ignore_index=True)
+    return results.sort_values(
+        ["M", "efConstruction", "db_size", "efSearch"]
+    ).reset_index(drop=True)
+
+
+# --- Tasks, in the workers ---
+
+
+def _run_task(path: str, M: int, efC: int) -> float:
+    "Grow the index of (M, efC) from its last done size through the rest, and time it."
+    start = perf_counter()
+    config = _read_json(os.path.join(path, "sweep.json"))
+    codes = np.load(os.path.join(path, "data_codes.npy"), mmap_mode="r")
+    masks = np.load(os.path.join(path, "data_masks.npy"), mmap_mode="r")
+    make_queries, kwargs = _variant(config["variant"])
+
+    done = _done_sizes(path, M, efC)
+    if done:
+        db = HNSW.load(_index_path(path, M, efC, done[-1]), mmap=False, **kwargs)
+    else:
+        db = HNSW(M=M, efConstruction=efC, m_L=1 / math.log(M), **kwargs)
+
+    for size in config["db_sizes"]:
+        if size in done:
+            continue
+        # The layers drawn do not depend on where a run resumed.
+        np.random.seed([config["seed"], M, efC, size])
+        for batch in range(db.db_size(), size, QUERY_BATCH):
+            batch_rows = slice(batch, min(batch + QUERY_BATCH, size))
+            batch_codes, batch_masks = codes[batch_rows], masks[batch_rows]
+            for q in make_queries(np.asarray(batch_codes), np.asarray(batch_masks)):
+                db.insert(q)
+
+        index_path = _index_path(path, M, efC, size)
+        if os.path.exists(index_path):
+            shutil.rmtree(index_path)  # From a run stopped before its results.
+        _atomic(index_path, db.save)
+        rows = _experiments(db, codes, masks, make_queries, M, efC, config)
+        _atomic(
+            _result_path(path, M, efC, size),
+            lambda tmp: _write_results(tmp, pd.DataFrame(rows, columns=RESULT_COLUMNS)),
+        )
+        # Only the index of the last done size is needed to resume.
+        for old in done:
+            shutil.rmtree(_index_path(path, M, efC, old), ignore_errors=True)
+        done = [size]
+    return perf_counter() - start
+
+
+def _experiments(db, codes, masks, make_queries, M, efC, config) -> list[list]:
+    "The rows of every efSearch at the current size of db."
+    size = db.db_size()
+    n = min(config["num_experiments"], size)
+    rng = np.random.default_rng([config["seed"], size])
+    targets = np.sort(rng.choice(size, n, replace=False))
+    if isinstance(config["noise"], float):
+        noise = np.full(n, config["noise"])
+    else:
+        midpoints, probabilities = config["noise"]
+        noise = ii.sample_noise(midpoints, probabilities, n, rng=rng)
+    noisy_codes = ii.iris_with_noise_arrays(np.asarray(codes[targets]), noise, rng=rng)
+    queries = make_queries(noisy_codes, np.asarray(masks[targets]))
+
+    rows = []
+    for ef in config["efSearches"]:
+        db.reset_stats()
+        start = perf_counter()
+        ranks = []
+        for target, q in zip(targets.tolist(), queries):
+            result = db.search(q, config["K"], ef=ef)
+            ranks.append(
+                next((i for i, (_, e) in enumerate(result) if e == target), np.inf)
+            )
+        duration = perf_counter() - start
+        stats = db.get_stats()
+        rows.append(
+            [
+                size,
+                config["K"],
+                M,
+                efC,
+                ef,
+                ranks,
+                n,
+                stats["n_distances"] / n,
+                duration / n,
+            ]
+        )
+    return rows
+
+
+def _variant(variant: str) -> tuple[Callable, dict]:
+    "make_queries from (codes, masks) arrays, and the kwargs of HNSW."
+    if variant == "irisint":
+        return ii.irisint_make_queries, dict(
+            distance_func=ii.irisint_distance,
+            query_to_vector_func=ii.irisint_query_to_vector,
+            vector_bits=math.prod(ii.DIM),
+        )
+    if variant == "irispacked":
+        store = ii.irispacked_store()
+        return ii.irispacked_make_queries, dict(
+            distance_func=ii.irispacked_distance,
+            query_to_vector_func=ii.irispacked_query_to_vector,
+            vector_store=store,
+            distance_batch_func=store.distance_batch,
+        )
+    raise ValueError(f"Unknown variant {variant!r}")
+
+
+# --- Files ---
+
+
+def _result_path(path: str, M: int, efC: int, size: int, ext: str = RESULT_EXT) -> str:
+    return os.path.join(path, "results", f"M{M}_efC{efC}_size{size}{ext}")
+
+
+def _index_path(path: str, M: int, efC: int, size: int) -> str:
+    return os.path.join(path, "indexes", f"M{M}_efC{efC}", f"size_{size}")
+
+
+def _done_sizes(path: str, M: int, efC: int) -> list[int]:
+    config = _read_json(os.path.join(path, "sweep.json"))
+    return [
+        size
+        for size in config["db_sizes"]
+        if any(
+            os.path.exists(_result_path(path, M, efC, size, ext)) for ext in RESULT_EXTS
+        )
+    ]
+
+
+def _atomic(target: str, write: Callable[[str], object]):
+    "Call write on a temporary path next to target, then rename it to target."
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp = target + ".tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    write(tmp)
+    os.replace(tmp, target)
+
+
+def _write_results(path: str, results: pd.DataFrame):
+    "Write results in the format of RESULT_EXT, whatever the extension of path."
+    if RESULT_EXT == ".parquet":
+        results.to_parquet(path)
+    else:
+        results.to_pickle(path, compression=None)
+
+
+def _read_results(path: str) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_pickle(path, compression=None)
+
+
+def _save_npy(path: str, array: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def _read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path: str, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
@@ -0,0 +1,275 @@
+"""
+Crash-safe ingestion: a write-ahead log of the changes of an HNSW, and snapshots.
+
+Each change (insert, delete, repair, compact) is appended to the log before it is
+applied, with the layer drawn for each insert. Every snapshot_every changes, the index
+is saved as a snapshot and a new log starts. On open, the latest snapshot is loaded and
+the tail of its log is replayed. HNSW operations are deterministic given the layers, so
+the recovered graph is the one before the crash, link for link.
+
+Layout of the directory:
+
+    snapshot_{seq}/     HNSW.save after the first seq changes; snapshot_0 is empty.
+    log_{seq}.wal       The changes after seq, as frames of a pickled (op, args).
+
+A frame is its length and CRC32, then the pickle. A torn frame at the end of the log is
+the change that was being written: it was not applied, and is dropped on recovery.
+
+The log holds pickles: only open trusted directories.
+"""
+import os
+import pickle
+import shutil
+import struct
+from threading import Lock
+from typing import Any, BinaryIO, Iterator, Sequence
+import zlib
+
+import numpy as np
+
+from hnsw import HNSW, Index, Query
+
+_FRAME_HEADER = struct.Struct("!II")
+
+# The changes that are logged, as methods of HNSW.
+OPS = ("insert", "delete", "repair", "compact")
+
+# Params saved in the snapshots, which take precedence over those given on open.
+SAVED_PARAMS = (
+    "M",
+    "efConstruction",
+    "m_L",
+    "neighbor_heuristic",
+    "extend_candidates",
+    "keep_pruned_connections",
+)
+
+
+class DurableHNSW:
+    """
+    An HNSW whose changes survive a crash of the process, in the directory path.
+
+    Open a new or existing directory with the kwargs of HNSW, such as distance_func and
+    query_to_vector_func. Make all the changes through this object; `db` is the index,
+    for reading. The changes are serialized, in the order of the log.
+
+    The log is flushed after each change, or each insert_many. With fsync, it is also
+    synced to disk, which survives a crash of the machine, at the cost of a disk write.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        snapshot_every: int | None = 10_000,
+        fsync: bool = False,
+        **kwargs,
+    ):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith((".tmp", ".old")):  # From an interrupted snapshot.
+                shutil.rmtree(os.path.join(path, name))
+
+        snapshots = self._snapshots()
+        if not snapshots:
+            self.db = HNSW(**kwargs)
+            self.snapshot_seq = self.seq = 0
+            self._save_snapshot()
+        else:
+            kwargs = {k: v for k, v in kwargs.items() if k not in SAVED_PARAMS}
+            self.snapshot_seq = self.seq = snapshots[-1]
+            self.db = HNSW.load(self._snapshot_path(self.seq), mmap=False, **kwargs)
+        self.n_replayed = self._replay()
+        self._log: BinaryIO = open(self._log_path(self.snapshot_seq), "ab")
+        self._remove_before(self.snapshot_seq)
+
+    def __enter__(self) -> "DurableHNSW":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "Close the log. The changes are already in it."
+        self._log.close()
+
+    def __len__(self) -> int:
+        return self.db.db_size()
+
+    # --- Changes ---
+
+    def insert(self, q_vec: Query) -> Index:
+        with self._lock:
+            l = self.db._select_layer()
+            self._append([("insert", (q_vec, l))])
+            q = self._apply("insert", (q_vec, l))
+            self._may_snapshot()
+        return q
+
+    def insert_many(self, queries: Sequence[Query]) -> list[Index]:
+        "Insert the queries in order, with one write and flush of the log for all."
+        with self._lock:
+            changes = [
+                ("insert", (q_vec, self.db._select_layer())) for q_vec in queries
+            ]
+            self._append(changes)
+            ids = [self._apply(op, args) for op, args in changes]
+            self._may_snapshot()
+        return ids
+
+    def delete(self, e: Index):
+        "See HNSW.delete."
+        self._change("delete", e)
+
+    def repair(self, max_deleted: int | None = None) -> int:
+        "See HNSW.repair."
+        return self._change("repair", max_deleted)
+
+    def compact(self, min_deleted_ratio: float = 0.1) -> np.ndarray | None:
+        "See HNSW.compact."
+        return self._change("compact", min_deleted_ratio)
+
+    def checkpoint(self):
+        "Save a snapshot now, and start a new log."
+        with self._lock:
+            if self.seq != self.snapshot_seq:
+                self._snapshot()
+
+    def _change(self, op: str, *args) -> Any:
+        with self._lock:
+            self._append([(op, args)])
+            result = self._apply(op, args)
+            self._may_snapshot()
+        return result
+
+    def _apply(self, op: str, args: tuple) -> Any:
+        # A logged change counts even if it raises, as it will raise again on replay.
+        self.seq += 1
+        return getattr(self.db, op)(*args)
+
+    # --- Reads ---
+
+    def search(
+        self, q_vec: Query, K: int, ef: int | None = None, sketch: bool = False
+    ) -> list[tuple[float, int]]:
+        "See HNSW.search."
+        return self.db.search(q_vec, K, ef=ef, sketch=sketch)
+
+    def search_many(self, queries: Sequence[Query], K: int, **kwargs) -> list:
+        "See HNSW.search_many."
+        return self.db.search_many(queries, K, **kwargs)
+
+    def get_params(self) -> dict[str, int | float]:
+        return self.db.get_params()
+
+    def get_stats(self) -> dict[str, int | float]:
+        return self.db.get_stats() | {"wal_seq": self.seq}
+
+    def reset_stats(self) -> dict[str, int | float]:
+        return self.db.reset_stats() | {"wal_seq": self.seq}
+
+    # --- Log ---
+
+    def _append(self, changes: list[tuple[str, tuple]]):
+        frames = []
+        for change in changes:
+            data = pickle.dumps(change, protocol=pickle.HIGHEST_PROTOCOL)
+            frames.append(_FRAME_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        self._log.write(b"".join(frames))
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def _replay(self) -> int:
+        "Apply the log of the snapshot, drop its torn tail, and count the changes."
+        log_path = self._log_path(self.snapshot_seq)
+        if not os.path.exists(log_path):
+            return 0
+        n = 0
+        with open(log_path, "rb+") as f:
+            for op, args in _read_frames(f):
+                if op not in OPS:
+                    raise ValueError(f"Unknown change {op!r} in {log_path}")
+                try:
+                    self._apply(op, args)
+                except Exception:
+                    pass  # It failed the same way when it was logged.
+                n += 1
+            f.truncate(f.tell())  # _read_frames stops after the last whole frame.
+        return n
+
+    # --- Snapshots ---
+
+    def _may_snapshot(self):
+        if self.snapshot_every and self.seq - self.snapshot_seq >= self.snapshot_every:
+            self._snapshot()
+
+    def _snapshot(self):
+        self._save_snapshot()
+        self._log.close()
+        self._log = open(self._log_path(self.snapshot_seq), "ab")
+        self._remove_before(self.snapshot_seq)
+
+    def _save_snapshot(self):
+        "Save the index as the snapshot of seq, renamed once complete."
+        target = self._snapshot_path(self.seq)
+        tmp = target + ".tmp"
+        self.db.save(tmp)
+        os.replace(tmp, target)
+        self.snapshot_seq = self.seq
+
+    def _remove_before(self, seq: int):
+        "Remove the snapshots and logs older than seq."
+        for name in os.listdir(self.path):
+            old_seq = _seq_of(name)
+            if old_seq is None or old_seq >= seq:
+                continue
+            old_path = os.path.join(self.path, name)
+            if os.path.isdir(old_path):
+                shutil.rmtree(old_path)
+            else:
+                os.remove(old_path)
+
+    def _snapshots(self) -> list[int]:
+        "The seq of the complete snapshots, in order."
+        return sorted(
+            seq
+            for name in os.listdir(self.path)
+            if name.startswith("snapshot_")
+            and (seq := _seq_of(name)) is not None
+            and os.path.exists(os.path.join(self.path, name, "header.json"))
+        )
+
+    def _snapshot_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"snapshot_{seq}")
+
+    def _log_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"log_{seq}.wal")
+
+
+def _seq_of(name: str) -> int | None:
+    "The seq of a snapshot or log name, or None for other files."
+    for prefix, suffix in (("snapshot_", ""), ("log_", ".wal")):
+        if name.startswith(prefix) and name.endswith(suffix):
+            seq = name[len(prefix) : len(name) - len(suffix)]
+            if seq.isdigit():
+                return int(seq)
+    return None
+
+
+def _read_frames(f: BinaryIO) -> Iterator[Any]:
+    "Yield the whole frames of f, and leave f after the last one."
+    while True:
+        start = f.tell()
+        header = f.read(_FRAME_HEADER.size)
+        if len(header) == _FRAME_HEADER.size:
+            n, crc = _FRAME_HEADER.unpack(header)
+            data = f.read(n)
+            if len(data) == n and zlib.crc32(data) == crc:
+                yield pickle.loads(data)
+                continue
+        f.seek(start)
+        return
@@ -1,9 +1,19 @@
+from math import prod
+
 import numpy as np
 
 import iris
 from iris.io.dataclasses import IrisTemplate
 from iris.nodes.matcher.utils import hamming_distance
 
+from packed_vectors import (
+    PackedVectorStore,
+    bits_to_words,
+    packed_distance,
+    packed_distance_bounded,
+    packed_distances,
+)
+
 FAST = False # FAST = True
 if FAST:
     # 1_600 bits.
@@ -114,9 +124,7 @@ def _np_distance(
 
 # Precompute all rotations as a query.
 def irisint_make_query(tpl: IrisTemplate) -> list[tuple[int, int]]:
-    all_rotations = [rotated_tpl(tpl, rot) for rot in range(-MAX_ROT, MAX_ROT + 1)]
-    query = [convert_to_irisint(x) for x in all_rotations]
-    return query
+    return irisint_make_queries(*templates_to_arrays([tpl]))[0]
 
 
 # Distance between each precomputed rotation and a vector.
@@ -134,7 +142,6 @@ def convert_to_irisint(tpl: IrisTemplate) -> tuple[int, int]:
     mask = _np_to_bigint(np.concatenate(tpl.mask_codes))
     return (code, mask)
 
-from math import prod
 def convert_from_irisint(irisint: tuple[int, int], shape: tuple[int, int, int]) -> IrisTemplate:
     size = prod(shape)
     iris_codes = list(_bigint_to_np(irisint[0], size).reshape(shape))
@@ -147,19 +154,10 @@ def convert_from_irisint(irisint: tuple[int, int], shape: tuple[int, int, int])
 
 def _np_to_bigint(a: np.ndarray) -> int:
     assert a.dtype == np.bool_
-    x = 0
-    a_bytes = np.packbits(a, axis=None)
-    for b in a_bytes:
-        x = (x << 8) | int(b)
-    return x
+    return int.from_bytes(np.packbits(a, axis=None).tobytes(), "big")
 
 def _bigint_to_np(a: int, size) -> np.ndarray:
-    a_bytes = list()
-    for _ in range((size+7) >> 3):
-        a_bytes.append(a & 255)
-        a = a >> 8
-    a_bytes.reverse()
-    x_bytes = np.array(a_bytes, dtype=np.uint8)
+    x_bytes = np.frombuffer(a.to_bytes((size + 7) >> 3, "big"), dtype=np.uint8)
     x = np.unpackbits(x_bytes).astype(bool)
     return x
 
@@ -173,6 +171,203 @@ def int_distance(x: tuple[int, int], y: tuple[int, int]):
     return diff.bit_count() / mask.bit_count()
 
 
+# --- Variant `irispacked` with pre-computed rotations in packed uint64 words. ---
+# Vectors are rows of a contiguous PackedVectorStore instead of boxed big ints.
+
+
+# Precompute all rotations as a query: (codes, masks) matrices of shape (2*MAX_ROT+1, n_words).
+def irispacked_make_query(tpl: IrisTemplate) -> tuple[np.ndarray, np.ndarray]:
+    return irispacked_make_queries(*templates_to_arrays([tpl]))[0]
+
+
+# Distance between each precomputed rotation and a vector.
+def irispacked_distance(
+    query: tuple[np.ndarray, np.ndarray], vector: tuple[np.ndarray, np.ndarray]
+) -> float:
+    return packed_distance(query, vector)
+
+
+# Same as irispacked_distance below the bound, otherwise any value >= bound.
+# It may skip the last words of rotations proven to be >= bound.
+def irispacked_distance_bounded(
+    query: tuple[np.ndarray, np.ndarray],
+    vector: tuple[np.ndarray, np.ndarray],
+    bound: float,
+) -> float:
+    return packed_distance_bounded(query, vector, bound)
+
+
+# Distances between each precomputed rotation and many vectors, as rows (N, n_words).
+# The minimum over rotations of each row, with vectorized XOR/AND/popcount.
+def irispacked_distances(
+    query: tuple[np.ndarray, np.ndarray], codes: np.ndarray, masks: np.ndarray
+) -> np.ndarray:
+    return packed_distances(query, codes, masks)
+
+
+# Store the no-rotation row.
+def irispacked_query_to_vector(
+    query: tuple[np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    codes, masks = query
+    return (codes[MAX_ROT].copy(), masks[MAX_ROT].copy())
+
+
+# A store for `HNSW(vector_store=store, distance_batch_func=store.distance_batch)`.
+# It accepts vectors of the `irispacked` and `irisint` variants.
+def irispacked_store(capacity: int = 1024) -> PackedVectorStore:
+    return PackedVectorStore(n_bits=prod(DIM), capacity=capacity)
+
+
+# --- Queries of stored vectors, for `HNSW(vector_to_query_func=...)`. ---
+# The repair of deletions compares stored vectors to each other.
+
+
+# All rotations of a stored `irisint` vector.
+def irisint_vector_to_query(vector: tuple[int, int]) -> list[tuple[int, int]]:
+    codes, masks = (_bigint_to_np(x, prod(DIM)).reshape(DIM) for x in vector)
+    return irisint_make_queries(codes[None], masks[None])[0]
+
+
+# All rotations of a stored `irispacked` vector.
+def irispacked_vector_to_query(
+    vector: tuple[np.ndarray, np.ndarray]
+) -> tuple[np.ndarray, np.ndarray]:
+    codes, masks = (
+        np.unpackbits(w.view(np.uint8))[: prod(DIM)].reshape(DIM).astype(bool)
+        for w in vector
+    )
+    return irispacked_make_queries(codes[None], masks[None])[0]
+
+
+# --- Batch query preparation. ---
+# All rotations of N templates at once, from stacked arrays without IrisTemplate objects.
+
+# Templates per vectorized step, ~100 MB of rotated bits at 12,800 bits.
+BATCH_SIZE = 256
+
+
+# Stack templates into (codes, masks) arrays of shape (N, *DIM).
+def templates_to_arrays(tpls: list[IrisTemplate]) -> tuple[np.ndarray, np.ndarray]:
+    codes = np.stack([np.stack(tpl.iris_codes) for tpl in tpls])
+    masks = np.stack([np.stack(tpl.mask_codes) for tpl in tpls])
+    return (codes, masks)
+
+
+# All rotations as flat bits (N, 2*max_rot+1, n_bits), in the order of rotated_tpl.
+def rotated_bits(arrays: np.ndarray, max_rot: int = MAX_ROT) -> np.ndarray:
+    rotations = [np.roll(arrays, rot, axis=-1) for rot in range(-max_rot, max_rot + 1)]
+    return np.stack(rotations, axis=1).reshape(len(arrays), len(rotations), -1)
+
+
+# Same as [irisint_make_query(tpl) for tpl in templates], from stacked arrays.
+def irisint_make_queries(
+    codes: np.ndarray, masks: np.ndarray, max_rot: int = MAX_ROT
+) -> list[list[tuple[int, int]]]:
+    queries = []
+    for start in range(0, len(codes), BATCH_SIZE):
+        batch = slice(start, start + BATCH_SIZE)
+        code_bytes = np.packbits(rotated_bits(codes[batch], max_rot), axis=-1)
+        mask_bytes = np.packbits(rotated_bits(masks[batch], max_rot), axis=-1)
+        for query_codes, query_masks in zip(code_bytes, mask_bytes):
+            queries.append(
+                [
+                    (_bytes_to_bigint(c), _bytes_to_bigint(m))
+                    for c, m in zip(query_codes, query_masks)
+                ]
+            )
+    return queries
+
+
+def _bytes_to_bigint(a: np.ndarray) -> int:
+    return int.from_bytes(a.tobytes(), "big")
+
+
+# Same as [irispacked_make_query(tpl) for tpl in templates], from stacked arrays.
+def irispacked_make_queries(
+    codes: np.ndarray, masks: np.ndarray, max_rot: int = MAX_ROT
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    queries = []
+    for start in range(0, len(codes), BATCH_SIZE):
+        batch = slice(start, start + BATCH_SIZE)
+        query_codes = bits_to_words(rotated_bits(codes[batch], max_rot))
+        query_masks = bits_to_words(rotated_bits(masks[batch], max_rot))
+        queries.extend(zip(query_codes, query_masks))
+    return queries
+
+
+# --- Low-resolution sketches of `irisint`, for a two-stage search. ---
+# Every 2nd row and 4th column, like the FAST mode: 1,600 bits and ±4 rotations.
+# Use with HNSW(sketch_query_func=irisint_sketch_query,
+#   sketch_vector_func=irisint_sketch_vector, sketch_distance_func=irisint_distance)
+# and db.search(query, K, ef, sketch=True).
+
+SKETCH_STEP = (2, 4)
+# One sketch rotation is SKETCH_STEP[1] full rotations, rounded up to cover ±MAX_ROT.
+SKETCH_MAX_ROT = -(-MAX_ROT // SKETCH_STEP[1])
+
+
+# Sketch query from the no-rotation vector of an `irisint` query.
+def irisint_sketch_query(query: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    codes, masks = _irisint_sketch_arrays(query[MAX_ROT])
+    return irisint_make_queries(codes[None], masks[None], SKETCH_MAX_ROT)[0]
+
+
+# Sketch of a stored `irisint` vector.
+def irisint_sketch_vector(vector: tuple[int, int]) -> tuple[int, int]:
+    codes, masks = _irisint_sketch_arrays(vector)
+    return (_np_to_bigint(codes), _np_to_bigint(masks))
+
+
+def _irisint_sketch_arrays(vector: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    row_step, col_step = SKETCH_STEP
+    code, mask = (_bigint_to_np(x, prod(DIM)).reshape(DIM) for x in vector)
+    return (code[:, ::row_step, ::col_step], mask[:, ::row_step, ::col_step])
+
+
+# --- Batch generation of synthetic templates as arrays. ---
+# Stacked (N, *DIM) codes and masks, for irisint_make_queries and irispacked_make_queries,
+# without IrisTemplate objects. rng is a np.random.Generator, or the global np.random
+# state by default like iris_random.
+
+
+# Random codes with full masks, like iris_random.
+def iris_random_arrays(n: int, dim=DIM, rng=None) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random if rng is None else rng
+    n_bits = prod(dim)
+    random_bytes = np.frombuffer(rng.bytes(n * (-(-n_bits // 8))), dtype=np.uint8)
+    bits = np.unpackbits(random_bytes.reshape(n, -1), axis=1, count=n_bits)
+    codes = bits.view(np.bool_).reshape(n, *dim)
+    masks = np.ones((n, *dim), dtype=np.bool_)
+    return (codes, masks)
+
+
+# Noisy copies of codes, each flipping bits with its own noise level, like iris_with_noise.
+# The masks are unchanged. Levels are rounded to multiples of 2^-16: each bit compares
+# 16 random bits to a threshold, several times faster than a random float.
+def iris_with_noise_arrays(codes: np.ndarray, noise_levels=0.25, rng=None) -> np.ndarray:
+    rng = np.random if rng is None else rng
+    levels = np.broadcast_to(np.asarray(noise_levels, dtype=np.float64), len(codes))
+    thresholds = np.round(levels * 2**16).astype(np.uint32)
+    noisy = np.empty_like(codes)
+    bits_per_sample = prod(codes.shape[1:])
+    # By batches, to bound the random bits in memory.
+    for start in range(0, len(codes), BATCH_SIZE):
+        batch = slice(start, start + BATCH_SIZE)
+        n = len(codes[batch])
+        draws = np.frombuffer(rng.bytes(2 * n * bits_per_sample), dtype=np.uint16)
+        flips = draws.reshape(n, -1) < thresholds[batch, None]
+        np.bitwise_xor(codes[batch], flips.reshape(codes[batch].shape), out=noisy[batch])
+    return noisy
+
+
+# Noise levels drawn from a distribution, such as the measured one of the notebooks:
+# the bin midpoints and their probabilities.
+def sample_noise(midpoints: np.ndarray, probabilities: np.ndarray, sample_size=1, rng=None) -> np.ndarray:
+    rng = np.random if rng is None else rng
+    return rng.choice(midpoints, size=sample_size, p=probabilities)
+
+
 # --- Test of the implementations. ---
 def iris_test():
     tpl = iris_random()
@@ -181,11 +376,13 @@ def iris_test():
     vector = iris_query_to_vector(iris_make_query(tpl))
     vector_np = irisnp_query_to_vector(irisnp_make_query(tpl))
     vector_int = irisint_query_to_vector(irisint_make_query(tpl))
+    vector_packed = irispacked_query_to_vector(irispacked_make_query(tpl))
 
     # Exact matches produce zero distance.
     assert iris_distance(iris_make_query(tpl), vector) == 0.0
     assert irisnp_distance(irisnp_make_query(tpl), vector_np) == 0.0
     assert irisint_distance(irisint_make_query(tpl), vector_int) == 0.0
+    assert irispacked_distance(irispacked_make_query(tpl), vector_packed) == 0.0
 
     # Noisy query produces the same non-zero distance for all implementations.
     noisy_tpl = iris_with_noise(tpl)
@@ -193,12 +390,70 @@ def iris_test():
     query = iris_make_query(noisy_tpl)
     query_np = irisnp_make_query(noisy_tpl)
     query_int = irisint_make_query(noisy_tpl)
+    query_packed = irispacked_make_query(noisy_tpl)
 
     dist = iris_distance(query, vector)
     dist_np = irisnp_distance(query_np, vector_np)
     dist_int = irisint_distance(query_int, vector_int)
+    dist_packed = irispacked_distance(query_packed, vector_packed)
 
     assert 0.0 < dist < 0.5
-    assert dist == dist_np == dist_int
+    assert dist == dist_np == dist_int == dist_packed
+
+    # Batch query preparation matches the rotations of rotated_tpl.
+    reference = [
+        convert_to_irisint(rotated_tpl(noisy_tpl, rot))
+        for rot in range(-MAX_ROT, MAX_ROT + 1)
+    ]
+    codes, masks = templates_to_arrays([tpl, noisy_tpl])
+    assert irisint_make_queries(codes, masks)[1] == query_int == reference
+    packed_codes, packed_masks = irispacked_make_queries(codes, masks)[1]
+    assert (packed_codes == query_packed[0]).all()
+    assert (packed_masks == query_packed[1]).all()
+
+    # Queries rebuilt from stored vectors are the original queries.
+    assert irisint_vector_to_query(irisint_query_to_vector(query_int)) == query_int
+    rebuilt_codes, rebuilt_masks = irispacked_vector_to_query(
+        irispacked_query_to_vector(query_packed)
+    )
+    assert (rebuilt_codes == query_packed[0]).all()
+    assert (rebuilt_masks == query_packed[1]).all()
+
+    # Masked templates against many stored vectors at once give the same distances.
+    tpls = [_with_random_mask(iris_random()) for _ in range(4)]
+    noisy_tpl = _with_random_mask(iris_with_noise(tpls[0]))
+    store = irispacked_store()
+    for t in tpls:
+        store.append(irispacked_query_to_vector(irispacked_make_query(t)))
+    query_packed = irispacked_make_query(noisy_tpl)
+    dists_packed = irispacked_distances(query_packed, store.codes, store.masks)
+    for t, dist_packed in zip(tpls, dists_packed):
+        dist = iris_distance(noisy_tpl, t)
+        dist_np = irisnp_distance(
+            irisnp_make_query(noisy_tpl), irisnp_query_to_vector(irisnp_make_query(t))
+        )
+        dist_int = irisint_distance(
+            irisint_make_query(noisy_tpl), irisint_query_to_vector(irisint_make_query(t))
+        )
+        assert dist == dist_np == dist_int == dist_packed
+
+    # Batch generation gives the same distances as the templates, at the noise levels.
+    codes, masks = iris_random_arrays(3)
+    noisy = iris_with_noise_arrays(codes, [0.0, 0.25, 1.0])
+    assert codes.shape == noisy.shape == masks.shape == (3, *DIM)
+    assert (noisy[0] == codes[0]).all() and (noisy[2] != codes[2]).all()
+    assert 0.2 < (noisy[1] != codes[1]).mean() < 0.3
+    queries = irispacked_make_queries(noisy, masks)
+    vectors = [irispacked_query_to_vector(q) for q in irispacked_make_queries(codes, masks)]
+    tpl = IrisTemplate(iris_codes=list(codes[1]), mask_codes=list(masks[1]), iris_code_version="v3.0")
+    noisy_tpl = IrisTemplate(iris_codes=list(noisy[1]), mask_codes=list(masks[1]), iris_code_version="v3.0")
+    assert irispacked_distance(queries[1], vectors[1]) == iris_distance(noisy_tpl, tpl)
 
     print("Test iris distance implementations: ✅")
+
+
+def _with_random_mask(tpl: IrisTemplate, p_valid=0.9) -> IrisTemplate:
+    mask_codes = [np.random.uniform(0, 1, c.shape) < p_valid for c in tpl.iris_codes]
+    return IrisTemplate(
+        iris_codes=tpl.iris_codes, mask_codes=mask_codes, iris_code_version="v3.0"
+    )
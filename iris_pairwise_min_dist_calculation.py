@@ -1,7 +1,11 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from itertools import product
 
+from packed_vectors import bits_to_words
+
 def stack_rotated_matrices(matrices: pd.Series, max_rotation: int) -> np.ndarray:
     """
     Creates a vertically stacked array of flattened, rotated matrices.
@@ -70,3 +74,167 @@ def get_pairwise_min_dist_across_rotations(iris_matrices: pd.Series, mask_matric
 
     # Extract only the lower triangle (excluding the diagonal)
     return min_distances_per_matrix[np.tril_indices(len(iris_matrices), k=-1)]
+
+
+# --- Tiled computation, in bounded memory ---
+
+def pack_matrices(matrices: pd.Series) -> tuple[np.ndarray, tuple[int, ...]]:
+    """
+    Packs flattened binary matrices into rows of uint64 words.
+
+    Parameters:
+    ----------
+    matrices : pd.Series
+        A series of binary matrices of the same shape.
+
+    Returns:
+    -------
+    tuple[np.ndarray, tuple[int, ...]]
+        The words, of shape (len(matrices), n_words), and the shape of a matrix.
+    """
+    matrices = list(matrices)
+    shape = np.shape(matrices[0])
+    bits = np.array([np.asarray(m, dtype=bool).flatten() for m in matrices])
+    return bits_to_words(bits), shape
+
+
+def _unpack(words: np.ndarray, n_bits: int) -> np.ndarray:
+    return np.unpackbits(words.view(np.uint8), axis=-1, count=n_bits)
+
+
+def _signed(codes: np.ndarray, masks: np.ndarray) -> np.ndarray:
+    "+1 and -1 for the valid 1 and 0 bits, 0 for the invalid ones, as float32."
+    signed = codes.astype(np.float32) * 2 - 1
+    signed *= masks
+    return signed
+
+
+def _min_dist_rows(code_words, mask_words, shape, shifts, start, stop, block_cols):
+    """
+    The minimum distances of the matrices start..stop-1 to all the previous ones, as
+    a segment of the condensed vector of get_pairwise_min_dist_across_rotations.
+
+    The rolls of both matrices by a and b give the same distance as the roll of the first
+    by a - b: only the rows are rolled, by every relative shift. The counts of valid and
+    different bits are dot products of 0/1 masks and of +1/-1/0 signed bits, exact in
+    float32 below 2^24 bits:  n_valid - 2 * n_diff = signed_x . signed_y.
+    """
+    n_bits = int(np.prod(shape))
+    row_bits = n_bits // shape[0]
+    n_shifts = len(shifts)
+
+    codes = _unpack(code_words[start:stop], n_bits)
+    masks = _unpack(mask_words[start:stop], n_bits)
+    # (rows * shifts, bits), rolled along axis 0 of the matrices.
+    rolled_codes = np.stack([np.roll(codes, s * row_bits, axis=1) for s in shifts], axis=1)
+    rolled_masks = np.stack([np.roll(masks, s * row_bits, axis=1) for s in shifts], axis=1)
+    rolled_codes = rolled_codes.reshape(-1, n_bits)
+    rolled_masks = rolled_masks.reshape(-1, n_bits)
+    x_signed = _signed(rolled_codes, rolled_masks)
+    x_masks = rolled_masks.astype(np.float32)
+    del rolled_codes, rolled_masks
+
+    min_dists = np.empty((stop - start, stop - 1), dtype=np.float64)
+    for col in range(0, stop - 1, block_cols):
+        cols = slice(col, min(col + block_cols, stop - 1))
+        y_codes = _unpack(code_words[cols], n_bits)
+        y_masks = _unpack(mask_words[cols], n_bits)
+        n_valid = (x_masks @ y_masks.T.astype(np.float32)).astype(np.int64)
+        agree = (x_signed @ _signed(y_codes, y_masks).T).astype(np.int64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            dists = ((n_valid - agree) // 2) / n_valid
+        min_dists[:, cols] = dists.reshape(stop - start, n_shifts, -1).min(axis=1)
+
+    return np.concatenate([min_dists[i - start, :i] for i in range(start, stop)])
+
+
+def iter_pairwise_min_dist(iris_matrices: pd.Series, mask_matrices: pd.Series, max_rotation: int,
+                           block_rows: int = 16, block_cols: int = 512, workers: int = 1):
+    """
+    Computes the values of get_pairwise_min_dist_across_rotations, equal to them, in
+    consecutive segments of the condensed vector, in bounded memory.
+
+    Parameters:
+    ----------
+    iris_matrices, mask_matrices, max_rotation :
+        As in get_pairwise_min_dist_across_rotations.
+
+    block_rows : int
+        The matrices per segment. A segment works on
+        block_rows * (4 * max_rotation + 1) * bits float32 values, twice.
+
+    block_cols : int
+        The matrices compared at once to the rows of a segment.
+
+    workers : int
+        Segments computed in parallel threads. The matrix products also use the threads
+        of the BLAS library.
+
+    Yields:
+    -------
+    np.ndarray
+        The distances of the pairs (i, j), j < i, for the rows i of the next block, in
+        the order of np.tril_indices(len(iris_matrices), k=-1).
+    """
+    code_words, shape = pack_matrices(iris_matrices)
+    mask_words, _ = pack_matrices(mask_matrices)
+    if np.prod(shape) >= 1 << 24:
+        raise ValueError("Matrices of 2^24 bits or more are not exact in float32.")
+    # Relative shifts of rows, distinct modulo the number of rows.
+    shifts = sorted(set(s % shape[0] for s in range(-2 * max_rotation, 2 * max_rotation + 1)))
+
+    n = len(code_words)
+    blocks = [(start, min(start + block_rows, n)) for start in range(1, n, block_rows)]
+
+    def segment(block):
+        return _min_dist_rows(code_words, mask_words, shape, shifts, *block, block_cols)
+
+    if workers <= 1:
+        yield from map(segment, blocks)
+        return
+    # At most 2 segments per worker are in memory.
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(segment, block))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_pairwise_min_dist_across_rotations_tiled(iris_matrices: pd.Series, mask_matrices: pd.Series,
+                                                 max_rotation: int, **kwargs) -> np.ndarray:
+    """
+    Returns the same array as get_pairwise_min_dist_across_rotations, computed by
+    iter_pairwise_min_dist with the same kwargs. Its size is still N * (N - 1) / 2.
+    """
+    segments = list(iter_pairwise_min_dist(iris_matrices, mask_matrices, max_rotation, **kwargs))
+    return np.concatenate(segments) if segments else np.zeros(0)
+
+
+def get_pairwise_min_dist_histogram(iris_matrices: pd.Series, mask_matrices: pd.Series, max_rotation: int,
+                                    bins: np.ndarray | None = None, **kwargs) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the histogram of the pairwise minimum distances without keeping them.
+
+    Parameters:
+    ----------
+    bins : np.ndarray, optional
+        The edges of the bins, as in np.histogram. Distances outside are not counted.
+        Defaults to 100 bins of width 0.01 over [0, 1].
+
+    kwargs :
+        As in iter_pairwise_min_dist.
+
+    Returns:
+    -------
+    tuple[np.ndarray, np.ndarray]
+        The counts of each bin, and the bins.
+    """
+    if bins is None:
+        bins = np.linspace(0, 1, 101)
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    for segment in iter_pairwise_min_dist(iris_matrices, mask_matrices, max_rotation, **kwargs):
+        counts += np.histogram(segment, bins=bins)[0]
+    return counts, bins
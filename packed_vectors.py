@@ -0,0 +1,228 @@
+import numpy as np
+
+# Bits are packed in the order of `np.packbits`, so a row of words holds the same bytes as
+# the big-endian Python int of the `irisint` variant.
+WORD_BITS = 64
+
+# Distance temporaries of about this many words stay in the CPU cache.
+KERNEL_WORDS = 1 << 16
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+# Nibble-stage words count at most 8 bits per byte, so 31 of them fit in a byte lane.
+_LANE_WORDS = 31
+
+
+def n_words(n_bits: int) -> int:
+    return (n_bits + WORD_BITS - 1) // WORD_BITS
+
+
+def bits_to_words(bits: np.ndarray) -> np.ndarray:
+    "Pack booleans along the last axis into uint64 words, zero-padded at the end."
+    packed = np.packbits(bits, axis=-1)
+    pad = (-packed.shape[-1]) % 8
+    if pad:
+        packed = np.pad(packed, [(0, 0)] * (packed.ndim - 1) + [(0, pad)])
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+
+def int_to_words(x: int, n_bits: int) -> np.ndarray:
+    "Convert a big int of the `irisint` variant into uint64 words."
+    n_bytes = (n_bits + 7) // 8
+    buf = x.to_bytes(n_bytes, "big") + bytes(n_words(n_bits) * 8 - n_bytes)
+    return np.frombuffer(buf, dtype=np.uint64)
+
+
+def words_to_int(words: np.ndarray, n_bits: int) -> int:
+    "Convert uint64 words back into a big int of the `irisint` variant."
+    n_bytes = (n_bits + 7) // 8
+    return int.from_bytes(np.ascontiguousarray(words).tobytes()[:n_bytes], "big")
+
+
+def popcount(words: np.ndarray) -> np.ndarray:
+    "Count the set bits along the last axis."
+    return _popcount_inplace(words.copy())
+
+
+def _popcount_inplace(x: np.ndarray) -> np.ndarray:
+    "Like popcount, but may overwrite x."
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x).sum(axis=-1, dtype=np.int64)
+
+    # SWAR popcount of each byte, in place.
+    t = np.empty_like(x)
+    np.right_shift(x, np.uint64(1), out=t)
+    t &= _M1
+    x -= t
+    np.right_shift(x, np.uint64(2), out=t)
+    t &= _M2
+    x &= _M2
+    x += t
+    np.right_shift(x, np.uint64(4), out=t)
+    x += t
+    x &= _M4
+
+    # Add groups of words per byte lane, then all the bytes.
+    n_words = x.shape[-1]
+    group = max(g for g in range(1, _LANE_WORDS + 1) if n_words % g == 0)
+    lanes = x.reshape(x.shape[:-1] + (n_words // group, group))
+    lanes = lanes.sum(axis=-1, dtype=np.uint64)
+    return lanes.view(np.uint8).sum(axis=-1, dtype=np.int64)
+
+
+def packed_distance(
+    query: tuple[np.ndarray, np.ndarray], vector: tuple[np.ndarray, np.ndarray]
+) -> float:
+    "Minimum fractional Hamming distance between the query rotations (R, W) and a vector (W,)."
+    q_codes, q_masks = query
+    y_code, y_mask = vector
+    mask = q_masks & y_mask
+    diff = q_codes ^ y_code
+    diff &= mask
+    return float((_popcount_inplace(diff) / _popcount_inplace(mask)).min())
+
+
+def packed_distance_bounded(
+    query: tuple[np.ndarray, np.ndarray],
+    vector: tuple[np.ndarray, np.ndarray],
+    bound: float,
+    checkpoint: float = 0.9,
+) -> float:
+    """
+    Like packed_distance, but may return any value >= bound once every rotation is
+    proven to be >= bound, for `HNSW(distance_bound_func=...)`.
+
+    All rotations are first evaluated on a checkpoint fraction of the words. A rotation
+    with d differing bits out of m valid bits is then at least d / (m + r), where r counts
+    the valid bits left in the vector. Only the rotations below bound get the rest.
+    """
+    if bound == np.inf:
+        return packed_distance(query, vector)
+    q_codes, q_masks = query
+    y_code, y_mask = vector
+    split = int(q_codes.shape[1] * checkpoint)
+
+    mask = q_masks[:, :split] & y_mask[:split]
+    diff = q_codes[:, :split] ^ y_code[:split]
+    diff &= mask
+    n_diff, n_mask = _popcount_inplace(diff), _popcount_inplace(mask)
+    lower = n_diff / (n_mask + int(popcount(y_mask[split:])))
+    alive = np.flatnonzero(lower < bound)
+    if not len(alive):
+        return float(lower.min())  # Rejected.
+
+    mask = q_masks[alive, split:] & y_mask[split:]
+    diff = q_codes[alive, split:] ^ y_code[split:]
+    diff &= mask
+    n_diff = n_diff[alive] + _popcount_inplace(diff)
+    n_mask = n_mask[alive] + _popcount_inplace(mask)
+    return float((n_diff / n_mask).min())
+
+
+def packed_distances(
+    query: tuple[np.ndarray, np.ndarray], codes: np.ndarray, masks: np.ndarray
+) -> np.ndarray:
+    """
+    Like packed_distance, against each of the rows (N, W) of codes and masks.
+
+    All rotations are compared to a block of rows at once with XOR, AND and popcount,
+    and blocks are sized so that the (R, rows, W) temporaries stay in the CPU cache.
+    """
+    q_codes, q_masks = query
+    n_rotations, n_words = q_codes.shape
+    block = max(1, KERNEL_WORDS // (n_rotations * n_words))
+    out = np.empty(len(codes), dtype=np.float64)
+    for start in range(0, len(codes), block):
+        rows = slice(start, start + block)
+        mask = q_masks[:, None, :] & masks[None, rows, :]
+        diff = q_codes[:, None, :] ^ codes[None, rows, :]
+        diff &= mask
+        n_diff = _popcount_inplace(diff)
+        out[rows] = (n_diff / _popcount_inplace(mask)).min(axis=0)
+    return out
+
+
+class PackedVectorStore:
+    "Contiguous (code, mask) vectors as rows of uint64 words, grown by doubling."
+
+    def __init__(self, n_bits: int, capacity: int = 1024):
+        self.n_bits = n_bits
+        self.n_words = n_words(n_bits)
+        self.size = 0
+        self._codes = np.zeros((capacity, self.n_words), dtype=np.uint64)
+        self._masks = np.zeros((capacity, self.n_words), dtype=np.uint64)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        n_bits: int,
+        codes: np.ndarray,
+        masks: np.ndarray,
+        size: int | None = None,
+    ) -> "PackedVectorStore":
+        """
+        Wrap existing (N, n_words) arrays, such as memory-mapped ones, without copying.
+        The first size rows are used, all of them by default, and the rest is capacity.
+        """
+        store = cls(n_bits, capacity=0)
+        store._codes, store._masks = codes, masks
+        store.size = len(codes) if size is None else size
+        return store
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self._codes[: self.size]
+
+    @property
+    def masks(self) -> np.ndarray:
+        return self._masks[: self.size]
+
+    @property
+    def nbytes(self) -> int:
+        return self._codes.nbytes + self._masks.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return (self._codes[i], self._masks[i])
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield (self._codes[i], self._masks[i])
+
+    def append(self, vec: tuple[np.ndarray | int, np.ndarray | int]):
+        "Append a vector given as words, or as big ints of the `irisint` variant."
+        if self.size == len(self._codes):
+            self._grow(max(1, 2 * self.size))
+        code, mask = vec
+        self._codes[self.size] = self._as_words(code)
+        self._masks[self.size] = self._as_words(mask)
+        self.size += 1
+
+    def keep(self, mask: np.ndarray):
+        "Keep only the vectors where mask is True, in order."
+        self._codes = self.codes[mask]
+        self._masks = self.masks[mask]
+        self.size = len(self._codes)
+
+    def distance_batch(
+        self, query: tuple[np.ndarray, np.ndarray], ids: list[int]
+    ) -> np.ndarray:
+        "Distances from a query to the given rows, for `HNSW(distance_batch_func=...)`."
+        return packed_distances(query, self._codes[ids], self._masks[ids])
+
+    def _as_words(self, x: np.ndarray | int) -> np.ndarray:
+        if isinstance(x, int):
+            return int_to_words(x, self.n_bits)
+        return x
+
+    def _grow(self, capacity: int):
+        for name in ("_codes", "_masks"):
+            old = getattr(self, name)
+            new = np.zeros((capacity, self.n_words), dtype=np.uint64)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
@@ -0,0 +1,96 @@
+from math import prod
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from hnsw import HNSW
+import iris_integration as ii
+
+
+@pytest.fixture(scope="session")
+def arrays() -> tuple[np.ndarray, np.ndarray]:
+    "Random (codes, masks) of 400 templates, some of their bits masked."
+    codes, masks = ii.iris_random_arrays(400, rng=np.random.default_rng(0))
+    masks = np.random.default_rng(1).random(masks.shape) < 0.9
+    return codes, masks
+
+
+@pytest.fixture(scope="session")
+def packed_queries(arrays) -> list:
+    return ii.irispacked_make_queries(*arrays)
+
+
+@pytest.fixture(scope="session")
+def int_queries(arrays) -> list:
+    return ii.irisint_make_queries(*arrays)
+
+
+def packed_kwargs(**kwargs) -> dict:
+    "The kwargs of an irispacked HNSW, with its own store."
+    store = ii.irispacked_store()
+    return (
+        dict(
+            distance_func=ii.irispacked_distance,
+            query_to_vector_func=ii.irispacked_query_to_vector,
+            vector_to_query_func=ii.irispacked_vector_to_query,
+            vector_store=store,
+            distance_batch_func=store.distance_batch,
+        )
+        | kwargs
+    )
+
+
+def int_kwargs(**kwargs) -> dict:
+    "The kwargs of an irisint HNSW."
+    return (
+        dict(
+            distance_func=ii.irisint_distance,
+            query_to_vector_func=ii.irisint_query_to_vector,
+            vector_to_query_func=ii.irisint_vector_to_query,
+            vector_bits=prod(ii.DIM),
+        )
+        | kwargs
+    )
+
+
+# The index params of the tests, but for their own.
+DB_PARAMS = dict(M=8, efConstruction=32, m_L=0.5)
+
+
+def make_db(queries=(), kwargs: dict | None = None, **params) -> HNSW:
+    """
+    A seeded HNSW of DB_PARAMS and params, with the queries inserted. kwargs are the
+    vector kwargs, packed_kwargs() by default.
+    """
+    np.random.seed(0)
+    if kwargs is None:
+        kwargs = packed_kwargs()
+    db = HNSW(**(DB_PARAMS | params), **kwargs)
+    for q in queries:
+        db.insert(q)
+    return db
+
+
+def graph(db) -> tuple:
+    "The layers, entry point and tombstones of db, to compare indexes."
+    return (
+        [layer.to_arrays() for layer in db.layers],
+        list(db.entry_point),
+        sorted(db.deleted),
+        db.db_size(),
+    )
+
+
+def assert_same_graph(a, b):
+    layers_a, *rest_a = graph(a)
+    layers_b, *rest_b = graph(b)
+    assert rest_a == rest_b
+    assert len(layers_a) == len(layers_b)
+    for arrays_a, arrays_b in zip(layers_a, layers_b):
+        assert arrays_a.keys() == arrays_b.keys()
+        for name in arrays_a:
+            np.testing.assert_array_equal(arrays_a[name], arrays_b[name], name)
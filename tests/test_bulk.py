@@ -0,0 +1,63 @@
+import pytest
+
+from conftest import make_db
+from hnsw import HNSW
+from hnsw_bulk import default_n_clusters
+
+
+def build(queries, **params) -> HNSW:
+    db = make_db(**params)
+    assert db.build(queries) == list(range(len(queries)))
+    return db
+
+
+def distance(db: HNSW, x, y) -> float:
+    return db._distance_func(db._vector_to_query_func(db.vectors[x]), db.vectors[y])
+
+
+def test_build_structure(packed_queries):
+    db = build(packed_queries)
+    assert len(db.layers) > 2
+    assert db.entry_point[0] in db.layers[-1]
+    assert len(db.layers[0]) == len(packed_queries)
+    for lc, layer in enumerate(db.layers):
+        for e in layer:
+            dists, ids = db._get_links(e, layer)
+            assert 0 < len(ids) <= layer.max_links
+            assert e not in ids.tolist() and len(set(ids.tolist())) == len(ids)
+            assert all(n in layer for n in ids.tolist())
+            assert list(dists) == sorted(dists)
+            assert dists[0] == pytest.approx(distance(db, e, ids[0]))
+            if lc:
+                assert e in db.layers[lc - 1]
+
+
+def test_build_links_follow_heuristic(packed_queries):
+    db = build(packed_queries, neighbor_heuristic=True)
+    n_checked = 0
+    for lc, layer in enumerate(db.layers):
+        for e in layer:
+            dists, ids = db._get_links(e, layer)
+            for k, (eq, s) in enumerate(zip(dists.tolist(), ids.tolist())):
+                # Nearer to the base than to any link selected before it.
+                assert eq == pytest.approx(distance(db, e, s))
+                assert all(distance(db, prev, s) > eq for prev in ids[:k].tolist())
+                n_checked += lc > 0
+    assert n_checked > 0
+
+
+def test_build_search_finds_targets(arrays, packed_queries):
+    db = build(packed_queries)
+    found = [db.search(q, 1, ef=32)[0][1] for q in packed_queries[:50]]
+    assert found == list(range(50))
+
+
+def test_build_needs_empty_index(packed_queries):
+    db = build(packed_queries[:10])
+    with pytest.raises(ValueError):
+        db.build(packed_queries[10:20])
+
+
+def test_default_clusters_grow_with_size():
+    sizes = [10, 1000, 1500, 3000, 10_000]
+    assert [default_n_clusters(n) for n in sizes] == [3, 3, 4, 5, 6]
@@ -0,0 +1,95 @@
+import threading
+
+import numpy as np
+
+from conftest import int_kwargs, make_db
+from hnsw import HNSW
+import iris_integration as ii
+
+
+def live_links(db: HNSW) -> set:
+    "The nodes linked from the live nodes."
+    return {
+        int(n)
+        for layer in db.layers
+        for e in layer
+        if e not in db.deleted
+        for n in db._get_links(e, layer)[1].tolist()
+    }
+
+
+def test_repair_unlinks_deleted(packed_queries):
+    db = make_db(packed_queries[:150])
+    deleted = set(range(0, 150, 5))
+    for e in deleted:
+        db.delete(e)
+    assert live_links(db) & deleted
+    assert db.repair(max_deleted=10) == len(deleted) - 10
+    assert db.repair() == 0
+    assert not live_links(db) & deleted
+    live = [e for e in range(1, 150, 7) if e not in deleted]
+    assert [db.search(packed_queries[e], 1, ef=32)[0][1] for e in live] == live
+
+
+def test_compact_keeps_results(packed_queries):
+    db = make_db(packed_queries[:150])
+    deleted = set(range(0, 150, 3)) | set(db.entry_point)
+    for e in deleted:
+        db.delete(e)
+    before = [db.search(q, 5, ef=64) for q in packed_queries[150:170]]
+
+    assert db.compact(min_deleted_ratio=0.9) is None
+    new_id = db.compact()
+    assert db.db_size() == len(db.vectors) == 150 - len(deleted)
+    assert [int(new_id[e]) for e in sorted(deleted)] == [-1] * len(deleted)
+    assert not db.deleted
+    for layer in db.layers:
+        for e in layer:
+            assert all(0 <= n < db.db_size() for n in db._get_links(e, layer)[1])
+
+    # The results are kept, renumbered, but for the links that repair changed.
+    after = [db.search(q, 5, ef=64) for q in packed_queries[150:170]]
+    renumbered = [[(d, int(new_id[e])) for d, e in result] for result in before]
+    recall = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(after, renumbered)])
+    assert recall >= 0.9
+    for e, q in enumerate(packed_queries[:150]):
+        if e not in deleted:
+            assert db.search(q, 1, ef=32)[0] == (0.0, int(new_id[e]))
+    db.insert(packed_queries[0])
+    assert db.search(packed_queries[0], 1)[0] == (0.0, db.db_size() - 1)
+
+
+def test_compact_int_vectors(int_queries):
+    db = make_db(int_queries[:40], int_kwargs())
+    db.delete(7)
+    new_id = db.compact(min_deleted_ratio=0)
+    assert db.vectors[6:8] == [
+        ii.irisint_query_to_vector(int_queries[e]) for e in (6, 8)
+    ]
+    assert new_id[8] == 7
+
+
+def test_search_returns_K_despite_tombstones(packed_queries):
+    db = make_db(packed_queries[:250])
+    for e in range(0, 250, 2):
+        db.delete(e)
+    for q in packed_queries[250:270]:
+        result = db.search(q, 10, ef=10)
+        assert len(result) == 10
+        assert not {e for _d, e in result} & db.deleted
+    assert db.search(packed_queries[3], 1, ef=10) == [(0.0, 3)]
+    db.insert(packed_queries[0])
+    assert db.search(packed_queries[0], 1, ef=10) == [(0.0, 250)]
+
+
+def test_compact_waits_for_repair(packed_queries):
+    db = make_db(packed_queries[:100])
+    for e in range(0, 100, 4):
+        db.delete(e)
+    repair = threading.Thread(target=db.repair)
+    with db._maintenance_lock:
+        repair.start()
+        repair.join(0.2)
+        assert repair.is_alive()  # Waits for the lock, as compact would.
+    repair.join()
+    assert db.compact() is not None and db.db_size() == 75
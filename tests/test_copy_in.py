@@ -0,0 +1,88 @@
+import json
+from math import prod
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import assert_same_graph, int_kwargs, make_db
+from hnsw import HNSW
+from hnsw_copy_in import copy_in, copy_in_chunks, copy_in_csv
+import iris_integration as ii
+
+
+def rust_copy_out(db: HNSW, n_bits: int = 64) -> tuple:
+    "The (vectors, links, entries) frames of the Rust copy-out of the graph of db."
+    rng = np.random.default_rng(0)
+    ids = rng.permutation(db.db_size())
+    data = rng.integers(-1, 2, (len(ids), n_bits))
+    vectors = pd.DataFrame(
+        {"id": ids, "point": [{"data": {"data": row.tolist()}} for row in data]}
+    )
+    rows = []
+    for lc, layer in enumerate(db.layers):
+        for e, neighbors in layer.items():
+            # The Rust queue holds [neighbor, distance] pairs, in any order.
+            order = rng.permutation(len(neighbors)).tolist()
+            queue = [[neighbors[i][1], neighbors[i][0]] for i in order]
+            rows.append((lc, e, {"queue": queue}))
+    links = pd.DataFrame(rows, columns=["layer", "source_ref", "links"])
+    entries = pd.DataFrame({"id": db.entry_point})
+    return vectors, links, entries
+
+
+def as_json(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    return df.assign(**{column: df[column].map(json.dumps)})
+
+
+def chunks(df: pd.DataFrame, size: int) -> list:
+    return [df[i : i + size] for i in range(0, len(df), size)]
+
+
+def test_copy_in_paths_agree(tmp_path, int_queries):
+    source = make_db(int_queries[:60], int_kwargs())
+    vectors, links, entries = rust_copy_out(source)
+
+    db = HNSW(M=8)
+    copy_in(db, vectors, links, entries)
+    assert_same_graph(source, db)
+    assert db.n_insertions == 60
+
+    chunked = HNSW(M=8)
+    json_vectors, json_links = as_json(vectors, "point"), as_json(links, "links")
+    copy_in_chunks(chunked, chunks(json_vectors, 7), chunks(json_links, 7), entries)
+
+    paths = [str(tmp_path / f"{name}.csv") for name in ("vectors", "links", "entries")]
+    for df, path in zip((json_vectors, json_links, entries), paths):
+        df.to_csv(path, index=False)
+    from_csv = HNSW(M=8)
+    copy_in_csv(from_csv, *paths, chunksize=7)
+
+    for other in (chunked, from_csv):
+        assert_same_graph(db, other)
+        assert other.vectors == db.vectors
+        assert other.n_insertions == db.n_insertions
+
+
+def test_copy_in_keeps_all_links(int_queries):
+    vectors, links, entries = rust_copy_out(make_db(int_queries[:30], int_kwargs()))
+    with pytest.raises(ValueError, match="M=4"):
+        copy_in(HNSW(M=4), vectors, links, entries)
+    with pytest.raises(ValueError, match="M=4"):
+        copy_in_chunks(HNSW(M=4), [vectors], [links], entries)
+
+
+def test_copy_in_rebuilds_sketches(int_queries):
+    kwargs = int_kwargs(
+        sketch_query_func=ii.irisint_sketch_query,
+        sketch_vector_func=ii.irisint_sketch_vector,
+        sketch_distance_func=ii.irisint_distance,
+    )
+    frames = rust_copy_out(make_db(int_queries[:20], kwargs), n_bits=prod(ii.DIM))
+    db, chunked = HNSW(M=8, **kwargs), HNSW(M=8, **kwargs)
+    copy_in(db, *frames)
+    vectors, links, entries = frames
+    copy_in_chunks(chunked, [vectors[:7], vectors[7:]], [links], entries)
+    for copy in (db, chunked):
+        assert copy.sketches == [ii.irisint_sketch_vector(v) for v in copy.vectors]
+        assert len(copy.search(int_queries[0], 3, sketch=True)) == 3
@@ -0,0 +1,16 @@
+from conftest import make_db, packed_kwargs
+import iris_integration as ii
+
+
+def test_bound_hook_keeps_results(packed_queries):
+    db = make_db(packed_queries[:150])
+    bounded = make_db(
+        packed_queries[:150],
+        packed_kwargs(distance_bound_func=ii.irispacked_distance_bounded),
+    )
+    assert bounded.search(packed_queries[0], 1) == [(0.0, 0)]
+    for q in packed_queries[150:170]:
+        assert bounded.search(q, 5, ef=32) == db.search(q, 5, ef=32)
+    stats = bounded.get_stats()
+    assert 0 < stats["n_rejections"] < stats["n_distances"]
+    assert db.get_stats()["n_rejections"] == 0
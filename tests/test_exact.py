@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import int_kwargs, make_db
+from hnsw import HNSW
+from hnsw_exact import ExactIndex, recall
+import iris_integration as ii
+
+
+def brute_force(db: HNSW, q_vec, K: int) -> list[tuple[float, int]]:
+    dists = [
+        (db._distance_func(q_vec, vec), e)
+        for e, vec in enumerate(db.vectors)
+        if e not in db.deleted
+    ]
+    return sorted(dists)[:K]
+
+
+def assert_same_results(results, truth):
+    for result, expected in zip(results, truth, strict=True):
+        assert [e for _d, e in result] == [e for _d, e in expected]
+        assert [d for d, _e in result] == pytest.approx([d for d, _e in expected])
+
+
+def test_exact_packed(packed_queries):
+    db = make_db(packed_queries[:100])
+    db.delete(5)
+    exact = ExactIndex.from_hnsw(db, chunk_rows=32, workers=2)
+    for q in packed_queries[95:105]:
+        assert_same_results([exact.search(q, 5)], [brute_force(db, q, 5)])
+
+
+def test_exact_int_high_bits(arrays):
+    codes, masks = (x[:30].copy() for x in arrays)
+    # The stored vectors have no high bits, and the queries have them.
+    codes[:, 0], masks[:, 0] = False, False
+    stored = ii.irisint_make_queries(codes, masks)
+    db = HNSW(**int_kwargs())
+    for q in stored:
+        db.insert(q)
+    queries = ii.irisint_make_queries(*(x[30:35] for x in arrays))
+    exact = ExactIndex.from_hnsw(db)
+    results = exact.search_many(queries, 3)
+    truth = [brute_force(db, q, 3) for q in queries]
+    assert_same_results(results, truth)
+    assert recall(results, truth) == 1.0
+
+
+def test_exact_int_needs_width(int_queries):
+    db = HNSW(**int_kwargs(vector_bits=None))
+    db.insert(int_queries[0])
+    with pytest.raises(ValueError, match="n_bits"):
+        ExactIndex.from_hnsw(db)
+    assert len(ExactIndex.from_hnsw(db, n_bits=ii.prod(ii.DIM))) == 1
@@ -0,0 +1,52 @@
+import pytest
+
+from conftest import make_db
+from hnsw import HNSW, identity
+
+
+def int_db(vectors: list[int], **kwargs) -> HNSW:
+    "An index of the ints, with their Hamming distance, and no links."
+    db = HNSW(vector_to_query_func=identity, neighbor_heuristic=True, **kwargs)
+    db.vectors = list(vectors)
+    return db
+
+
+def test_heuristic_needs_vector_to_query():
+    with pytest.raises(ValueError, match="vector_to_query_func"):
+        HNSW(neighbor_heuristic=True)
+
+
+@pytest.mark.parametrize(
+    "M, keep_pruned, expected",
+    [
+        (2, False, [(1, 0), (2, 2)]),
+        (3, False, [(1, 0), (2, 2)]),
+        (3, True, [(1, 0), (2, 1), (2, 2)]),
+    ],
+)
+def test_select_neighbors_heuristic(M, keep_pruned, expected):
+    # From the base 0b0000: 1 is nearer to 0 than to the base, and is pruned.
+    db = int_db([0b0001, 0b0011, 0b1100], keep_pruned_connections=keep_pruned)
+    candidates = [(2, 1), (1, 0), (2, 2)]
+    assert db._select_neighbors_heuristic(candidates, M) == expected
+
+
+def test_extend_candidates():
+    db = int_db([0b0001, 0b0011, 0b1100, 0b0111], extend_candidates=True)
+    db.layers = [{0: [(1, 1)], 1: [(1, 0), (2, 3)], 2: [], 3: [(1, 1)]}]
+    assert db._extend_candidates(0, [(1, 0)], 0) == [(2, 1)]
+    assert db._extend_candidates(0, [(1, 0), (2, 1)], 0) == [(3, 3)]
+    db.delete(3)
+    assert db._extend_candidates(0, [(1, 0), (2, 1)], 0) == []
+
+
+@pytest.mark.parametrize("extend", [False, True])
+@pytest.mark.parametrize("keep_pruned", [False, True])
+def test_insert_with_heuristic(packed_queries, extend, keep_pruned):
+    kwargs = dict(extend_candidates=extend, keep_pruned_connections=keep_pruned)
+    db = make_db(packed_queries[:100], neighbor_heuristic=True, **kwargs)
+    found = [db.search(q, 1, ef=32)[0][1] for q in packed_queries[:100:10]]
+    assert found == list(range(0, 100, 10))
+
+    q = db.insert(packed_queries[100])
+    assert len(db._get_links(q, db.layers[0])[1]) <= db.M
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from conftest import make_db
+from hnsw_instrumentation import Recorder
+
+
+def test_recorder_exports():
+    rec = Recorder(history=3)
+    for n in range(1, 5):  # The first is out of the history.
+        rec.record_layer("search", 0, n, 10 * n, 100 * n)
+        rec.record_layer("search", 1, 1, 2, 3)
+        rec.record_latency("search", n / 1e3)
+    rec.record_layer("insert", 0, 5, 6, 7)
+
+    records = rec.layer_records()
+    assert [(r["op"], r["layer"], r["count"]) for r in records] == [
+        ("insert", 0, 1),
+        ("search", 1, 3),
+        ("search", 0, 3),
+    ]
+    assert records[2]["hops_mean"] == 3.0 and records[2]["distances_p50"] == 30.0
+    assert records[2]["visited_p99"] == pytest.approx(398.0)
+    assert records[1]["hops_p95"] == 1.0
+
+    [latency] = rec.latency_records()
+    assert latency["op"] == "search" and latency["count"] == 4
+    assert latency["mean_ms"] == pytest.approx(3.0)
+    assert latency["p50_ms"] == pytest.approx(3.0)
+    counts, edges = rec.latency_histogram("search", bins=4)
+    assert counts.sum() == 3 and edges[0] == pytest.approx(2.0)
+
+    summary = rec.summary()
+    assert summary["search_p50_ms"] == pytest.approx(3.0)
+    # The totals count all the operations, beyond the history.
+    assert summary["search_hops_per_op"] == (1 + 2 + 3 + 4 + 4) / 4
+    assert summary["search_distances_per_op"] == (100 + 8) / 4
+    assert np.isnan(summary["insert_hops_per_op"])  # No insert latency recorded.
+    assert "insert_p50_ms" not in summary
+
+    rec.reset()
+    assert rec.layer_records() == rec.latency_records() == []
+    assert rec.summary() == {}
+
+
+def test_index_reports_each_layer(packed_queries):
+    rec = Recorder()
+    db = make_db(packed_queries[:100], instrumentation=rec)
+    n_layers = len(db.layers)
+    records = {(r["op"], r["layer"]): r for r in rec.layer_records()}
+    assert records[("insert", 0)]["count"] == 99  # But the first.
+    assert rec.summary().keys() >= {"insert_p99_ms", "insert_hops_per_op"}
+
+    rec.reset()
+    db.reset_stats()
+    for q in packed_queries[100:110]:
+        db.search(q, 5, ef=32)
+    records = rec.layer_records()
+    assert [r["layer"] for r in records] == list(reversed(range(n_layers)))
+    assert all(r["op"] == "search" and r["count"] == 10 for r in records)
+    [latency] = rec.latency_records()
+    assert latency["count"] == 10
+    summary = rec.summary()
+    n_evaluated = db.n_distances + db.n_memo_hits
+    assert summary["search_distances_per_op"] * 10 <= n_evaluated
@@ -0,0 +1,115 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import assert_same_graph
+from hnsw import HNSW, CompactLayer
+from hnsw_list_queues import FurthestQueue
+
+
+@pytest.mark.parametrize("dense", [True, False])
+def test_rows_and_links(dense):
+    layer = CompactLayer(max_links=3, dense=dense)
+    assert len(layer) == 0 and 5 not in layer
+    r = layer.mut_row(5)
+    assert layer.mut_row(5) == r and 5 in layer and len(layer) == 1
+    assert r == (5 if dense else 0)
+    layer.set_links(r, [(0.1, 2), (0.2, 1), (0.3, 4), (0.4, 7)])
+    dists, ids = layer.links(r)
+    assert ids.tolist() == [2, 1, 4] and dists.tolist() == [0.1, 0.2, 0.3]
+
+    layer.add_link(r, 0.2, 0)  # Ties by id, and the furthest drops.
+    assert layer.links(r)[1].tolist() == [2, 0, 1]
+    layer.add_link(r, 0.5, 9)  # Beyond a full row.
+    assert layer.links(r)[1].tolist() == [2, 0, 1]
+
+    for e in (9, 3, 20):
+        layer.mut_row(e)
+    assert sorted(layer) == [3, 5, 9, 20]
+    assert layer.links(layer.row(20))[1].tolist() == []
+    assert layer.links(layer.row(5))[1].tolist() == [2, 0, 1]
+
+
+@pytest.mark.parametrize("dense", [True, False])
+def test_arrays_round_trip(dense):
+    layer = CompactLayer(max_links=2, dense=dense)
+    for e, links in {4: [(0.5, 1)], 1: [(0.5, 4), (0.7, 6)], 6: []}.items():
+        layer.set_links(layer.mut_row(e), links)
+    arrays = layer.to_arrays()
+    assert ("nodes" in arrays) is not dense
+    copy = CompactLayer.from_arrays(**arrays)
+    assert sorted(copy) == sorted(layer) == [1, 4, 6]
+    for e in layer:
+        for a, b in zip(copy.links(copy.row(e)), layer.links(layer.row(e))):
+            np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize("dense", [True, False])
+def test_renumbered(dense):
+    layer = CompactLayer(max_links=3, dense=dense)
+    layer.set_links(layer.mut_row(0), [(0.1, 2), (0.2, 1), (0.3, 3)])
+    layer.set_links(layer.mut_row(2), [(0.1, 0), (0.2, 3)])
+    layer.set_links(layer.mut_row(1), [(0.2, 0)])
+    layer.set_links(layer.mut_row(3), [(0.2, 2)])
+    new_id = np.array([0, -1, 1, 2])
+    renumbered = layer.renumbered(new_id)
+    assert sorted(renumbered) == [0, 1, 2]
+    links = {e: renumbered.links(renumbered.row(e)) for e in renumbered}
+    assert links[0][1].tolist() == [1, 2] and links[0][0].tolist() == [0.1, 0.3]
+    assert links[1][1].tolist() == [0, 2]
+    assert links[2][1].tolist() == [1]
+
+
+def test_mapping_view_and_from_dict():
+    links = {4: [(0.5, 1)], 1: [(0.7, 6), (0.5, 4)], 6: []}
+    layer = CompactLayer.from_dict(links, dense=False, max_links=1)
+    assert layer.max_links == 2  # Wide enough for all the links.
+    assert layer[1] == [(0.5, 4), (0.7, 6)]
+    assert dict(layer.items()) == {e: sorted(n) for e, n in links.items()}
+    assert list(layer.values()) == [[(0.5, 1)], [(0.5, 4), (0.7, 6)], []]
+    assert layer.get(2, []) == []
+    with pytest.raises(KeyError):
+        layer[2]
+    dense = CompactLayer.from_dict(links, dense=True)
+    assert dict(dense) == dict(layer) and dense.rows is None
+
+
+def old_state(db: HNSW) -> dict:
+    "The pickled state of db in the first versions, with dict-of-FurthestQueue layers."
+    names = ["M", "Mmax", "Mmax0", "efConstruction", "m_L", "_distance_func"]
+    names += ["_query_to_vector_func", "vectors", "entry_point", "search_log"]
+    names += ["record_search_log", "n_cmp_per_len", "n_insertions", "stat_time"]
+    state = {name: getattr(db, name) for name in names}
+    layers = [
+        {e: FurthestQueue(links) for e, links in layer.items()} for layer in db.layers
+    ]
+    return state | {"layers": layers}
+
+
+def test_old_pickles_and_dict_layers(monkeypatch):
+    np.random.seed(0)
+    db = HNSW(M=4, efConstruction=16)
+    for x in np.random.randint(0, 1 << 62, 200).tolist():
+        db.insert(x)
+    queries = np.random.randint(0, 1 << 62, 10).tolist()
+    expected = [db.search(q, 5) for q in queries]
+
+    copy = pickle.loads(pickle.dumps(db))
+    assert_same_graph(db, copy)
+    assert [copy.search(q, 5) for q in queries] == expected
+
+    # As pickled then, with the queues of hnsw.py.
+    monkeypatch.setattr(FurthestQueue, "__module__", "hnsw")
+    data = pickle.dumps(old_state(db))
+    monkeypatch.undo()
+    old = HNSW.__new__(HNSW)
+    old.__setstate__(pickle.loads(data))
+    assert_same_graph(db, old)
+    assert [old.search(q, 5) for q in queries] == expected
+    old.insert(queries[0])
+
+    # Dict layers assigned as the copy-in notebook does.
+    copy.layers = [dict(layer.items()) for layer in db.layers]
+    assert_same_graph(db, copy)
+    assert [copy.search(q, 5) for q in queries] == expected
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from iris_pairwise_min_dist_calculation import (
+    get_pairwise_min_dist_across_rotations,
+    get_pairwise_min_dist_across_rotations_tiled,
+    get_pairwise_min_dist_histogram,
+    iter_pairwise_min_dist,
+)
+
+
+def random_matrices(n: int, shape: tuple, seed: int = 0) -> tuple[pd.Series, pd.Series]:
+    rng = np.random.default_rng(seed)
+    codes = list(rng.random((n, *shape)) < 0.5)
+    masks = list(rng.random((n, *shape)) < 0.8)
+    if n > 3:
+        # No valid bit: its distances are NaN.
+        masks[3] = np.zeros(shape, dtype=bool)
+    return pd.Series(codes), pd.Series(masks)
+
+
+@pytest.mark.parametrize(
+    "shape, max_rotation, kwargs",
+    [
+        ((8, 16), 2, {}),
+        ((8, 16), 2, dict(block_rows=3, block_cols=5, workers=2)),
+        # Rotations that wrap around the rows.
+        ((4, 8), 3, dict(block_rows=1, block_cols=1)),
+    ],
+)
+def test_tiled_equals_original(shape, max_rotation, kwargs):
+    codes, masks = random_matrices(23, shape)
+    with np.errstate(invalid="ignore"):
+        expected = get_pairwise_min_dist_across_rotations(codes, masks, max_rotation)
+    tiled = get_pairwise_min_dist_across_rotations_tiled(
+        codes, masks, max_rotation, **kwargs
+    )
+    assert np.isnan(expected).sum() == 22
+    np.testing.assert_array_equal(tiled, expected)
+    segments = iter_pairwise_min_dist(codes, masks, max_rotation, **kwargs)
+    assert sum(len(s) for s in segments) == len(expected)
+
+
+def test_histogram_counts_the_distances():
+    codes, masks = random_matrices(23, (8, 16))
+    with np.errstate(invalid="ignore"):
+        expected = get_pairwise_min_dist_across_rotations(codes, masks, 2)
+    bins = np.linspace(0, 1, 21)
+    counts, edges = get_pairwise_min_dist_histogram(codes, masks, 2, bins=bins)
+    np.testing.assert_array_equal(edges, bins)
+    np.testing.assert_array_equal(counts, np.histogram(expected, bins=bins)[0])
+    assert counts.sum() == len(expected) - 22  # NaNs are not counted.
+    assert len(get_pairwise_min_dist_histogram(codes, masks, 2)[0]) == 100
+
+
+def test_tiled_single_matrix():
+    codes, masks = random_matrices(1, (8, 16))
+    assert len(get_pairwise_min_dist_across_rotations_tiled(codes, masks, 2)) == 0
@@ -0,0 +1,62 @@
+from multiprocessing import shared_memory
+
+import pytest
+
+from conftest import assert_same_graph, int_kwargs, make_db, packed_kwargs
+from hnsw_parallel import SharedArrays
+
+
+def test_insert_many_matches_insert(packed_queries):
+    queries = packed_queries[:120]
+    sequential = make_db(queries)
+    parallel = make_db()
+    # With batches of one, each insert sees all the previous ones.
+    assert parallel.insert_many(queries, workers=2, batch_size=1) == list(range(120))
+    assert_same_graph(sequential, parallel)
+
+
+def test_insert_many_batches_find_targets(packed_queries):
+    db = make_db()
+    db.insert_many(packed_queries[:200], workers=2, batch_size=32)
+    found = [db.search(q, 1, ef=32)[0][1] for q in packed_queries[:200:10]]
+    assert found == list(range(0, 200, 10))
+
+
+@pytest.mark.parametrize("variant", ["packed", "int"])
+def test_search_many_matches_search(variant, packed_queries, int_queries):
+    queries, kwargs = {
+        "packed": (packed_queries, packed_kwargs()),
+        "int": (int_queries[:60], int_kwargs()),
+    }[variant]
+    db = make_db(queries[:-10], kwargs)
+    db.delete(2)
+    expected = [db.search(q, 5, ef=24) for q in queries[-10:]]
+    for workers in (1, 2):
+        results, stats = db.search_many(queries[-10:], 5, ef=24, workers=workers)
+        assert results == expected
+        assert len(stats) == 10
+
+
+def test_share_db_failure_releases_segments(packed_queries, monkeypatch):
+    db = make_db(packed_queries[:60])
+    expected = make_db(packed_queries[:60])
+    names = []
+    create = SharedArrays.create
+
+    def fail_on_layers(self, key, *args, **kwargs):
+        if key == "layer_1_ids":
+            raise OSError("no space left on /dev/shm")
+        array = create(self, key, *args, **kwargs)
+        names.append(self.blocks[key].name)
+        return array
+
+    monkeypatch.setattr(SharedArrays, "create", fail_on_layers)
+    with pytest.raises(OSError):
+        db.insert_many(packed_queries[60:70], workers=2)
+    assert len(names) == 5  # The vectors and layer 0.
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    monkeypatch.undo()
+    assert_same_graph(db, expected)
+    db.insert(packed_queries[60])
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from conftest import assert_same_graph, int_kwargs, make_db, packed_kwargs
+from hnsw import HNSW
+
+
+def make_deleted_db(queries, kwargs: dict | None = None) -> HNSW:
+    db = make_db(queries, kwargs)
+    db.delete(3)
+    return db
+
+
+def search_all(db: HNSW, queries) -> list:
+    return [db.search(q, 5, ef=32) for q in queries]
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip_packed(tmp_path, packed_queries, mmap):
+    db = make_deleted_db(packed_queries[:150])
+    db.save(str(tmp_path / "index"))
+    loaded = HNSW.load(str(tmp_path / "index"), mmap=mmap, **packed_kwargs())
+    assert_same_graph(db, loaded)
+    assert loaded.get_params() == db.get_params()
+    np.testing.assert_array_equal(loaded.vectors.codes, db.vectors.codes)
+    assert search_all(loaded, packed_queries[150:170]) == search_all(
+        db, packed_queries[150:170]
+    )
+    loaded.insert(packed_queries[150])  # The distances use the loaded store.
+    assert loaded.search(packed_queries[150], 1)[0] == (0.0, 150)
+
+
+def test_round_trip_int(tmp_path, int_queries):
+    db = make_deleted_db(int_queries[:40], int_kwargs())
+    db.save(str(tmp_path / "index"))
+    loaded = HNSW.load(str(tmp_path / "index"), **int_kwargs())
+    assert_same_graph(db, loaded)
+    assert loaded.vectors == db.vectors
+    assert loaded.vector_bits == db.vector_bits
+    assert search_all(loaded, int_queries[40:45]) == search_all(db, int_queries[40:45])
+
+
+def test_round_trip_default_ints(tmp_path):
+    np.random.seed(0)
+    db = HNSW(M=4, efConstruction=16)
+    for x in np.random.randint(0, 1 << 62, 50).tolist():
+        db.insert(x)
+    db.save(str(tmp_path / "index"))
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+    loaded = HNSW.load(str(tmp_path / "index"))
+    assert_same_graph(db, loaded)
+    assert loaded.vectors == db.vectors
+    assert loaded.search(db.vectors[7], 3) == db.search(db.vectors[7], 3)
+
+
+def test_save_overwrites(tmp_path, packed_queries):
+    path = str(tmp_path / "index")
+    big = make_deleted_db(packed_queries[:150])
+    big.save(path)
+    db = make_deleted_db(packed_queries[:5])
+    assert len(db.layers) < len(big.layers)
+    db.save(path)
+    layers = {name.split("_")[1] for name in os.listdir(path) if "layer_" in name}
+    assert layers == {str(lc) for lc in range(len(db.layers))}
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+    assert_same_graph(db, HNSW.load(path, **packed_kwargs()))
+
+
+def test_interrupted_save_keeps_previous(tmp_path, packed_queries, monkeypatch):
+    path = str(tmp_path / "index")
+    db = make_deleted_db(packed_queries[:50])
+    db.save(path)
+
+    def fail(path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(db, "_save_files", fail)
+    with pytest.raises(OSError):
+        db.save(path)
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+    assert_same_graph(db, HNSW.load(path, **packed_kwargs()))
+
+    # Interrupted between the renames: the previous index is in path.old.
+    os.replace(path, path + ".old")
+    assert_same_graph(db, HNSW.load(path, **packed_kwargs()))
+    monkeypatch.undo()
+    db.save(path)
+    assert sorted(os.listdir(tmp_path)) == ["index"]
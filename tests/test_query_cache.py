@@ -0,0 +1,62 @@
+from conftest import make_db
+
+
+def searched(db, q, K=5):
+    "The result of one search, and the stats it counted."
+    [result], [stats] = db.search_many([q], K, ef=32)
+    return result, stats | {"n_query_cache_hits": db.n_query_cache_hits}
+
+
+def test_memo_within_a_search(packed_queries):
+    db = make_db(packed_queries[:150])
+    assert len(db.layers) > 1
+    stats = [searched(db, q)[1] for q in packed_queries[150:170]]
+    # The greedy descent evaluates nodes again on the layers below.
+    assert sum(s["n_memo_hits"] for s in stats) > 0
+    assert all(s["n_query_cache_hits"] == 0 for s in stats)
+
+
+def test_repeated_query_hits_cache(packed_queries):
+    db = make_db(packed_queries[:150], query_cache_size=4)
+    uncached = make_db(packed_queries[:150])
+    q = packed_queries[150]
+    first, stats = searched(db, q)
+    assert stats["n_distances"] > 0 and stats["n_query_cache_hits"] == 0
+    assert first == searched(uncached, q)[0]
+
+    again, stats = searched(db, q)
+    assert again == first
+    assert stats["n_distances"] == 0 and stats["n_query_cache_hits"] == 1
+    assert stats["n_memo_hits"] > 0
+
+
+def test_cache_evicts_least_recent(packed_queries):
+    db = make_db(packed_queries[:100], query_cache_size=2)
+    q0, q1, q2 = packed_queries[100:103]
+    for q in (q0, q1, q0, q2):  # q0 is used again, so q1 is evicted by q2.
+        searched(db, q)
+    assert db.n_query_cache_hits == 1 and len(db._query_cache) == 2
+    assert searched(db, q0)[1]["n_distances"] == 0
+    assert searched(db, q1)[1]["n_distances"] > 0
+    assert db.n_query_cache_hits == 2
+
+
+def test_inserts_share_the_cache(packed_queries):
+    db = make_db(packed_queries[:100], query_cache_size=4)
+    db.search(packed_queries[100], 5)
+    db.reset_stats()
+    db.insert(packed_queries[100])
+    assert db.n_query_cache_hits == 1
+
+
+def test_compact_clears_cache(packed_queries):
+    db = make_db(packed_queries[:100], query_cache_size=4)
+    q = packed_queries[100]
+    searched(db, q)
+    for e in range(0, 100, 2):
+        db.delete(e)
+    assert db.compact() is not None
+    assert not db._query_cache
+    result, stats = searched(db, q)
+    assert stats["n_distances"] > 0 and stats["n_query_cache_hits"] == 0
+    assert all(0 <= e < db.db_size() for _d, e in result)
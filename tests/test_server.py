@@ -0,0 +1,94 @@
+import asyncio
+import json
+import pickle
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import make_db
+from hnsw_server import HNSWClient, HNSWServer, _decode, _encode, run_load
+
+
+class Exploit:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Exploit, "ran", True))
+
+
+def test_server_batches_match_search(packed_queries):
+    db = make_db(packed_queries[:100])
+    queries = packed_queries[90:110]
+    expected = [db.search(q, 3, ef=16 + i % 2) for i, q in enumerate(queries)]
+
+    async def run():
+        server = HNSWServer(db, batch_window=0.05)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        client = await HNSWClient.connect(port=port)
+        try:
+            searches = [client.search(q, 3, 16 + i % 2) for i, q in enumerate(queries)]
+            results = await asyncio.gather(
+                *searches, client.search(None, 3, 16), return_exceptions=True
+            )
+        finally:
+            await client.close()
+            await server.close()
+        assert server.executor._shutdown
+        return results, server.metrics()
+
+    results, metrics = asyncio.run(run())
+    # The bad query fails alone, and the others are batched.
+    assert results[:-1] == expected
+    assert isinstance(results[-1], Exception)
+    assert metrics["n_search_batches"] < len(queries)
+
+
+def test_frames_round_trip(packed_queries):
+    message = (
+        3,
+        "search",
+        (packed_queries[0], [(1 << 12799) | 5, -7], {"x": float("inf")}, None),
+    )
+    buffers = []
+    value = _encode(message, buffers, [0])
+    decoded = _decode(json.loads(json.dumps(value)), b"".join(buffers))
+    assert decoded[:2] == message[:2] and decoded[2][1:] == message[2][1:]
+    for a, b in zip(decoded[2][0], packed_queries[0]):
+        np.testing.assert_array_equal(a, b)
+    error = _decode(_encode(KeyError("k"), [], [0]), b"")
+    assert isinstance(error, KeyError)
+    assert isinstance(_decode({"error": ["SystemExit", "no"]}, b""), RuntimeError)
+    with pytest.raises(ValueError):
+        _decode({"array": ["|O", [1], 0]}, b"\0" * 8)
+
+
+def test_server_drops_pickles_and_serializes_inserts(packed_queries):
+    db = make_db(packed_queries[:50])
+
+    async def run():
+        server = HNSWServer(db)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        # A pickle that would run code closes the connection, unread.
+        reader, writer = await asyncio.open_connection(port=port)
+        data = pickle.dumps((0, "search", (Exploit(), 1, None)))
+        writer.write(struct.pack("!II", len(data), 0) + data)
+        assert await reader.read() == b""
+        writer.close()
+
+        client = await HNSWClient.connect(port=port)
+        try:
+            load = await run_load(
+                client, packed_queries[50:70], 40, concurrency=8, insert_every=4
+            )
+        finally:
+            await client.close()
+            await server.close()
+        return load
+
+    run_load_stats = asyncio.run(run())
+    assert run_load_stats["requests_per_sec"] > 0
+    assert not Exploit.ran
+    assert db.db_size() == 60
@@ -0,0 +1,30 @@
+import pytest
+
+from conftest import packed_kwargs
+from hnsw_sharded import ShardedHNSW
+
+
+def test_sharded_search_and_reload(tmp_path, packed_queries):
+    queries = packed_queries[:60]
+    with ShardedHNSW(3, M=8, **packed_kwargs()) as sharded:
+        assert sharded.insert_many(queries) == list(range(60))
+        found = [sharded.search(q, 1)[0][1] for q in queries[::6]]
+        assert found == list(range(0, 60, 6))
+        expected = [sharded.search(q, 5) for q in packed_queries[60:65]]
+        sharded.save(str(tmp_path / "index"))
+    with ShardedHNSW.load(str(tmp_path / "index"), **packed_kwargs()) as loaded:
+        assert len(loaded) == 60
+        assert [loaded.search(q, 5) for q in packed_queries[60:65]] == expected
+
+
+def test_shard_errors_raise_in_parent(tmp_path, packed_queries):
+    with pytest.raises(TypeError, match="no_such_param"):
+        ShardedHNSW(2, no_such_param=1, **packed_kwargs())
+
+    # A shard without its header fails to load.
+    with ShardedHNSW(2, **packed_kwargs()) as sharded:
+        sharded.insert_many(packed_queries[:10])
+        sharded.save(str(tmp_path / "index"))
+    (tmp_path / "index" / "shard_1" / "header.json").unlink()
+    with pytest.raises(FileNotFoundError):
+        ShardedHNSW.load(str(tmp_path / "index"), **packed_kwargs())
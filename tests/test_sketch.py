@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from conftest import int_kwargs, make_db, packed_kwargs
+from hnsw import HNSW
+from hnsw_exact import ExactIndex, recall
+import iris_integration as ii
+
+
+def test_sketch_search_finds_targets(int_queries):
+    kwargs = int_kwargs(
+        sketch_query_func=ii.irisint_sketch_query,
+        sketch_vector_func=ii.irisint_sketch_vector,
+        sketch_distance_func=ii.irisint_distance,
+    )
+    db = make_db(int_queries[:40], kwargs)
+    found = [db.search(q, 1, ef=16, sketch=True)[0] for q in int_queries[:40:8]]
+    assert found == [(0.0, e) for e in range(0, 40, 8)]
+
+    # Against the exact neighbors, not the sketch's own top-K.
+    assert db.sketch_recall(int_queries[:40:8], 1, ef=16) == 1.0
+    exact = ExactIndex.from_hnsw(db).search_many(int_queries[40:50], 5)
+    sketched = [db.search(q, 5, ef=5, sketch=True) for q in int_queries[40:50]]
+    assert db.sketch_recall(int_queries[40:50], 5, ef=5) == recall(sketched, exact)
+
+
+def test_sketch_search_needs_funcs(packed_queries):
+    db = HNSW(sketch_distance_func=ii.irispacked_distance, **packed_kwargs())
+    db.insert(packed_queries[0])
+    with pytest.raises(ValueError, match="sketch_query_func, sketch_vector_func"):
+        db.search(packed_queries[0], 1, sketch=True)
+
+
+def test_packed_queries_max_rot(arrays):
+    codes, masks = arrays
+    queries = ii.irispacked_make_queries(codes[:3], masks[:3], max_rot=2)
+    assert [q[0].shape[0] for q in queries] == [5, 5, 5]
+    full = ii.irispacked_make_queries(codes[:3], masks[:3])
+    for q, f in zip(queries, full):
+        # The middle rotations are the same.
+        np.testing.assert_array_equal(q[0], f[0][ii.MAX_ROT - 2 : ii.MAX_ROT + 3])
+        np.testing.assert_array_equal(q[1], f[1][ii.MAX_ROT - 2 : ii.MAX_ROT + 3])
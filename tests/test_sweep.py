@@ -0,0 +1,54 @@
+import os
+
+import pandas as pd
+import pytest
+
+import hnsw_sweep
+from hnsw_sweep import run_sweep
+
+SWEEP = dict(
+    Ms=[4, 8],
+    efConstructions=[16],
+    efSearches=[8, 16],
+    db_sizes=[20, 40],
+    num_experiments=5,
+    K=5,
+    variant="irispacked",
+    workers=1,
+    log=None,
+)
+
+
+def test_sweep_resumes(tmp_path, monkeypatch):
+    full = run_sweep(str(tmp_path / "full"), **SWEEP)
+    assert len(full) == 2 * 2 * 2
+    indexes = os.listdir(tmp_path / "full" / "indexes" / "M4_efC16")
+    assert indexes == ["size_40"]
+    results = sorted(os.listdir(tmp_path / "full" / "results"))
+    assert results[0] == "M4_efC16_size20" + hnsw_sweep.RESULT_EXT
+
+    # Stop M=8 after saving its last index, before its results. The pool forks, so
+    # the workers see the patch.
+    experiments = hnsw_sweep._experiments
+
+    def stop(db, *args):
+        if args[3] == 8 and db.db_size() == 40:
+            raise RuntimeError("stopped")
+        return experiments(db, *args)
+
+    path = str(tmp_path / "resumed")
+    monkeypatch.setattr(hnsw_sweep, "_experiments", stop)
+    with pytest.raises(RuntimeError, match="stopped"):
+        run_sweep(path, **SWEEP)
+    monkeypatch.undo()
+    assert len(hnsw_sweep.load_results(path)) == 2 * 2 + 2
+
+    logs = []
+    resumed = run_sweep(path, **(SWEEP | {"log": logs.append}))
+    assert logs[0] == "1 of 2 tasks to run."
+    pd.testing.assert_frame_equal(
+        resumed.drop(columns="search_sec"), full.drop(columns="search_sec")
+    )
+
+    with pytest.raises(ValueError, match="different config"):
+        run_sweep(path, **(SWEEP | {"K": 10}))
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+
+from conftest import DB_PARAMS, assert_same_graph, make_db, packed_kwargs
+from hnsw import HNSW
+from hnsw_wal import DurableHNSW
+
+
+def open_wal(path, **kwargs) -> DurableHNSW:
+    return DurableHNSW(str(path), **DB_PARAMS, **packed_kwargs(**kwargs))
+
+
+def test_replay_restores_graph(tmp_path, packed_queries):
+    np.random.seed(0)
+    with open_wal(tmp_path, snapshot_every=25) as wal:
+        wal.insert_many(packed_queries[:40])
+        for q in packed_queries[40:60]:
+            wal.insert(q)
+        wal.delete(3)
+        wal.repair()
+        expected = wal.db
+    with open_wal(tmp_path) as wal:
+        assert wal.seq == 62
+        assert wal.snapshot_seq == 40
+        assert wal.n_replayed == 22
+        assert_same_graph(expected, wal.db)
+
+
+def test_replay_drops_torn_frame(tmp_path, packed_queries):
+    expected = make_db(packed_queries[:20])
+
+    np.random.seed(0)
+    with open_wal(tmp_path, snapshot_every=None) as wal:
+        for q in packed_queries[:20]:
+            wal.insert(q)
+        log_path = wal._log_path(wal.snapshot_seq)
+        size_20 = os.path.getsize(log_path)
+        wal.insert(packed_queries[20])
+    # Tear the last frame, as a crash in the middle of its write.
+    with open(log_path, "r+b") as f:
+        f.truncate(size_20 + (os.path.getsize(log_path) - size_20) // 2)
+
+    np.random.seed(1)
+    with open_wal(tmp_path, snapshot_every=None) as wal:
+        assert wal.n_replayed == 20
+        assert os.path.getsize(log_path) == size_20
+        assert_same_graph(expected, wal.db)
+        # The log goes on after the last whole frame.
+        wal.insert(packed_queries[20])
+        recovered = wal.db
+    with open_wal(tmp_path, snapshot_every=None) as wal:
+        assert wal.n_replayed == 21
+        assert_same_graph(recovered, wal.db)
+
+
+def test_corrupt_frame_ends_log(tmp_path, packed_queries):
+    with open_wal(tmp_path, snapshot_every=None) as wal:
+        wal.insert_many(packed_queries[:10])
+        log_path = wal._log_path(0)
+    with open(log_path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    with open_wal(tmp_path, snapshot_every=None) as wal:
+        assert wal.n_replayed == 9
+        assert len(wal) == 9
+
+
+def test_checkpoint_and_stale_files(tmp_path, packed_queries):
+    with open_wal(tmp_path) as wal:
+        wal.insert_many(packed_queries[:10])
+        wal.checkpoint()
+        expected = wal.db
+    # Leftovers of an interrupted snapshot.
+    HNSW(**packed_kwargs()).save(str(tmp_path / "snapshot_99.tmp"))
+    os.makedirs(tmp_path / "snapshot_99.tmp.old")
+    with open_wal(tmp_path) as wal:
+        assert wal.n_replayed == 0
+        assert_same_graph(expected, wal.db)
+    assert sorted(os.listdir(tmp_path)) == ["log_10.wal", "snapshot_10"]